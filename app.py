@@ -4,12 +4,13 @@
 提供 K 线图、数据表、数据更新页面与 API。
 """
 
+import gzip
 import json
 import os
-import subprocess
 import sys
-import time
+from datetime import datetime, timezone
 
+import numpy as np
 from flask import Flask, render_template, request, jsonify, send_file
 
 # 项目根目录加入 path，保证可 import config 及各模块
@@ -17,14 +18,21 @@ ROOT = os.path.dirname(os.path.abspath(__file__))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from config import SYMBOL_LIST, CONTRACT_MULTI, csv_path
+from config import (META_PATH, OPTIMIZE_TOP, PORTFOLIO_MAX_LEGS, SNAPSHOT_SERVE, SYMBOL_LIST, CONTRACT_MULTI,
+                    WALKFORWARD_TEST_YEARS, WALKFORWARD_TRAIN_YEARS, csv_path)
+from datastore import align_days, data_version, date_to_day, get_bars, symbol_meta
+from jobs import RUNNER
+from resample import TIMEFRAMES, get_resampled
+from snapshot import lookup as snapshot_lookup
+from tableview import COLUMNS as TABLE_COLUMNS, query_page
 
-app = Flask(__name__, static_folder="static", template_folder="templates")
+try:  # 可选：装了 brotli 时对支持的浏览器用 br 压缩，否则 gzip
+    import brotli
+except ImportError:
+    brotli = None
 
-# get_data_meta 内存缓存，减少重复读盘
-_meta_cache = None
-_meta_cache_time = 0
-META_CACHE_TTL = 60  # 秒
+app = Flask(__name__, static_folder="static", template_folder="templates")
+app.config["SNAPSHOT"] = SNAPSHOT_SERVE
 
 
 @app.context_processor
@@ -37,91 +45,197 @@ def inject_meta():
         return {"data_end_date": ""}
 
 
-def load_kline(symbol: str, name: str):
-    """读取某品种 CSV，返回 (dates, k_data, volumes, ma20)。k_data 每项 [open, close, low, high]。"""
-    path = csv_path(symbol, name)
-    if not os.path.exists(path):
+def _kline_lists(bars, ma20=None):
+    """Bars -> (dates, k_data, volumes, ma20) 列表形式，供 JSON 输出。ma20 为空时用 bars.ma20。"""
+    k = np.column_stack([bars.open, bars.close, bars.low, bars.high]).round(2)
+    ma20 = bars.ma20 if ma20 is None else ma20
+    return bars.dates, k.tolist(), bars.volume.tolist(), [None if v != v else v for v in ma20.round(2).tolist()]
+
+
+def load_kline(symbol: str, name: str, calendar: bool = False):
+    """读取某品种 K 线，返回 (dates, k_data, volumes, ma20)。k_data 每项 [open, close, low, high]。
+
+    数据来自进程内共享缓存（datastore），CSV 未变化时不重新解析；返回的列表为共享缓存，调用方勿原地修改。
+    calendar=True 时为日历补全视图（非交易日沿用前一交易日价格、成交量 0），读取时计算，不改写 CSV。
+    """
+    bars = get_bars(symbol, name, calendar)
+    if bars is None or not len(bars):
         return [], [], [], []
-    dates, k_data, volumes, closes = [], [], [], []
-    with open(path, "r", encoding="utf-8-sig") as f:
-        next(f)
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            parts = line.split(",")
-            if len(parts) < 6:
-                continue
-            try:
-                date = parts[0].strip()
-                open_ = float(parts[1])
-                high = float(parts[2])
-                low = float(parts[3])
-                close = float(parts[4])
-                vol = int(float(parts[5]))
-            except (ValueError, TypeError):
-                continue
-            dates.append(date)
-            k_data.append([round(open_, 2), round(close, 2), round(low, 2), round(high, 2)])
-            volumes.append(vol)
-            closes.append(close)
-    ma20 = []
-    for i in range(len(closes)):
-        if i < 19:
-            ma20.append(None)
-        else:
-            ma20.append(round(sum(closes[i - 19 : i + 1]) / 20, 2))
-    return dates, k_data, volumes, ma20
+    return bars.memo("kline_lists", _kline_lists)
 
 
 def get_data_meta():
-    """返回数据元信息：最新日期、各品种条数。带 60 秒内存缓存。任何异常时返回空，避免 500。"""
-    global _meta_cache, _meta_cache_time
-    now = time.time()
-    if _meta_cache is not None and (now - _meta_cache_time) < META_CACHE_TTL:
-        return _meta_cache
+    """返回数据元信息：最新日期、各品种条数。读 meta.json / 文件尾部，不扫描 CSV。任何异常时返回空，避免 500。"""
     try:
         latest = ""
         counts = {}
         for code, name in SYMBOL_LIST:
-            path = csv_path(code, name)
-            if not os.path.exists(path):
+            info = symbol_meta(code, name)
+            if not info or not info["last_date"]:
                 continue
-            n = 0
-            last_date = ""
-            with open(path, "r", encoding="utf-8-sig", errors="ignore") as f:
-                next(f, None)
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    parts = line.split(",")
-                    if len(parts) >= 1:
-                        last_date = parts[0].strip()
-                        n += 1
-            if last_date:
-                counts[name] = n
-                if not latest or last_date > latest:
-                    latest = last_date
-        _meta_cache = {"data_end_date": latest or "", "counts": counts}
-        _meta_cache_time = now
-        return _meta_cache
+            counts[name] = info["rows"]
+            if not latest or info["last_date"] > latest:
+                latest = info["last_date"]
+        return {"data_end_date": latest or "", "counts": counts}
     except Exception:
         return {"data_end_date": "", "counts": {}}
 
 
-def load_table(symbol: str, name: str):
-    """返回表格行列表：每行 [日期, 开, 高, 低, 收, 量, MA20]。"""
-    dates, k_data, volumes, ma20 = load_kline(symbol, name)
-    rows = []
-    for i in range(len(dates)):
-        k = k_data[i]
-        # k: [open, close, low, high] -> 表列：开、高、低、收
-        rows.append([
-            dates[i], k[0], k[3], k[2], k[1], volumes[i],
-            ma20[i] if ma20[i] is not None else ""
-        ])
-    return rows
+# 紧凑格式价格缩放：价格、MA20 已保留两位小数，乘 100 后为整数
+COMPACT_SCALE = 100
+
+
+def _deltas(values: np.ndarray) -> list:
+    """整数序列 -> 首项原值、其余为与前项之差（小整数，JSON 更短、压缩率更高）。"""
+    return np.diff(values, prepend=0).tolist()
+
+
+def compact_kline(bars, ma20) -> dict:
+    """K 线的紧凑列式编码（?format=compact）。bars 为要输出的窗口，ma20 为对应的均线值。
+
+    日期为 base + 逐日差值 dd（首项 0）；开高低收为 ×scale 后的整数再做差分；
+    成交量原样；MA20 为 ×scale 的整数（不足 20 根为 null，不做差分）。kline.html 的 decodeCompact 负责还原。
+    """
+    scaled = [np.rint(np.round(col, 2) * COMPACT_SCALE).astype(np.int64)
+              for col in (bars.open, bars.high, bars.low, bars.close)]
+    ma = ma20.round(2)
+    ma_int = np.rint(np.nan_to_num(ma) * COMPACT_SCALE).astype(np.int64).tolist()
+    return {
+        "format": "compact",
+        "scale": COMPACT_SCALE,
+        "base": bars.dates[0] if len(bars) else None,
+        "dd": np.diff(bars.days, prepend=bars.days[:1]).tolist(),
+        "o": _deltas(scaled[0]),
+        "h": _deltas(scaled[1]),
+        "l": _deltas(scaled[2]),
+        "c": _deltas(scaled[3]),
+        "vol": bars.volume.tolist(),
+        "ma20": [None if m != m else v for m, v in zip(ma.tolist(), ma_int)],
+    }
+
+
+def kline_window(bars, i0: int, i1: int, max_points: int = None):
+    """取 [i0, i1) 窗口，给定 max_points 且超出时降采样（见 downsample）。返回 (Bars, ma20, 每点代表根数)。
+
+    MA20 始终按全历史计算后再截取 / 选点，不受窗口与降采样影响。
+    """
+    w, ma = bars.take(slice(i0, i1)), bars.ma20[i0:i1]
+    if max_points and len(w) > max_points:
+        from downsample import downsample
+        return downsample(w, ma, max_points)
+    return w, ma, 1
+
+
+def _date_range_args():
+    """读取查询参数 ?start=&end=（YYYY-MM-DD，可省略）。格式错误抛 ValueError。"""
+    start = (request.args.get("start") or "").strip() or None
+    end = (request.args.get("end") or "").strip() or None
+    for d in (start, end):
+        if d:
+            date_to_day(d)
+    return start, end
+
+
+def _points_arg():
+    """?max_points=N 或 ?width=像素（约每 2 像素一根）-> 最多返回的点数，未给出时为 None（不降采样）。"""
+    points = request.args.get("max_points", type=int)
+    if points is None:
+        width = request.args.get("width", type=int)
+        points = width // 2 if width else None
+    return max(10, min(5000, points)) if points else None
+
+
+def _calendar_arg() -> bool:
+    """?calendar=1 时返回日历补全视图。"""
+    return request.args.get("calendar", "").lower() in ("1", "true", "yes")
+
+
+# 接口输出格式版本：返回结构变化时递增，使浏览器里旧的 ETag 失效
+API_VERSION = "2"
+# SSE 空闲时发送保活注释的间隔（秒）
+SSE_KEEPALIVE = 15
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_BYTES = 1024
+
+
+def _negotiate_encoding():
+    """按 Accept-Encoding 选择压缩方式：br（需 brotli）> gzip > 不压缩。"""
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compress(resp, encoding):
+    """就地压缩响应体并设置 Content-Encoding。"""
+    data = resp.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return
+    data = brotli.compress(data, quality=5) if encoding == "br" else gzip.compress(data, 6)
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+
+
+def _conditional(paths, max_age: int, build):
+    """条件 GET：由数据文件版本（mtime + size）生成强 ETag 与 Last-Modified，并按 Accept-Encoding 压缩。
+
+    请求的 If-None-Match / If-Modified-Since 命中时直接返回 304，不调用 build（不解析、不编码 JSON）；
+    否则 build() 生成响应。build 返回 (响应, 状态码) 时视为错误，原样返回、不带校验头。
+    不同压缩方式是不同的表示，ETag 带上编码后缀；查询参数不同响应也不同，参数（排序后）计入 ETag。
+    """
+    encoding = _negotiate_encoding()
+    query = sorted(request.args.items(multi=True))
+    tag, modified = data_version(paths, API_VERSION + request.path + repr(query))
+    if encoding:
+        tag = f"{tag}-{encoding}"
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(tag)
+    elif request.if_modified_since is not None:
+        fresh = modified <= request.if_modified_since.timestamp()
+    else:
+        fresh = False
+    if fresh:
+        resp = app.response_class(status=304)
+    else:
+        resp = build()
+        if isinstance(resp, tuple):
+            return resp
+        _compress(resp, encoding)
+    resp.vary.add("Accept-Encoding")
+    resp.set_etag(tag)
+    resp.last_modified = datetime.fromtimestamp(modified, timezone.utc)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return resp
+
+
+@app.before_request
+def serve_snapshot():
+    """快照模式：GET 数据接口命中预生成快照（见 snapshot.py）时直接返回该文件，不读 CSV；未命中交给实时接口。"""
+    if not app.config["SNAPSHOT"] or request.method != "GET" or not request.path.startswith("/api/"):
+        return None
+    hit = snapshot_lookup(request.path, request.args.items(multi=True))
+    if hit is None:
+        return None
+    path, tag = hit
+    gzipped = bool(request.accept_encodings["gzip"])
+    tag = f"{tag}-gzip" if gzipped else tag
+    if request.if_none_match.contains(tag):
+        resp = app.response_class(status=304)
+    else:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        resp = app.response_class(data if gzipped else gzip.decompress(data), mimetype="application/json")
+        if gzipped:
+            resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    resp.set_etag(tag)
+    resp.headers["Cache-Control"] = "public, max-age=60"
+    return resp
 
 
 # ---------- API ----------
@@ -134,79 +248,303 @@ def api_symbols():
 
 @app.route("/api/kline/<code>")
 def api_kline(code):
-    """某品种 K 线数据：{ dates, k, vol, ma20 }。"""
+    """某品种 K 线数据：{ dates, k, vol, ma20 }。可选 ?start=&end= 只返回该日期区间（MA20 按全历史计算），
+    ?calendar=1 返回日历补全视图，?format=compact 返回紧凑列式编码（见 compact_kline）。
+    ?max_points=N 或 ?width=像素 时把区间降采样到不超过 N 点，并附 bucket（每点最多代表的根数）与 range（实际首末日期）。
+    分页（渐进加载）：?limit=N 只取区间内最近 N 根，?before=日期 只取该日之前的；附 has_more（更早是否还有数据）
+    与 cursor（本页首日，作为下一页的 before）。
+    ?tf=W|M|Q 返回周 / 月 / 季 K（由日K合成并缓存，见 resample.py；日期为周期内最后一个交易日，MA20 为 20 根该周期 K 线）。"""
     name_map = {c: n for c, n in SYMBOL_LIST}
     if code not in name_map:
         return jsonify({"error": "未知品种"}), 404
     name = name_map[code]
-    dates, k_data, volumes, ma20 = load_kline(code, name)
-    if not dates:
-        return jsonify({"error": "无数据"}), 404
-    resp = jsonify({
-        "dates": dates,
-        "k": k_data,
-        "vol": volumes,
-        "ma20": [v if v is not None else None for v in ma20],
-    })
-    resp.headers["Cache-Control"] = "public, max-age=60"
-    return resp
+    try:
+        start, end = _date_range_args()
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+    before = (request.args.get("before") or "").strip() or None
+    limit = request.args.get("limit", type=int)
+    try:
+        before_day = date_to_day(before) if before else None
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+    paged = before is not None or limit is not None
+    calendar = _calendar_arg()
+    compact = request.args.get("format") == "compact"
+    max_points = _points_arg()
+    tf = (request.args.get("tf") or "D").upper()
+    if tf not in TIMEFRAMES:
+        return jsonify({"error": "tf 可选: " + "/".join(TIMEFRAMES)}), 400
+    if tf != "D" and calendar:
+        return jsonify({"error": "周期合成基于交易日，不能与 calendar 同时使用"}), 400
+
+    def build():
+        bars = get_resampled(code, name, tf) if tf != "D" else get_bars(code, name, calendar)
+        if bars is None or not len(bars):
+            return jsonify({"error": "无数据"}), 404
+        i0, i1 = bars.locate(start, end)
+        if before_day is not None:
+            i1 = min(i1, int(np.searchsorted(bars.days, before_day, "left")))
+        if limit is not None:
+            i0 = max(i0, i1 - max(0, limit))
+        i0 = min(i0, i1)
+        if not compact and not max_points:
+            dates, k_data, volumes, ma20 = bars.memo("kline_lists", _kline_lists)
+            payload = {
+                "dates": dates[i0:i1],
+                "k": k_data[i0:i1],
+                "vol": volumes[i0:i1],
+                "ma20": ma20[i0:i1],
+            }
+            bucket = 1
+        else:
+            w, ma, bucket = kline_window(bars, i0, i1, max_points)
+            if compact:
+                payload = compact_kline(w, ma)
+            else:
+                payload = dict(zip(("dates", "k", "vol", "ma20"), _kline_lists(w, ma)))
+        if max_points or paged:
+            payload["bucket"] = bucket
+            payload["range"] = [bars.dates[i0], bars.dates[i1 - 1]] if i1 > i0 else []
+        if paged:
+            payload["has_more"] = i0 > 0
+            payload["cursor"] = bars.dates[i0] if i1 > i0 else before
+        return jsonify(payload)
+
+    return _conditional([csv_path(code, name)], 60, build)
+
+
+# 批量 K 线可取的列与一次最多的品种数
+BATCH_FIELDS = ("open", "high", "low", "close", "volume", "ma20")
+BATCH_MAX_CODES = 20
+
+
+def batch_kline(windows, fields, normalize: bool = False):
+    """多品种在共同日期轴上对齐：windows 为 [(Bars, i0, i1), ...]。返回 (dates, [{列名: 值列表}, ...])。
+
+    日期轴为各窗口交易日的并集（datastore.align_days），某品种当日无数据为 None；MA20 按各自全历史计算。
+    normalize 时价格列除以该品种窗口内首个收盘价再乘 100（同一起点比较走势），成交量不变。
+    """
+    axis, index = align_days([bars.days[i0:i1] for bars, i0, i1 in windows])
+    out = []
+    for (bars, i0, _), idx in zip(windows, index):
+        have = (idx >= 0).tolist()
+        src = np.where(idx >= 0, idx, 0) + i0
+        base = float(bars.close[src[idx >= 0][0]]) if normalize and any(have) else None
+        cols = {}
+        for f in fields:
+            values = (bars.ma20 if f == "ma20" else getattr(bars, f))[src]
+            if f != "volume":
+                values = (values / base * 100).round(4) if base else values.round(2)
+            cols[f] = [v if h and v == v else None for v, h in zip(values.tolist(), have)]
+        out.append(cols)
+    return np.datetime_as_string(axis.astype("datetime64[D]"), unit="D").tolist(), out
+
+
+@app.route("/api/kline")
+def api_kline_batch():
+    """多品种 K 线（一次请求）：?codes=C0,CS0,JD0，返回共同日期轴上对齐的序列 { dates, series: [{ code, name, close, ... }] }。
+
+    ?fields=close,volume 选择列（默认 close，可选 open/high/low/close/volume/ma20）；?normalize=1 价格按首日收盘折算为 100；
+    ?start=&end= 日期区间，?calendar=1 日历补全视图。
+    """
+    name_map = dict(SYMBOL_LIST)
+    codes = [c for c in (request.args.get("codes") or "").split(",") if c.strip()]
+    codes = list(dict.fromkeys(c.strip() for c in codes))
+    if not codes:
+        return jsonify({"error": "请用 ?codes= 指定品种，逗号分隔"}), 400
+    if len(codes) > BATCH_MAX_CODES:
+        return jsonify({"error": f"一次最多 {BATCH_MAX_CODES} 个品种"}), 400
+    unknown = [c for c in codes if c not in name_map]
+    if unknown:
+        return jsonify({"error": "未知品种: " + ",".join(unknown)}), 404
+    fields = [f.strip() for f in (request.args.get("fields") or "close").split(",") if f.strip()]
+    if not fields or any(f not in BATCH_FIELDS for f in fields):
+        return jsonify({"error": "fields 可选: " + ",".join(BATCH_FIELDS)}), 400
+    try:
+        start, end = _date_range_args()
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+    calendar = _calendar_arg()
+    normalize = request.args.get("normalize", "").lower() in ("1", "true", "yes")
+
+    def build():
+        found, windows = [], []
+        for code in codes:
+            bars = get_bars(code, name_map[code], calendar)
+            if bars is not None and len(bars):
+                found.append(code)
+                windows.append((bars, *bars.locate(start, end)))
+        dates, cols = batch_kline(windows, fields, normalize)
+        series = [dict(c, code=code, name=name_map[code]) for code, c in zip(found, cols)]
+        return jsonify({"dates": dates, "series": series, "normalized": normalize})
+
+    return _conditional([csv_path(c, name_map[c]) for c in codes], 60, build)
+
+
+def _table_filters(start: str, end: str) -> tuple:
+    """日期区间与 ?min_<列>=&max_<列>= 数值筛选 -> tableview 的 filters。数值格式错误抛 ValueError。"""
+    filters = []
+    if start or end:
+        filters.append(("date", date_to_day(start) if start else None, date_to_day(end) if end else None))
+    for col in TABLE_COLUMNS[1:]:
+        lo, hi = request.args.get("min_" + col, ""), request.args.get("max_" + col, "")
+        if lo.strip() or hi.strip():
+            filters.append((col, float(lo) if lo.strip() else None, float(hi) if hi.strip() else None))
+    return tuple(filters)
 
 
 @app.route("/api/table/<code>")
 def api_table(code):
-    """某品种表格数据（分页）：?page=1&size=100。"""
+    """某品种表格数据（服务端排序、筛选、分页）。
+
+    ?size=100；翻页用 ?after=<游标> / ?before=<游标>（响应里的 next / prev），或 ?page=N 直接跳页。
+    ?sort=date|open|high|low|close|volume|ma20|chg&order=asc|desc；?start=&end= 日期区间，
+    ?min_<列>=&max_<列>= 数值区间（如 min_volume、max_chg）；?calendar=1 日历补全。
+    """
     name_map = {c: n for c, n in SYMBOL_LIST}
     if code not in name_map:
         return jsonify({"error": "未知品种"}), 404
     name = name_map[code]
-    rows = load_table(code, name)
+    try:
+        start, end = _date_range_args()
+        after = (request.args.get("after") or "").strip() or None
+        before = (request.args.get("before") or "").strip() or None
+        for d in (after, before):
+            if d:
+                date_to_day(d)
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+    try:
+        filters = _table_filters(start, end)
+    except ValueError:
+        return jsonify({"error": "筛选值应为数字"}), 400
+    sort = request.args.get("sort", "date")
+    if sort not in TABLE_COLUMNS:
+        return jsonify({"error": "不支持的排序列"}), 400
+    desc = request.args.get("order", "asc").lower() == "desc"
+    calendar = _calendar_arg()
     page = max(1, request.args.get("page", 1, type=int))
     size = max(1, min(500, request.args.get("size", 100, type=int)))
-    total = len(rows)
-    start = (page - 1) * size
-    chunk = rows[start : start + size]
-    resp = jsonify({
-        "total": total,
-        "page": page,
-        "size": size,
-        "rows": chunk,
-    })
-    resp.headers["Cache-Control"] = "public, max-age=30"
-    return resp
+
+    def build():
+        bars = get_bars(code, name, calendar)
+        if bars is None:
+            return jsonify({"total": 0, "offset": 0, "size": size, "rows": [], "prev": None, "next": None})
+        try:
+            result = query_page(bars, size, sort, desc, filters, after, before, page)
+        except LookupError:
+            return jsonify({"error": "游标已失效，请从第一页重新加载"}), 400
+        return jsonify(dict(result, size=size, page=result["offset"] // size + 1, sort=sort,
+                            order="desc" if desc else "asc"))
+
+    return _conditional([csv_path(code, name)], 30, build)
 
 
 @app.route("/api/meta")
 def api_meta():
     """数据元信息：最新日期等。"""
-    resp = jsonify(get_data_meta())
-    resp.headers["Cache-Control"] = "public, max-age=60"
-    return resp
+    paths = [csv_path(code, name) for code, name in SYMBOL_LIST] + [META_PATH]
+    return _conditional(paths, 60, lambda: jsonify(get_data_meta()))
+
+
+def _update_stages(do_export: bool):
+    """数据更新任务的各阶段：补全最新（逐品种上报进度），可选导出 Excel，最后重建静态快照（与 run.py all 一致）。
+    均在后台线程内直接调用。"""
+    names = dict(SYMBOL_LIST)
+
+    def supplement(job):
+        from supplement_futures_akshare import main
+        done = []
+
+        def on_symbol(symbol, result, stat):
+            done.append(symbol)
+            event = {"symbol": symbol, "name": names.get(symbol, symbol), "done": len(done),
+                     "total": len(names), "ok": stat.ok, "seconds": round(stat.seconds, 2)}
+            if not stat.ok:
+                event["error"] = str(stat.error)
+            elif result[1] is None:
+                event["added"] = 0
+            else:
+                event["added"], event["rows"] = result[1][1], result[1][2]
+            job.emit("progress", **event)
+
+        main(on_symbol=on_symbol)
+
+    def export(job):
+        from csv_to_excel_with_chart import main
+        main()
+
+    def snapshot(job):
+        from snapshot import build_snapshot
+        r = build_snapshot()
+        print(f"快照 {r['files']} 个文件，更新 {r['written']} 个")
+
+    stages = [("补全最新数据", supplement)]
+    if do_export:
+        stages.append(("导出 Excel", export))
+    stages.append(("更新静态快照", snapshot))
+    return stages
 
 
 @app.route("/api/update", methods=["POST"])
 def api_update():
-    """执行数据更新：先 supplement，再可选 export。返回 { ok, log }。"""
+    """提交数据更新任务（后台执行：先 supplement，再可选 export，最后重建静态快照），立即返回 { ok, job, events }。
+
+    已有更新在进行时不重复执行，返回该任务（created 为 false）。进度见 /api/jobs/<id>/events（SSE）。
+    """
     if os.environ.get("VERCEL"):
         return jsonify({
             "ok": False,
             "log": "数据更新仅在本地可用。请在本机运行 python app.py 后使用「数据更新」功能；线上环境为只读展示。"
         })
-    do_export = request.json and request.json.get("export") is True
-    try:
-        cmd = [sys.executable, os.path.join(ROOT, "run.py"), "supplement"]
-        out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, encoding="utf-8", timeout=120)
-        log = (out.stdout or "") + (out.stderr or "")
-        if not out.returncode == 0:
-            return jsonify({"ok": False, "log": log or "执行失败"})
-        if do_export:
-            cmd2 = [sys.executable, os.path.join(ROOT, "run.py"), "export"]
-            out2 = subprocess.run(cmd2, cwd=ROOT, capture_output=True, text=True, encoding="utf-8", timeout=60)
-            log += "\n" + (out2.stdout or "") + (out2.stderr or "")
-        return jsonify({"ok": True, "log": log.strip() or "完成"})
-    except subprocess.TimeoutExpired:
-        return jsonify({"ok": False, "log": "执行超时", "error": "执行超时"})
-    except Exception as e:
-        return jsonify({"ok": False, "log": str(e), "error": str(e)})
+    do_export = bool(request.is_json and (request.get_json(silent=True) or {}).get("export") is True)
+    job, created = RUNNER.submit("update", _update_stages(do_export))
+    return jsonify({"ok": True, "job": job.id, "created": created,
+                    "events": f"/api/jobs/{job.id}/events"}), 202
+
+
+@app.route("/api/update")
+def api_update_latest():
+    """最近一次更新任务的状态（没有则 job 为 null），页面刷新后据此重新订阅进度。"""
+    job = RUNNER.latest()
+    return jsonify({"job": job.status() if job else None})
+
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    """任务状态与全部事件。"""
+    job = RUNNER.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(dict(job.status(), events=job.events[:]))
+
+
+@app.route("/api/jobs/<job_id>/events")
+def api_job_events(job_id):
+    """任务事件流（Server-Sent Events）：state / stage / progress / log / done。
+
+    断线重连时浏览器带 Last-Event-ID，从其后的事件继续推送；任务结束后连接关闭。
+    """
+    job = RUNNER.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    after = request.headers.get("Last-Event-ID", type=int) or request.args.get("after", 0, type=int)
+
+    def stream():
+        seq = after
+        while True:
+            events, finished = job.wait_events(seq, SSE_KEEPALIVE)
+            for e in events:
+                seq = e["seq"]
+                yield f"id: {seq}\nevent: {e['type']}\ndata: {json.dumps(e, ensure_ascii=False)}\n\n"
+            if finished and not events:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return app.response_class(stream(), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # ---------- 页面 ----------
@@ -241,67 +579,237 @@ def backtest_page():
     return render_template("backtest.html", symbols=SYMBOL_LIST, strategies=strats)
 
 
+def _backtest_args(body: dict) -> dict:
+    """回测 / 参数扫描共用的请求字段，不合法时抛 ValueError（消息即返回给前端的错误）。"""
+    from backtest import STRATEGIES
+    args = {
+        "symbol": body.get("symbol", "C0"),
+        "strategy": body.get("strategy", "ma_cross"),
+        "start_date": body.get("start_date", ""),
+        "end_date": body.get("end_date", ""),
+        "calendar": bool(body.get("calendar")),
+        "timeframe": str(body.get("timeframe") or "D").upper(),
+    }
+    try:
+        args["capital"] = float(body.get("capital", 100000))
+        args["lots"] = int(body.get("lots", 1))
+        args["commission"] = float(body.get("commission", 5))
+    except (TypeError, ValueError):
+        raise ValueError("资金、手数、手续费须为数字") from None
+
+    if args["strategy"] not in STRATEGIES:
+        raise ValueError("未知策略")
+    if args["timeframe"] not in TIMEFRAMES:
+        raise ValueError("timeframe 可选: " + "/".join(TIMEFRAMES))
+    if args["timeframe"] != "D" and args["calendar"]:
+        raise ValueError("周期合成基于交易日，不能与 calendar 同时使用")
+    name_map = {c: n for c, n in SYMBOL_LIST}
+    if args["symbol"] not in name_map:
+        raise ValueError("未知品种")
+    args["name"] = name_map[args["symbol"]]
+    args["multiplier"] = CONTRACT_MULTI.get(args["symbol"], 10)
+    return args
+
+
+def _coerce_params(params: dict) -> dict:
+    """策略参数转成数字（整数值写成 int），无法转换的保持原样。原地修改并返回。"""
+    for k, v in params.items():
+        try:
+            params[k] = float(v)
+            if params[k] == int(params[k]):
+                params[k] = int(params[k])
+        except (ValueError, TypeError):
+            pass
+    return params
+
+
 @app.route("/api/backtest", methods=["POST"])
 def api_backtest():
-    from backtest import BacktestEngine, STRATEGIES
+    from backtest import BacktestEngine
     body = request.json or {}
-    symbol = body.get("symbol", "C0")
-    strat_key = body.get("strategy", "ma_cross")
-    params = body.get("params", {})
-    start_date = body.get("start_date", "")
-    end_date = body.get("end_date", "")
-    capital = float(body.get("capital", 100000))
-    lots = int(body.get("lots", 1))
-    commission = float(body.get("commission", 5))
-
-    if strat_key not in STRATEGIES:
-        return jsonify({"error": "未知策略"}), 400
-
-    name_map = {c: n for c, n in SYMBOL_LIST}
-    if symbol not in name_map:
-        return jsonify({"error": "未知品种"}), 400
-
-    dates, k_data, volumes, _ = load_kline(symbol, name_map[symbol])
+    try:
+        args = _backtest_args(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    symbol, calendar = args["symbol"], args["calendar"]
+    params = body.get("params")
+    if params is not None and not isinstance(params, dict):
+        return jsonify({"error": 'params 须为 {参数名: 数值}，如 {"period": 20}'}), 400
+    params = dict(params or {})
+
+    dates, k_data, volumes, _ = load_kline(symbol, args["name"], calendar)
     if not dates:
         return jsonify({"error": "无数据"}), 404
 
-    if start_date:
-        idx = next((i for i, d in enumerate(dates) if d >= start_date), 0)
-        dates, k_data, volumes = dates[idx:], k_data[idx:], volumes[idx:]
-    if end_date:
-        idx = next((i for i in range(len(dates) - 1, -1, -1) if dates[i] <= end_date), len(dates) - 1)
-        dates, k_data, volumes = dates[: idx + 1], k_data[: idx + 1], volumes[: idx + 1]
-
-    if len(dates) < 30:
-        return jsonify({"error": "数据不足（至少需要 30 根 K 线）"}), 400
+    try:
+        i0, i1 = get_bars(symbol, args["name"], calendar).locate(args["start_date"] or None,
+                                                                 args["end_date"] or None)
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+    dates, k_data, volumes = dates[i0:i1], k_data[i0:i1], volumes[i0:i1]
 
     opens = [r[0] for r in k_data]
     closes = [r[1] for r in k_data]
     lows = [r[2] for r in k_data]
     highs = [r[3] for r in k_data]
 
-    multi = CONTRACT_MULTI.get(symbol, 10)
-    for k, v in params.items():
-        try:
-            params[k] = float(v)
-            if params[k] == int(params[k]):
-                params[k] = int(params[k])
-        except (ValueError, TypeError):
-            pass
+    _coerce_params(params)
 
-    engine = BacktestEngine(dates, opens, highs, lows, closes, volumes)
-    result = engine.run(strat_key, params, capital=capital, lots=lots,
-                        commission=commission, multiplier=multi)
+    engine = BacktestEngine(dates, opens, highs, lows, closes, volumes, timeframe=args["timeframe"])
+    if engine.n < 30:
+        return jsonify({"error": "数据不足（至少需要 30 根 K 线）"}), 400
+    result = engine.run(args["strategy"], params, capital=args["capital"], lots=args["lots"],
+                        commission=args["commission"], multiplier=args["multiplier"])
 
     kline_out = []
-    for i in range(len(dates)):
+    for i in range(engine.n):
         kline_out.append({
-            "time": dates[i], "open": opens[i], "high": highs[i],
-            "low": lows[i], "close": closes[i],
+            "time": engine.dates[i], "open": engine.opens[i], "high": engine.highs[i],
+            "low": engine.lows[i], "close": engine.closes[i],
         })
     result["kline"] = kline_out
     return jsonify(result)
 
 
+RANGES_ERROR = 'ranges 须为 {参数名: 取值范围}，如 {"period": {"min": 10, "max": 30, "step": 5}}'
+
+
+@app.route("/api/backtest/optimize", methods=["POST"])
+def api_backtest_optimize():
+    """参数扫描。请求体在 /api/backtest 的字段之外（params 不用）：
+    ranges（各参数取值范围，缺省为策略声明的 min / max，格式见 optimize.param_axes）、method（grid / random）、
+    samples、seed、metric（排序指标，默认 total_return）、top、x / y（热力图坐标轴参数）。
+    返回排行 results 与热力图矩阵 heatmap（见 optimize.optimize）。"""
+    from optimize import optimize
+    body = request.json or {}
+    try:
+        top = int(body.get("top") or OPTIMIZE_TOP)
+        samples = int(body["samples"]) if body.get("samples") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "top、samples 须为整数"}), 400
+    if body.get("ranges") is not None and not isinstance(body["ranges"], dict):
+        return jsonify({"error": RANGES_ERROR}), 400
+    try:
+        args = _backtest_args(body)
+        bars = get_bars(args["symbol"], args["name"], args["calendar"])
+        if bars is None or not len(bars):
+            return jsonify({"error": "无数据"}), 404
+        try:
+            i0, i1 = bars.locate(args["start_date"] or None, args["end_date"] or None)
+        except ValueError:
+            return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+        result = optimize(
+            bars.take(slice(i0, i1)), args["strategy"], ranges=body.get("ranges"),
+            method=str(body.get("method") or "grid"), samples=samples, seed=body.get("seed"),
+            metric=str(body.get("metric") or "total_return"), top=top,
+            x=body.get("x"), y=body.get("y"), timeframe=args["timeframe"],
+            capital=args["capital"], lots=args["lots"], commission=args["commission"],
+            multiplier=args["multiplier"])
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    result["symbol"] = args["symbol"]
+    return jsonify(result)
+
+
+@app.route("/api/backtest/walkforward", methods=["POST"])
+def api_backtest_walkforward():
+    """滚动前推。请求体同参数扫描（不用 top / x / y），另有 train_years、test_years（窗口长度，年）与 anchored
+    （训练起点固定为区间开头）。返回各窗口选中的参数与训练 / 测试指标 windows，以及拼接后的样本外
+    metrics / equity / trades / signals 和样本外区间的 kline（见 optimize.walk_forward）。"""
+    from optimize import walk_forward
+    from resample import resample
+    body = request.json or {}
+    try:
+        samples = int(body["samples"]) if body.get("samples") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "samples 须为整数"}), 400
+    if body.get("ranges") is not None and not isinstance(body["ranges"], dict):
+        return jsonify({"error": RANGES_ERROR}), 400
+    try:
+        args = _backtest_args(body)
+        bars = get_bars(args["symbol"], args["name"], args["calendar"])
+        if bars is None or not len(bars):
+            return jsonify({"error": "无数据"}), 404
+        try:
+            i0, i1 = bars.locate(args["start_date"] or None, args["end_date"] or None)
+        except ValueError:
+            return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+        bars = bars.take(slice(i0, i1))
+        result = walk_forward(
+            bars, args["strategy"], ranges=body.get("ranges"),
+            method=str(body.get("method") or "grid"), samples=samples, seed=body.get("seed"),
+            metric=str(body.get("metric") or "total_return"),
+            train_years=body.get("train_years") or WALKFORWARD_TRAIN_YEARS,
+            test_years=body.get("test_years") or WALKFORWARD_TEST_YEARS,
+            anchored=bool(body.get("anchored")), timeframe=args["timeframe"],
+            capital=args["capital"], lots=args["lots"], commission=args["commission"],
+            multiplier=args["multiplier"])
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    bars = resample(bars, args["timeframe"])
+    i0 = bars.locate(result["windows"][0]["test_start"], None)[0]
+    dates = bars.dates
+    result["kline"] = [{"time": dates[i], "open": o, "high": h, "low": lo, "close": c}
+                       for i, o, h, lo, c in zip(range(i0, len(bars)), bars.open[i0:].tolist(),
+                                                 bars.high[i0:].tolist(), bars.low[i0:].tolist(),
+                                                 bars.close[i0:].tolist())]
+    result["symbol"] = args["symbol"]
+    return jsonify(result)
+
+
+@app.route("/api/backtest/portfolio", methods=["POST"])
+def api_backtest_portfolio():
+    """组合回测：多个品种共用一个资金池（见 portfolio.PortfolioEngine）。请求体：
+    legs（[{symbol, strategy, params, lots, weight}, ...]，缺省项取顶层的 strategy / params / lots）或
+    symbols（品种列表，各腿同一策略；都不给时为全部品种）、allocation（fixed / equal / weight）、
+    capital、lots、commission、start_date、end_date、timeframe。
+    返回组合指标 metrics（含 max_exposure：持仓合约价值占权益的最高百分比）、各腿汇总 legs、
+    组合权益 equity、回撤 drawdown 与全部成交 trades。"""
+    from portfolio import PortfolioEngine
+    body = request.json or {}
+    name_map = dict(SYMBOL_LIST)
+    legs = body.get("legs")
+    if legs is None:
+        symbols = body.get("symbols")
+        if symbols is not None and not (isinstance(symbols, list) and all(isinstance(s, str) for s in symbols)):
+            return jsonify({"error": 'symbols 须为品种代码列表，如 ["C0", "CS0"]'}), 400
+        legs = [{"symbol": s} for s in (symbols or list(name_map))]
+    if not isinstance(legs, list) or not all(isinstance(leg, dict) for leg in legs):
+        return jsonify({"error": "legs 须为 [{symbol, strategy, params, ...}, ...]"}), 400
+    if not legs or len(legs) > PORTFOLIO_MAX_LEGS:
+        return jsonify({"error": f"组合须有 1–{PORTFOLIO_MAX_LEGS} 腿"}), 400
+    unknown = sorted({str(leg.get("symbol")) for leg in legs} - set(name_map))
+    if unknown:
+        return jsonify({"error": "未知品种: " + ",".join(unknown)}), 400
+    if any(p is not None and not isinstance(p, dict)
+           for p in [body.get("params")] + [leg.get("params") for leg in legs]):
+        return jsonify({"error": 'params 须为 {参数名: 数值}，如 {"period": 20}'}), 400
+    try:
+        args = _backtest_args(dict(body, symbol=legs[0]["symbol"], calendar=False))
+        default_params = body.get("params") or {}
+        legs = [dict(leg, strategy=leg.get("strategy") or args["strategy"],
+                     params=_coerce_params(dict(leg.get("params") or default_params))) for leg in legs]
+        bars = {}
+        for leg in legs:
+            code = leg["symbol"]
+            if code not in bars:
+                b = get_bars(code, name_map[code])
+                try:
+                    i0, i1 = b.locate(args["start_date"] or None, args["end_date"] or None) if b is not None else (0, 0)
+                except ValueError:
+                    return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+                bars[code] = b.take(slice(i0, i1)) if b is not None else None
+        engine = PortfolioEngine(bars, args["timeframe"])
+        if engine.n < 30:
+            return jsonify({"error": "数据不足（至少需要 30 根 K 线）"}), 400
+        result = engine.run(legs, capital=args["capital"], lots=args["lots"], commission=args["commission"],
+                            allocation=str(body.get("allocation") or "fixed"))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    for leg in result["legs"]:
+        leg["name"] = name_map[leg["symbol"]]
+    return jsonify(result)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -4,110 +4,76 @@
 支持双均线交叉、MACD、布林带突破、KDJ 四种内置策略。
 """
 
-import math
-from datetime import datetime
+import numpy as np
 
-
-# ── 技术指标计算 ──────────────────────────────────────────────
-
-def _sma(arr, period):
-    out = [None] * len(arr)
-    s = 0.0
-    for i, v in enumerate(arr):
-        s += v
-        if i >= period:
-            s -= arr[i - period]
-        if i >= period - 1:
-            out[i] = s / period
-    return out
-
-
-def _ema(arr, period):
-    k = 2.0 / (period + 1)
-    out = [arr[0]]
-    for i in range(1, len(arr)):
-        out.append(arr[i] * k + out[-1] * (1 - k))
-    return out
+from indicators import crosses, ema, rolling_max, rolling_min, rolling_std, sma, smooth, to_signals
+from datastore import dates_to_days
+from resample import TIMEFRAMES, resample_lists
 
 
 # ── 策略信号生成 ──────────────────────────────────────────────
-# 每个策略返回 list[int]，长度等于 K 线数量
+# 每个策略返回 int8 数组，长度等于 K 线数量
 # 1 = 买入信号, -1 = 卖出信号, 0 = 无操作
-
-def strategy_ma_cross(closes, short=5, long=20, **_):
-    ma_s = _sma(closes, short)
-    ma_l = _sma(closes, long)
-    n = len(closes)
-    sig = [0] * n
-    for i in range(1, n):
-        if ma_s[i] is None or ma_l[i] is None or ma_s[i - 1] is None or ma_l[i - 1] is None:
-            continue
-        if ma_s[i - 1] <= ma_l[i - 1] and ma_s[i] > ma_l[i]:
-            sig[i] = 1
-        elif ma_s[i - 1] >= ma_l[i - 1] and ma_s[i] < ma_l[i]:
-            sig[i] = -1
-    return sig
-
-
-def strategy_macd(closes, fast=12, slow=26, signal=9, **_):
-    ef = _ema(closes, fast)
-    es = _ema(closes, slow)
-    dif = [ef[i] - es[i] for i in range(len(closes))]
-    dea = _ema(dif, signal)
-    n = len(closes)
-    sig = [0] * n
-    for i in range(slow, n):
-        if dif[i - 1] <= dea[i - 1] and dif[i] > dea[i]:
-            sig[i] = 1
-        elif dif[i - 1] >= dea[i - 1] and dif[i] < dea[i]:
-            sig[i] = -1
-    return sig
-
-
-def strategy_boll(closes, period=20, mult=2.0, **_):
-    mid = _sma(closes, period)
-    n = len(closes)
-    sig = [0] * n
-    for i in range(1, n):
-        if mid[i] is None or mid[i - 1] is None:
-            continue
-        sq = sum((closes[j] - mid[i]) ** 2 for j in range(i - period + 1, i + 1))
-        std = math.sqrt(sq / period)
-        upper = mid[i] + mult * std
-        lower = mid[i] - mult * std
-        prev_sq = sum((closes[j] - mid[i - 1]) ** 2 for j in range(i - period, i))
-        prev_std = math.sqrt(prev_sq / period)
-        prev_upper = mid[i - 1] + mult * prev_std
-        prev_lower = mid[i - 1] - mult * prev_std
-        if closes[i - 1] <= prev_upper and closes[i] > upper:
-            sig[i] = 1
-        elif closes[i - 1] >= prev_lower and closes[i] < lower:
-            sig[i] = -1
-    return sig
+# 指标与交叉判断均为向量化计算（见 indicators.py），与原逐根循环的信号一致
+# cache 为 dict 时（引擎传入，同一段行情共用）按「指标 + 周期」缓存只依赖收盘价的指标，参数扫描时各组参数复用
+
+def _memo(cache, key, fn):
+    if cache is None:
+        return fn()
+    try:
+        return cache[key]
+    except KeyError:
+        value = cache[key] = fn()
+        return value
+
+
+def strategy_ma_cross(closes, short=5, long=20, cache=None, **_):
+    up, down = crosses(_memo(cache, ("sma", short), lambda: sma(closes, short)),
+                       _memo(cache, ("sma", long), lambda: sma(closes, long)))
+    return to_signals(up, down)
+
+
+def strategy_macd(closes, fast=12, slow=26, signal=9, cache=None, **_):
+    dif = (_memo(cache, ("ema", fast), lambda: ema(closes, fast))
+           - _memo(cache, ("ema", slow), lambda: ema(closes, slow)))
+    dea = ema(dif, signal)
+    up, down = crosses(dif, dea, start=slow)
+    return to_signals(up, down)
+
+
+def strategy_boll(closes, period=20, mult=2.0, cache=None, **_):
+    c = np.asarray(closes, dtype=np.float64)
+    mid = _memo(cache, ("sma", period), lambda: sma(c, period))
+    std = _memo(cache, ("std", period), lambda: rolling_std(c, period))
+    upper = mid + mult * std
+    lower = mid - mult * std
+    up, _ = crosses(c, upper)      # 收盘上破上轨
+    down, _ = crosses(lower, c)    # 收盘下破下轨
+    return to_signals(up, down)
+
+
+def _kd(rsv: np.ndarray, period: int):
+    """K、D 平滑：K = (2·K前 + RSV) / 3，D = (2·D前 + K) / 3，首个完整窗口处置 50。
+    按 RSV·⅓ + K前·⅔ 递归滤波（indicators.smooth），与原公式差在几个 ulp 内，信号相同。"""
+    kv = np.full(len(rsv), 50.0)
+    dv = np.full(len(rsv), 50.0)
+    kv[period:] = smooth(rsv[period:], 1 / 3, 50.0)
+    dv[period:] = smooth(kv[period:], 1 / 3, 50.0)
+    return kv, dv
 
 
 def strategy_kdj(closes, highs, lows, period=9, **_):
-    n = len(closes)
-    sig = [0] * n
-    kv, dv = [50.0] * n, [50.0] * n
-    for i in range(period - 1, n):
-        hi = max(highs[i - period + 1: i + 1])
-        lo = min(lows[i - period + 1: i + 1])
-        rsv = 50.0 if hi == lo else (closes[i] - lo) / (hi - lo) * 100
-        if i == period - 1:
-            kv[i] = 50.0
-            dv[i] = 50.0
-        else:
-            kv[i] = (2 * kv[i - 1] + rsv) / 3
-            dv[i] = (2 * dv[i - 1] + kv[i]) / 3
-    for i in range(period, n):
-        if kv[i - 1] <= dv[i - 1] and kv[i] > dv[i] and kv[i] < 30:
-            sig[i] = 1
-        elif kv[i - 1] >= dv[i - 1] and kv[i] < dv[i] and kv[i] > 70:
-            sig[i] = -1
-    return sig
+    c = np.asarray(closes, dtype=np.float64)
+    hi = rolling_max(highs, period)
+    lo = rolling_min(lows, period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsv = np.where(hi == lo, 50.0, (c - lo) / (hi - lo) * 100)
+    kv, dv = _kd(rsv, period)
+    up, down = crosses(kv, dv, start=period)
+    return to_signals(up & (kv < 30), down & (kv > 70))
 
 
+# params 的 min / max 为可调范围（参数扫描的默认网格）；constraints 为 [(a, b), ...]，表示参数 a 须小于 b
 STRATEGIES = {
     "ma_cross": {
         "name": "双均线交叉",
@@ -117,6 +83,7 @@ STRATEGIES = {
             {"key": "long", "label": "长期周期", "default": 20, "min": 5, "max": 250},
         ],
         "needs_hl": False,
+        "constraints": [("short", "long")],
     },
     "macd": {
         "name": "MACD 金叉死叉",
@@ -127,6 +94,7 @@ STRATEGIES = {
             {"key": "signal", "label": "信号线", "default": 9, "min": 2, "max": 30},
         ],
         "needs_hl": False,
+        "constraints": [("fast", "slow")],
     },
     "boll": {
         "name": "布林带突破",
@@ -150,8 +118,153 @@ STRATEGIES = {
 
 # ── 回测引擎 ──────────────────────────────────────────────────
 
+def _round(x: np.ndarray, ndigits: int = 2) -> np.ndarray:
+    """逐元素保留 ndigits 位小数，结果与 Python round(v, ndigits) 逐位相同（任意形状）。
+
+    np.round 是先乘 10^n 再取整，乘法的舍入误差可能让恰在 5 附近的数落到另一侧；这类位置很少，改用 round 逐个算
+    （容差 |y|·2^-50 为 4–8 个 ulp，宁多勿漏）。
+    """
+    scale = 10.0 ** ndigits
+    y = x * scale
+    out = np.rint(y) / scale
+    for i in np.flatnonzero(np.abs(y - np.floor(y) - 0.5) <= np.abs(y) * 2.0 ** -50).tolist():
+        out.flat[i] = round(float(x.flat[i]), ndigits)
+    return out
+
+
+def simulate(signals, opens, closes, capital=100000, lots=1, commission=5, multiplier=10):
+    """仓位 / 资金模拟内核（只做多，信号出现后的下一根开盘成交，末根的信号不执行，期末持仓按末根收盘平仓）。
+
+    全部为数组运算：先把信号压缩成交替的开 / 平仓事件（空仓时的卖出、持仓时的买入均忽略），
+    事件的现金变动按时间顺序累加（与逐根循环的累加顺序相同），再按每根之前的事件数得出仓位、成本与权益。
+    返回 dict：buys / sells（信号所在根下标）、entry_price / exit_price / pnl（每笔，期末强平的一笔在最后）、
+    equity（逐根权益，未取整）、closed_at_end（是否有期末强平）。
+    """
+    sig = np.asarray(signals)
+    closes = np.asarray(closes, dtype=np.float64)
+    opens = np.asarray(opens, dtype=np.float64)
+    n = len(closes)
+    idx = np.flatnonzero((sig[:n - 1] == 1) | (sig[:n - 1] == -1))
+    s = sig[idx]
+    keep = s != np.concatenate([[-1], s[:-1]])
+    idx, s = idx[keep], s[keep]
+    is_buy = s == 1
+    buys, sells = idx[is_buy], idx[~is_buy]
+    entry_price = opens[buys + 1]
+    exit_price = opens[sells + 1]
+    fee = commission * lots
+    pnl = (exit_price - entry_price[:len(sells)]) * multiplier * lots - fee
+
+    deltas = np.empty(len(idx) + 1)
+    deltas[0] = float(capital)
+    deltas[1:][is_buy] = -fee
+    deltas[1:][~is_buy] = pnl
+    cash_levels = np.cumsum(deltas)
+
+    marks = np.zeros(n, dtype=np.int64)
+    marks[idx] = 1
+    k = np.cumsum(marks)
+    long = (k & 1) == 1
+    cost = entry_price[np.maximum(k - 1, 0) // 2] if len(buys) else np.zeros(n)
+    equity = cash_levels[k] + np.where(long, (closes - cost) * multiplier * lots, 0.0)
+
+    closed_at_end = len(buys) > len(sells)
+    if closed_at_end:
+        last_pnl = (closes[-1] - entry_price[-1]) * multiplier * lots - fee
+        pnl = np.append(pnl, last_pnl)
+        exit_price = np.append(exit_price, closes[-1])
+        equity[-1] = cash_levels[-1] + last_pnl
+    return {"buys": buys, "sells": sells, "entry_price": entry_price, "exit_price": exit_price,
+            "pnl": pnl, "equity": equity, "closed_at_end": closed_at_end}
+
+
+def score_signals(signals, opens, closes, days, metric="total_return", capital=100000, lots=1,
+                  commission=5, multiplier=10, per_year=252) -> np.ndarray:
+    """多组信号（二维，每行一组）在同一段行情上一次算出各组的某项指标，与逐组 run(detail=False) 的该项逐位相同。
+
+    参数扫描 / 滚动前推排序只需要一项指标，这里只算这一项：与 simulate 同一套规则，按列（K 线）向量化、各行同时算。
+    某根之后是否持仓 = 截至该根最近的非零信号是否为买入；开 / 平仓事件为与前一个非零信号不同的信号；
+    现金按根顺序累加（无事件的根加 0，与按事件累加结果相同）。段长至少 2 根。
+    """
+    sig = np.asarray(signals)
+    opens = np.asarray(opens, dtype=np.float64)
+    closes = np.asarray(closes, dtype=np.float64)
+    rows, n = sig.shape
+    fee = commission * lots
+    act = sig[:, :n - 1]
+    cols = np.arange(n - 1, dtype=np.int32)
+    nz = act != 0
+    last = np.maximum.accumulate(np.where(nz, cols, -1), axis=1)
+    long = np.take_along_axis(act, np.maximum(last, 0), axis=1) == 1
+    long &= last >= 0
+    was_long = np.zeros_like(long)
+    was_long[:, 1:] = long[:, :-1]
+    buy = long & ~was_long
+    sell = was_long & ~long
+    open_end = long[:, -1]
+    n_trades = buy.sum(axis=1)
+    if metric == "total_trades":
+        return n_trades
+
+    entry = np.maximum.accumulate(np.where(buy, cols, -1), axis=1)
+    if metric == "avg_holding_days":
+        d = np.asarray(days, dtype=np.int64)
+        hold = np.where(sell, d[1:] - d[np.maximum(entry, 0) + 1], 0).sum(axis=1)
+        hold += np.where(open_end, d[-1] - d[np.maximum(entry[:, -1], 0) + 1], 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _round(np.where(n_trades > 0, hold / np.maximum(n_trades, 1), 0.0), 1)
+
+    cost = opens[np.maximum(entry, 0) + 1]
+    sell_pnl = (opens[1:] - cost) * multiplier * lots - fee
+    last_pnl = (closes[-1] - cost[:, -1]) * multiplier * lots - fee
+
+    if metric in ("win_rate", "profit_factor"):
+        pnl = np.zeros_like(sell_pnl)
+        pnl[sell] = _round(sell_pnl[sell])
+        end_pnl = _round(last_pnl)
+        win = sell & (pnl > 0)
+        end_win = open_end & (end_pnl > 0)
+        if metric == "win_rate":
+            n_wins = win.sum(axis=1) + end_win
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _round(np.where(n_trades > 0, n_wins / np.maximum(n_trades, 1) * 100, 0.0), 1)
+        # 盈亏按时间顺序逐笔累加（cumsum 为顺序累加，与 sum(list) 相同），期末强平的一笔在最后
+        gross_profit = np.cumsum(np.where(win, pnl, 0.0), axis=1)[:, -1]
+        gross_profit = np.where(end_win, gross_profit + end_pnl, gross_profit)
+        gross_loss = np.cumsum(np.where(sell & ~win, pnl, 0.0), axis=1)[:, -1]
+        gross_loss = np.abs(np.where(open_end & ~end_win, gross_loss + end_pnl, gross_loss))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _round(np.where(gross_loss > 0, gross_profit / gross_loss, 999.0))
+
+    deltas = np.where(buy, -fee, np.where(sell, sell_pnl, 0.0))
+    deltas[:, 0] += float(capital)
+    cash = np.cumsum(deltas, axis=1)
+    final = np.where(open_end, cash[:, -1] + last_pnl, cash[:, -1])
+    if metric == "total_return":
+        return _round((_round(final) - capital) / capital * 100)
+    if metric == "annual_return":
+        years = n / per_year
+        return _round(np.array([((f / capital) ** (1 / years) - 1) * 100 if f > 0 else 0
+                                for f in _round(final).tolist()], dtype=np.float64))
+    if metric != "max_drawdown":
+        raise ValueError(f"未知指标: {metric!r}")
+    equity = np.empty((rows, n))
+    equity[:, :n - 1] = cash + np.where(long, (closes[:-1] - cost) * multiplier * lots, 0.0)
+    equity[:, -1] = final
+    values = _round(equity)
+    peak = np.maximum(np.maximum.accumulate(values, axis=1), capital)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dd = np.where(peak != 0, (values - peak) / peak * 100, 0.0).min(axis=1)
+    return _round(np.where(dd < 0, dd, 0.0))
+
+
 class BacktestEngine:
-    def __init__(self, dates, opens, highs, lows, closes, volumes):
+    def __init__(self, dates, opens, highs, lows, closes, volumes, timeframe="D"):
+        """传入日K序列。timeframe 为 W/M/Q 时先合成为周 / 月 / 季 K 再回测，年化收益按该周期每年根数折算。"""
+        if timeframe != "D":
+            dates, opens, highs, lows, closes, volumes = resample_lists(
+                dates, opens, highs, lows, closes, volumes, timeframe)
+        self.timeframe = timeframe
         self.dates = dates
         self.opens = opens
         self.highs = highs
@@ -159,73 +272,90 @@ class BacktestEngine:
         self.closes = closes
         self.volumes = volumes
         self.n = len(dates)
-
-    def run(self, strategy_key, params, capital=100000, lots=1,
-            commission=5, multiplier=10):
+        self._arrays = None
+        self._cache = {}
+
+    @classmethod
+    def from_bars(cls, bars, timeframe="D"):
+        """由 datastore.Bars 构造（数组直接复用，不转列表）。bars 须已是 timeframe 周期（合成由调用方完成）。"""
+        engine = cls.__new__(cls)
+        engine.timeframe = timeframe
+        engine.dates = bars.dates
+        engine.opens, engine.highs, engine.lows = bars.open, bars.high, bars.low
+        engine.closes, engine.volumes = bars.close, bars.volume
+        engine.n = len(bars)
+        engine._arrays = (bars.open, bars.high, bars.low, bars.close, bars.days)
+        engine._cache = {}
+        return engine
+
+    def arrays(self):
+        """(开, 高, 低, 收, 天数) 数组，首次调用时转换，之后复用（参数扫描时每组参数不再重复转换）。"""
+        if self._arrays is None:
+            self._arrays = (np.asarray(self.opens, dtype=np.float64), np.asarray(self.highs, dtype=np.float64),
+                            np.asarray(self.lows, dtype=np.float64), np.asarray(self.closes, dtype=np.float64),
+                            dates_to_days(self.dates))
+        return self._arrays
+
+    def signals(self, strategy_key, params):
+        """某策略某组参数在全序列上的信号。各周期的指标缓存在引擎上，同一引擎的多组参数共用。"""
         cfg = STRATEGIES[strategy_key]
-        fn = cfg["fn"]
         kw = {p["key"]: params.get(p["key"], p["default"]) for p in cfg["params"]}
+        kw["cache"] = self._cache
+        _, highs, lows, closes, _ = self.arrays()
         if cfg["needs_hl"]:
-            kw["highs"] = self.highs
-            kw["lows"] = self.lows
-        signals_raw = fn(self.closes, **kw)
-
-        trades = []
-        signals_out = []
-        equity = []
-        cash = float(capital)
-        pos = 0
-        entry_price = 0.0
-        entry_idx = 0
-        peak = cash
-
-        for i in range(self.n):
-            sig = signals_raw[i]
-            price = self.opens[min(i + 1, self.n - 1)] if i + 1 < self.n else self.closes[i]
-
-            if sig == 1 and pos == 0 and i + 1 < self.n:
-                exec_price = self.opens[i + 1]
-                pos = lots
-                entry_price = exec_price
-                entry_idx = i + 1
-                cash -= commission * lots
-                signals_out.append({
-                    "date": self.dates[i + 1], "action": "buy",
-                    "price": exec_price,
-                })
-            elif sig == -1 and pos > 0 and i + 1 < self.n:
-                exec_price = self.opens[i + 1]
-                pnl = (exec_price - entry_price) * multiplier * pos - commission * pos
-                cash += pnl
-                trades.append(self._trade(entry_idx, i + 1, entry_price, exec_price,
-                                          pnl, capital, multiplier, pos))
-                signals_out.append({
-                    "date": self.dates[i + 1], "action": "sell",
-                    "price": exec_price,
-                })
-                pos = 0
-
-            unrealised = 0.0
-            if pos > 0:
-                unrealised = (self.closes[i] - entry_price) * multiplier * pos
-            eq = cash + unrealised
-            if eq > peak:
-                peak = eq
-            equity.append({"date": self.dates[i], "value": round(eq, 2)})
-
-        if pos > 0:
-            exec_price = self.closes[-1]
-            pnl = (exec_price - entry_price) * multiplier * pos - commission * pos
-            cash += pnl
-            trades.append(self._trade(entry_idx, self.n - 1, entry_price, exec_price,
-                                      pnl, capital, multiplier, pos))
-            signals_out.append({
-                "date": self.dates[-1], "action": "sell",
-                "price": exec_price,
-            })
-            equity[-1]["value"] = round(cash, 2)
-
-        metrics = self._metrics(trades, equity, capital)
+            kw["highs"] = highs
+            kw["lows"] = lows
+        return cfg["fn"](closes, **kw)
+
+    def run(self, strategy_key, params, capital=100000, lots=1,
+            commission=5, multiplier=10, detail=True):
+        """回测。detail=False 时只返回 {"metrics": ...}，不组装权益曲线与成交明细（参数扫描用）。"""
+        return self.run_signals(self.signals(strategy_key, params), capital=capital, lots=lots,
+                                commission=commission, multiplier=multiplier, detail=detail)
+
+    def run_signals(self, signals, start=0, stop=None, capital=100000, lots=1,
+                    commission=5, multiplier=10, detail=True):
+        """以全序列的信号回测 [start, stop) 这一段：段内从空仓起算，段末按收盘平仓。
+
+        各策略的指标只用到当前及之前的 K 线，信号按全序列算一次后切片复用（滚动前推的各窗口共用），
+        与只在该段上重新计算相比多了段前的预热数据，没有未来数据。
+        """
+        stop = self.n if stop is None else stop
+        opens, _, _, closes, days = self.arrays()
+        sim = simulate(np.asarray(signals)[start:stop], opens[start:stop], closes[start:stop],
+                       capital, lots, commission, multiplier)
+        entries = sim["buys"] + 1 + start
+        exits = np.append(sim["sells"] + 1 + start, [stop - 1] if sim["closed_at_end"] else [])
+        exits = exits.astype(np.int64)
+        holding = days[exits] - days[entries]
+        pnl = _round(sim["pnl"])
+        values = _round(sim["equity"])
+        metrics = self._metrics(pnl, holding, values, capital, TIMEFRAMES[self.timeframe])
+        if not detail:
+            return {"metrics": metrics}
+
+        # 以下只在输出边界把数组转成 dict / 列表：取整、日期下标都先按数组算好，逐项只剩组装 dict。
+        # 逐根权益的 dict 是输出格式本身（10 万根约 25ms），完整结果的耗时以它为下限
+        dates = self.dates
+        ei, xi = entries.tolist(), exits.tolist()
+        ep, xp = sim["entry_price"].tolist(), sim["exit_price"].tolist()
+        trades = [{
+            "entry_date": dates[e],
+            "entry_price": a,
+            "exit_date": dates[x],
+            "exit_price": b,
+            "pnl": p,
+            "pnl_pct": q,
+            "holding_days": h,
+        } for e, x, a, b, p, q, h in zip(ei, xi, _round(sim["entry_price"]).tolist(),
+                                          _round(sim["exit_price"]).tolist(), pnl.tolist(),
+                                          _round(sim["pnl"] / capital * 100).tolist(), holding.tolist())]
+
+        # 开 / 平仓交替出现（同一根上先开后平），按笔交错即为时间顺序
+        signals_out = [None] * (len(ei) + len(xi))
+        signals_out[::2] = [{"date": dates[i], "action": "buy", "price": p} for i, p in zip(ei, ep)]
+        signals_out[1::2] = [{"date": dates[i], "action": "sell", "price": p} for i, p in zip(xi, xp)]
+        equity = [{"date": d, "value": v} for d, v in zip(dates[start:stop], values.tolist())]
         return {
             "metrics": metrics,
             "equity": equity,
@@ -233,50 +363,52 @@ class BacktestEngine:
             "signals": signals_out,
         }
 
-    def _trade(self, ei, xi, ep, xp, pnl, cap, multi, lots):
-        d0 = datetime.strptime(self.dates[ei], "%Y-%m-%d")
-        d1 = datetime.strptime(self.dates[xi], "%Y-%m-%d")
-        return {
-            "entry_date": self.dates[ei],
-            "entry_price": round(ep, 2),
-            "exit_date": self.dates[xi],
-            "exit_price": round(xp, 2),
-            "pnl": round(pnl, 2),
-            "pnl_pct": round(pnl / cap * 100, 2),
-            "holding_days": (d1 - d0).days,
-        }
+    def score(self, signals, metric="total_return", start=0, stop=None, capital=100000, lots=1,
+              commission=5, multiplier=10) -> np.ndarray:
+        """多组全序列信号（二维，每行一组）在 [start, stop) 段上的某项指标（见 score_signals），按行分块算以控制内存。"""
+        stop = self.n if stop is None else stop
+        opens, _, _, closes, days = self.arrays()
+        sig = np.asarray(signals)
+        block = max(16, 200_000 // max(stop - start, 1))
+        parts = [score_signals(sig[i:i + block, start:stop], opens[start:stop], closes[start:stop],
+                               days[start:stop], metric, capital, lots, commission, multiplier,
+                               TIMEFRAMES[self.timeframe])
+                 for i in range(0, len(sig), block)]
+        return np.concatenate(parts) if parts else np.zeros(0)
 
     @staticmethod
-    def _metrics(trades, equity, capital):
-        final = equity[-1]["value"] if equity else capital
+    def _metrics(pnl, holding, values, capital, per_year=252):
+        """pnl 为每笔盈亏、values 为逐根权益（均已取两位小数），holding 为每笔持仓天数。回撤的峰值从初始资金起算。"""
+        final = float(values[-1]) if len(values) else capital
         total_ret = (final - capital) / capital * 100
-        days = len(equity)
-        years = days / 252 if days > 0 else 1
+        days = len(values)
+        years = days / per_year if days > 0 else 1
         annual_ret = ((final / capital) ** (1 / years) - 1) * 100 if years > 0 and final > 0 else 0
 
-        peak = capital
-        max_dd = 0.0
-        for e in equity:
-            if e["value"] > peak:
-                peak = e["value"]
-            dd = (e["value"] - peak) / peak * 100 if peak else 0
-            if dd < max_dd:
+        max_dd = 0
+        if len(values):
+            peak = np.maximum(np.maximum.accumulate(values), capital)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                dd = float(np.where(peak != 0, (values - peak) / peak * 100, 0.0).min())
+            if dd < 0:
                 max_dd = dd
 
-        wins = [t for t in trades if t["pnl"] > 0]
-        losses = [t for t in trades if t["pnl"] <= 0]
-        win_rate = len(wins) / len(trades) * 100 if trades else 0
-        gross_profit = sum(t["pnl"] for t in wins) if wins else 0
-        gross_loss = abs(sum(t["pnl"] for t in losses)) if losses else 0
+        n_trades = len(pnl)
+        p = pnl.tolist()
+        wins = [v for v in p if v > 0]
+        losses = [v for v in p if v <= 0]
+        win_rate = len(wins) / n_trades * 100 if n_trades else 0
+        gross_profit = sum(wins) if wins else 0
+        gross_loss = abs(sum(losses)) if losses else 0
         profit_factor = round(gross_profit / gross_loss, 2) if gross_loss > 0 else 999.0
-        avg_hold = sum(t["holding_days"] for t in trades) / len(trades) if trades else 0
+        avg_hold = int(holding.sum()) / n_trades if n_trades else 0
 
         return {
             "total_return": round(total_ret, 2),
             "annual_return": round(annual_ret, 2),
             "max_drawdown": round(max_dd, 2),
             "win_rate": round(win_rate, 1),
-            "total_trades": len(trades),
+            "total_trades": n_trades,
             "profit_factor": profit_factor,
             "avg_holding_days": round(avg_hold, 1),
         }
@@ -9,6 +9,9 @@ import os
 # 数据目录（CSV 存放）
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
+# 各品种元信息（条数、首末日期、校验和），由更新流程维护，网页读取它而不扫描 CSV
+META_PATH = os.path.join(DATA_DIR, "meta.json")
+
 # 品种：代码 -> (中文名, 可选说明，供爬虫提示用)
 SYMBOLS = {
     "C0": ("玉米", "大商所，约2004年恢复上市"),
@@ -26,9 +29,50 @@ CONTRACT_MULTI = {"C0": 10, "CS0": 10, "JD0": 10}
 CUTOFF_DATE = "2024-07-17"
 SUPPLEMENT_START_DATE = "2024-07-18"
 
+# 多品种并发拉取：线程数、限速（每秒请求数）、失败重试次数
+FETCH_WORKERS = 8
+FETCH_RATE = 5.0
+FETCH_RETRIES = 3
+
+# 拉取响应的本地缓存：目录、有效期（秒）、模式。环境变量 FDS_FETCH_CACHE=replay 时只读缓存离线运行，=off 时不用缓存
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "fetch")
+FETCH_CACHE_TTL = 3600
+FETCH_CACHE_MODE = os.environ.get("FDS_FETCH_CACHE", "")
+
+# 数据表：每个品种（每个数据版本）最多缓存的排序 / 筛选视图数
+TABLE_VIEW_CACHE = 16
+
+# 静态快照：预先生成的 gzip JSON（run.py snapshot），快照模式下接口直接返回这些文件。
+# FDS_SNAPSHOT=1 开启、=0 关闭；未设置时在 Vercel 上默认开启
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "snapshot")
+SNAPSHOT_SERVE = os.environ.get("FDS_SNAPSHOT", "1" if os.environ.get("VERCEL") else "") == "1"
+# 快照里预生成的数据表每页行数与 K 线首屏根数（与 data.html / kline.html 的默认值一致）
+SNAPSHOT_TABLE_SIZE = 100
+SNAPSHOT_KLINE_PAGE = 260
+
+# 回测参数扫描：进程数（0 为 CPU 核数）、网格组合数上限、随机抽样默认组数、返回的排行条数；
+# 组合数少于 OPTIMIZE_POOL_MIN 时在当前进程内直接算（起进程池不划算）
+# Vercel / Lambda 等无服务器环境没有 /dev/shm、不能开进程池，默认为 1（当前进程内算）
+OPTIMIZE_WORKERS = int(os.environ.get("FDS_OPTIMIZE_WORKERS",
+                                      "1" if os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "0"))
+OPTIMIZE_MAX_COMBOS = 200000
+OPTIMIZE_SAMPLES = 500
+OPTIMIZE_TOP = 20
+OPTIMIZE_POOL_MIN = 200
+
+# 滚动前推：默认训练 / 测试窗口长度（年，按周期的每年根数折算）；全部参数组的信号矩阵（组数 × 根数，int8）的内存上限
+WALKFORWARD_TRAIN_YEARS = 3.0
+WALKFORWARD_TEST_YEARS = 1.0
+WALKFORWARD_MAX_SIGNAL_BYTES = 512 * 1024 * 1024
+
+# 组合回测：一次最多的腿数
+PORTFOLIO_MAX_LEGS = 50
+
 # 导出的 Excel 文件名（不含路径）
 OUT_EXCEL = "期货日K线_带图.xlsx"
 OUT_EXCEL_ALT = "期货日K线_带图_新.xlsx"
+# 导出清单：记录上次导出时各 CSV 的校验和，全部未变化时跳过重新生成
+EXPORT_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "export.json")
 
 # CSV 表头（与各脚本读写一致）
 CSV_HEADER = "日期,开盘(元/吨),最高(元/吨),最低(元/吨),收盘(元/吨),成交量(手)\n"
@@ -37,3 +81,8 @@ CSV_HEADER = "日期,开盘(元/吨),最高(元/吨),最低(元/吨),收盘(元/
 def csv_path(symbol: str, name: str) -> str:
     """某品种历史日K的 CSV 路径。"""
     return os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K.csv")
+
+
+def bars_path(symbol: str, name: str) -> str:
+    """某品种二进制列式缓存（由 CSV 生成，可内存映射）的路径。"""
+    return os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K.bars")
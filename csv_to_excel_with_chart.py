@@ -2,104 +2,123 @@
 """
 把 data/ 下的 CSV 转成带 K 线图 + MA20 的 Excel，同一文件里既有数据表又有图。
 用 Excel / WPS 打开 xlsx 即可，不依赖 HTML。
+按行流式写出（openpyxl write-only），源 CSV 均未变化时跳过重新生成。
 """
 
+import json
 import os
+
 from openpyxl import Workbook
 from openpyxl.chart import StockChart, LineChart, Reference
 from openpyxl.chart.axis import ChartLines
 
-from config import OUT_EXCEL, OUT_EXCEL_ALT, SYMBOL_LIST as SYMBOLS, csv_path
-
-
-def load_csv(symbol: str, name: str) -> list:
-    path = csv_path(symbol, name)
-    if not os.path.exists(path):
-        return []
-    rows = []
-    with open(path, "r", encoding="utf-8-sig") as f:
-        next(f)
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            parts = line.split(",")
-            if len(parts) < 6:
-                continue
-            try:
-                date = parts[0].strip()
-                open_ = float(parts[1])
-                high = float(parts[2])
-                low = float(parts[3])
-                close = float(parts[4])
-                vol = int(float(parts[5]))
-            except (ValueError, TypeError):
-                continue
-            rows.append((date, open_, high, low, close, vol))
-    return rows
-
-
-def add_ma20(rows: list) -> list:
-    """每行增加 MA20 列；不足 20 行为空。"""
-    out = []
-    closes = [r[4] for r in rows]
-    for i, r in enumerate(rows):
-        if i < 19:
-            ma = None
-        else:
-            ma = round(sum(closes[i - 19 : i + 1]) / 20, 2)
-        out.append((*r, ma))
-    return out
-
-
-def main():
-    wb = Workbook()
-    wb.remove(wb.active)
+from config import EXPORT_MANIFEST, OUT_EXCEL, OUT_EXCEL_ALT, SYMBOL_LIST as SYMBOLS, csv_path
+from datastore import file_crc32, load_bars, publish_file
+
+# 表头：日期, 开盘(元/吨), 最高, 最低, 收盘, 成交量, MA20
+HEADERS = ("日期", "开盘(元/吨)", "最高(元/吨)", "最低(元/吨)", "收盘(元/吨)", "成交量(手)", "MA20")
+# 导出版式版本：表格 / 图表布局变化时递增，使旧清单失效
+EXPORT_VERSION = 1
+
+
+def _sheet_rows(bars):
+    """逐行产出 (日期, 开, 高, 低, 收, 量, MA20)，供流式写入。"""
+    ma = bars.ma20.round(2).tolist()
+    cols = zip(bars.dates, bars.open.tolist(), bars.high.tolist(), bars.low.tolist(),
+               bars.close.tolist(), bars.volume.tolist(), ma)
+    for d, o, h, lo, c, v, m in cols:
+        yield d, o, h, lo, c, v, None if m != m else m
+
+
+def _add_charts(ws, name: str, n: int):
+    """在数据表右侧加 K 线图（高-低-收）与下方的 MA20 折线图。n 为含表头的行数。"""
+    row_start, row_end = 2, n
+    # K 线（高-低-收）A=日期 B=开 C=高 D=低 E=收 F=量 G=MA20
+    c1 = StockChart()
+    labels = Reference(ws, min_col=1, min_row=row_start, max_row=row_end)
+    data_ref = Reference(ws, min_col=3, max_col=5, min_row=1, max_row=row_end)
+    c1.add_data(data_ref, titles_from_data=True)
+    c1.set_categories(labels)
+    c1.hiLowLines = ChartLines()
+    c1.title = f"{name} 日K（高-低-收）+ MA20"
+    c1.width = 18
+    c1.height = 12
+    ws.add_chart(c1, "H2")
+    # MA20 折线图（放在 K 线图下方，同一列）
+    c2 = LineChart()
+    c2.title = "MA20"
+    ma_ref = Reference(ws, min_col=7, min_row=1, max_row=row_end)
+    c2.add_data(ma_ref, titles_from_data=True)
+    c2.set_categories(labels)
+    c2.width = 18
+    c2.height = 6
+    ws.add_chart(c2, "H16")
+
+
+def source_manifest() -> dict:
+    """当前各品种 CSV 的校验和清单（连同导出版式版本），用于判断是否需要重新导出。"""
+    sources = {}
     for symbol, name in SYMBOLS:
-        data = add_ma20(load_csv(symbol, name))
-        if len(data) < 2:
+        path = csv_path(symbol, name)
+        if os.path.exists(path):
+            sources[symbol] = {"crc32": file_crc32(path), "size": os.path.getsize(path)}
+    return {"version": EXPORT_VERSION, "sources": sources}
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(EXPORT_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_workbook(path: str) -> int:
+    """流式生成工作簿（write-only：行写出即落到临时文件，内存不随品种数与行数增长）。返回工作表数。"""
+    wb = Workbook(write_only=True)
+    count = 0
+    for symbol, name in SYMBOLS:
+        bars = load_bars(symbol, name)
+        if bars is None or len(bars) < 2:
             continue
-        ws = wb.create_sheet(title=name[:6], index=len(wb.worksheets))
-        # 表头：日期, 开盘(元/吨), 最高, 最低, 收盘, 成交量, MA20
-        headers = ("日期", "开盘(元/吨)", "最高(元/吨)", "最低(元/吨)", "收盘(元/吨)", "成交量(手)", "MA20")
-        for c, h in enumerate(headers, 1):
-            ws.cell(row=1, column=c, value=h)
-        for r, row in enumerate(data, 2):
-            for c, val in enumerate(row, 1):
-                ws.cell(row=r, column=c, value=val)
-        n = len(data) + 1
-        row_start, row_end = 2, n
-        # K 线（高-低-收）A=日期 B=开 C=高 D=低 E=收 F=量 G=MA20
-        c1 = StockChart()
-        labels = Reference(ws, min_col=1, min_row=row_start, max_row=row_end)
-        data_ref = Reference(ws, min_col=3, max_col=5, min_row=1, max_row=row_end)
-        c1.add_data(data_ref, titles_from_data=True)
-        c1.set_categories(labels)
-        c1.hiLowLines = ChartLines()
-        c1.title = f"{name} 日K（高-低-收）+ MA20"
-        c1.width = 18
-        c1.height = 12
-        ws.add_chart(c1, "H2")
-        # MA20 折线图（放在 K 线图下方，同一列）
-        c2 = LineChart()
-        c2.title = "MA20"
-        ma_ref = Reference(ws, min_col=7, min_row=1, max_row=row_end)
-        c2.add_data(ma_ref, titles_from_data=True)
-        c2.set_categories(labels)
-        c2.width = 18
-        c2.height = 6
-        ws.add_chart(c2, "H16")
-    if not wb.worksheets:
-        print("未找到任何 CSV 数据")
+        ws = wb.create_sheet(title=name[:6])
+        ws.append(HEADERS)
+        for row in _sheet_rows(bars):
+            ws.append(row)
+        _add_charts(ws, name, len(bars) + 1)
+        count += 1
+    if count:
+        wb.save(path)
+    return count
+
+
+def main(force: bool = False):
+    """导出 Excel。各 CSV 校验和与上次导出一致且输出文件仍在时跳过；force=True 强制重建。"""
+    base = os.path.dirname(os.path.abspath(__file__))
+    manifest = source_manifest()
+    last = _load_manifest()
+    out_path = last.get("output") or os.path.join(base, OUT_EXCEL)
+    if not force and os.path.exists(out_path) and {k: last.get(k) for k in manifest} == manifest:
+        print(f"各品种 CSV 未变化，跳过导出: {out_path}")
         return
-    base = os.path.dirname(__file__)
-    out_path = os.path.join(base, OUT_EXCEL)
+    tmp = os.path.join(base, f".{OUT_EXCEL}.{os.getpid()}.tmp")
     try:
-        wb.save(out_path)
-    except PermissionError:
-        out_path = os.path.join(base, OUT_EXCEL_ALT)
-        wb.save(out_path)
-        print(f"原文件可能被占用，已另存为: {OUT_EXCEL_ALT}")
+        if not build_workbook(tmp):
+            print("未找到任何 CSV 数据")
+            return
+        out_path = os.path.join(base, OUT_EXCEL)
+        try:
+            os.replace(tmp, out_path)
+        except PermissionError:
+            out_path = os.path.join(base, OUT_EXCEL_ALT)
+            os.replace(tmp, out_path)
+            print(f"原文件可能被占用，已另存为: {OUT_EXCEL_ALT}")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    os.makedirs(os.path.dirname(EXPORT_MANIFEST), exist_ok=True)
+    publish_file(EXPORT_MANIFEST, json.dumps(dict(manifest, output=out_path), ensure_ascii=False,
+                                             indent=1).encode("utf-8"))
     print(f"已生成: {out_path}")
     print("用 Excel 或 WPS 打开，每张表左侧为完整数据表（含 MA20 列），右侧为 K 线图 + MA20 线。")
 
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 数据访问层
+进程内共享的行情缓存：每个品种的 CSV 只解析一次，以列式数组常驻内存，
+文件 mtime/size 变化后才重新加载。Web、回测等模块统一从这里取数。
+CSV 旁可生成二进制列式缓存（.bars），冷启动时直接内存映射，无需解析文本。
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import warnings
+import zlib
+
+import numpy as np
+
+from config import META_PATH, SYMBOL_LIST, bars_path, csv_path
+
+
+class Bars:
+    """单品种日K的列式数据（只读），按日期升序。
+
+    days 为 1970-01-01 起的天数（int32），open/high/low/close 为 float64，volume 为 int64。
+    派生结果（日期字符串、MA20、接口输出等）按需计算并缓存在实例上，数据版本变化时随实例一起丢弃。
+    """
+
+    __slots__ = ("days", "open", "high", "low", "close", "volume", "_memo")
+
+    def __init__(self, days, open_, high, low, close, volume):
+        self.days = np.asarray(days, dtype=np.int32)
+        self.open = np.asarray(open_, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.int64)
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    def locate(self, start: str = None, end: str = None):
+        """日期区间 [start, end]（YYYY-MM-DD，可为空）对应的下标范围 (i0, i1)，二分查找，O(log n)。"""
+        i0 = int(np.searchsorted(self.days, date_to_day(start), "left")) if start else 0
+        i1 = int(np.searchsorted(self.days, date_to_day(end), "right")) if end else len(self.days)
+        return i0, max(i0, i1)
+
+    def take(self, index) -> "Bars":
+        """按下标 / 切片 / 布尔掩码取子集，返回新的 Bars。"""
+        return Bars(self.days[index], self.open[index], self.high[index], self.low[index],
+                    self.close[index], self.volume[index])
+
+    def memo(self, key, fn):
+        """返回 key 对应的派生结果，首次调用时用 fn(self) 计算。"""
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = fn(self)
+            return value
+
+    @property
+    def dates(self) -> list:
+        """日期字符串列表 YYYY-MM-DD。"""
+        return self.memo("dates", lambda b: np.datetime_as_string(
+            b.days.astype("datetime64[D]"), unit="D").tolist())
+
+    @property
+    def ma20(self) -> np.ndarray:
+        """20 日收盘均线，不足 20 根为 NaN。"""
+        return self.memo("ma20", lambda b: rolling_mean(b.close, 20))
+
+    @property
+    def calendar(self) -> "Bars":
+        """日历补全视图（见 calendar_fill），按需计算并缓存，不改写存储。"""
+        return self.memo("calendar", calendar_fill)
+
+
+def calendar_fill(bars: Bars) -> Bars:
+    """首末交易日之间每个自然日一根：非交易日（周末、节假日）沿用前一交易日的开高低收，成交量为 0。
+
+    与原 fill_all_dates 改写 CSV 的结果一致，但只在读取时由交易日数组一次 searchsorted 得出。
+    """
+    if len(bars) < 2:
+        return bars
+    days = np.arange(bars.days[0], bars.days[-1] + 1, dtype=np.int32)
+    src = np.searchsorted(bars.days, days, "right") - 1
+    volume = np.where(bars.days[src] == days, bars.volume[src], 0)
+    return Bars(days, bars.open[src], bars.high[src], bars.low[src], bars.close[src], volume)
+
+
+def align_days(days_list):
+    """多个升序天数数组的共同日期轴（排序合并取并集），及各数组行在轴上的位置映射。
+
+    返回 (axis, [index, ...])：index[j] 为 axis[j] 在该数组中的下标，当日无数据为 -1。
+    全程为向量化的排序 / 二分，不逐日查字典，品种数与行数增加时仍为一次遍历量级。
+    """
+    if not days_list:
+        return np.empty(0, dtype=np.int32), []
+    axis = np.unique(np.concatenate(days_list))
+    index = []
+    for days in days_list:
+        idx = np.full(len(axis), -1, dtype=np.int64)
+        idx[np.searchsorted(axis, days)] = np.arange(len(days))
+        index.append(idx)
+    return axis, index
+
+
+def rolling_mean(values: np.ndarray, period: int) -> np.ndarray:
+    """简单移动平均，前 period-1 个为 NaN。"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        csum = np.cumsum(values, dtype=np.float64)
+        out[period - 1] = csum[period - 1]
+        out[period:] = csum[period:] - csum[:-period]
+        out[period - 1:] /= period
+    return out
+
+
+def date_to_day(date: str) -> int:
+    """YYYY-MM-DD -> 1970-01-01 起的天数。格式错误抛 ValueError。"""
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+
+def dates_to_days(dates) -> np.ndarray:
+    """日期字符串序列 -> 1970-01-01 起的天数（int32）。"""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int32)
+
+
+# ── 向量化 CSV 解析 ──────────────────────────────────────────
+# 整个文件交给 NumPy 的 C 分词器一次性解析为结构化数组（日期按定长字节、OHLCV 为 float64），
+# 日期再整列转换为天数，不做逐行 Python 循环；遇到不规范的行时整体回退到逐行解析，行为与原脚本一致。
+
+_CSV_DTYPE = np.dtype([("date", "S10"), ("open", "f8"), ("high", "f8"),
+                       ("low", "f8"), ("close", "f8"), ("volume", "f8")])
+
+
+def _parse_lines(text: str) -> Bars:
+    """逐行解析（回退路径）：格式错误的行跳过。"""
+    days, opens, highs, lows, closes, vols = [], [], [], [], [], []
+    for line in text.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) < 6:
+            continue
+        try:
+            day = date_to_day(parts[0].strip())
+            row = (float(parts[1]), float(parts[2]), float(parts[3]),
+                   float(parts[4]), int(float(parts[5])))
+        except (ValueError, TypeError):
+            continue
+        days.append(day)
+        for col, v in zip((opens, highs, lows, closes, vols), row):
+            col.append(v)
+    return _sorted(Bars(days, opens, highs, lows, closes, vols))
+
+
+def _sorted(bars: Bars) -> Bars:
+    """保证按日期升序（日期下标依赖有序）；已有序时原样返回。"""
+    if len(bars) > 1 and np.any(np.diff(bars.days) < 0):
+        return bars.take(np.argsort(bars.days, kind="stable"))
+    return bars
+
+
+def parse_csv_bytes(raw: bytes) -> Bars:
+    """解析日K CSV 内容（首行为表头；日期, 开, 高, 低, 收, 量）。格式错误的行跳过。"""
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    head_end = raw.find(b"\n")
+    body = raw[head_end + 1:] if head_end >= 0 else b""
+    if not body.strip():
+        return Bars([], [], [], [], [], [])
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            arr = np.loadtxt(io.BytesIO(body), dtype=_CSV_DTYPE, delimiter=",",
+                             ndmin=1, encoding=None)
+        days = arr["date"].astype("datetime64[D]").astype(np.int32)
+    except ValueError:
+        return _parse_lines(body.decode("utf-8", "replace"))
+    return _sorted(Bars(days, arr["open"], arr["high"], arr["low"], arr["close"],
+                        arr["volume"].astype(np.int64)))
+
+
+def parse_csv(path: str) -> Bars:
+    """解析日K CSV 文件（向量化），返回列式 Bars。格式错误的行跳过。"""
+    with open(path, "rb") as f:
+        return parse_csv_bytes(f.read())
+
+
+def rows_to_bars(rows) -> Bars:
+    """[(日期, 开, 高, 低, 收, 量), ...]（字符串或数值）-> Bars，保持原顺序。"""
+    if not rows:
+        return Bars([], [], [], [], [], [])
+    cols = list(zip(*rows))
+    vals = np.array(cols[1:6], dtype=np.float64)
+    return Bars(dates_to_days(cols[0]), vals[0], vals[1], vals[2], vals[3], vals[4].astype(np.int64))
+
+
+def merge_bars(old: Bars, new: Bars) -> Bars:
+    """合并两段日K：日期重复时保留 old（new 内部重复保留首条），结果按日期升序。"""
+    _, first = np.unique(new.days, return_index=True)
+    fresh = np.zeros(len(new), dtype=bool)
+    fresh[first] = True
+    fresh &= ~np.isin(new.days, old.days)
+    cols = [np.concatenate([getattr(old, k), getattr(new, k)[fresh]])
+            for k in ("days", "open", "high", "low", "close", "volume")]
+    order = np.argsort(cols[0], kind="stable")
+    return Bars(*(c[order] for c in cols))
+
+
+def format_csv_lines(bars: Bars, start: int = 0, stop: int = None) -> str:
+    """Bars[start:stop] -> CSV 文本行（价格三位小数，与新浪原始数据一致；成交量整数）。"""
+    sl = slice(start, stop)
+    cols = zip(bars.dates[sl], bars.open[sl].tolist(), bars.high[sl].tolist(), bars.low[sl].tolist(),
+               bars.close[sl].tolist(), bars.volume[sl].tolist())
+    return "".join(f"{d},{o:.3f},{h:.3f},{lo:.3f},{c:.3f},{v}\n" for d, o, h, lo, c, v in cols)
+
+
+def publish_file(path: str, data: bytes, base: str = None):
+    """原子发布文件：写临时文件 → fsync → os.replace，读者只会看到旧文件或完整的新文件。
+
+    base 不为空时先把 base 原样复制到临时文件再追加 data（追加写：不解析、不重排已有内容）。
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        if base:
+            shutil.copyfile(base, tmp)
+        with open(tmp, "ab" if base else "wb") as f:
+            if base and f.tell():
+                with open(tmp, "rb") as rf:
+                    rf.seek(-1, os.SEEK_END)
+                    if rf.read(1) != b"\n":
+                        data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def file_stamp(path: str):
+    """文件版本标识 (mtime_ns, size)；文件不存在返回 None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def data_version(paths, salt: str = "") -> tuple:
+    """一组文件的数据版本：(版本摘要, 最后修改时间 Unix 秒)。只 stat 不读内容，供 HTTP ETag / Last-Modified 用。"""
+    h = hashlib.sha1(salt.encode("utf-8"))
+    latest = 0
+    for path in paths:
+        stamp = file_stamp(path)
+        h.update(repr((os.path.basename(path), stamp)).encode("utf-8"))
+        if stamp is not None:
+            latest = max(latest, stamp[0])
+    return h.hexdigest()[:24], latest // 1_000_000_000
+
+
+# ── 二进制列式缓存（.bars） ──────────────────────────────────
+# CSV 仍是唯一数据源；.bars 由 CSV 生成，可直接内存映射，零解析。
+# 布局（小端）：64 字节头 | days int32（补齐到 8 字节）| open | high | low | close（float64）| volume（int64）
+# 头：magic(8s) version(u32) 源CSV crc32(u32) 行数(i64) 源CSV mtime_ns(i64) 源CSV size(i64)
+
+SIDECAR_MAGIC = b"FDSBARS\0"
+SIDECAR_VERSION = 1
+_HEADER = struct.Struct("<8sIIqqq")
+_HEADER_SIZE = 64
+
+
+def _column_offsets(n: int):
+    """返回 (days 偏移, [open, high, low, close, volume] 偏移)。"""
+    base = _HEADER_SIZE + (4 * n + 7) // 8 * 8
+    return _HEADER_SIZE, [base + i * 8 * n for i in range(5)]
+
+
+def file_crc32(path: str) -> int:
+    """文件内容的 CRC32 校验和。"""
+    with open(path, "rb") as f:
+        return zlib.crc32(f.read())
+
+
+def write_sidecar(src: str, dst: str, bars: Bars = None) -> Bars:
+    """由 CSV 生成 .bars 文件（先写临时文件再原子替换）。bars 为空时先解析 CSV。返回 Bars。
+    临时文件名带进程号与线程号，多个 Web 进程同时重建同一个过期 .bars 时互不覆盖。"""
+    stamp = file_stamp(src)
+    if stamp is None:
+        raise FileNotFoundError(src)
+    if bars is None:
+        bars = parse_csv(src)
+    n = len(bars)
+    days_off, offsets = _column_offsets(n)
+    header = _HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, file_crc32(src), n, stamp[0], stamp[1])
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(header.ljust(_HEADER_SIZE, b"\0"))
+            f.write(bars.days.astype("<i4").tobytes())
+            f.write(b"\0" * (offsets[0] - days_off - 4 * n))
+            for col in (bars.open, bars.high, bars.low, bars.close):
+                f.write(col.astype("<f8").tobytes())
+            f.write(bars.volume.astype("<i8").tobytes())
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return bars
+
+
+def read_sidecar(src: str, dst: str):
+    """内存映射 .bars 文件返回 Bars（数组只读、零拷贝）。文件缺失、损坏或相对 CSV 过期时返回 None。
+
+    过期判断：CSV 的 mtime 与 size 均与记录一致视为新鲜；仅 size 一致时（如 git 检出改变了 mtime）再比对 crc32。
+    """
+    stamp = file_stamp(src)
+    try:
+        with open(dst, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if stamp is None or len(mm) < _HEADER_SIZE:
+        return None
+    magic, version, crc, n, mtime_ns, size = _HEADER.unpack_from(mm, 0)
+    if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION:
+        return None
+    if stamp[1] != size or (stamp[0] != mtime_ns and file_crc32(src) != crc):
+        return None
+    days_off, offsets = _column_offsets(n)
+    if len(mm) < offsets[-1] + 8 * n:
+        return None
+    cols = [np.frombuffer(mm, dtype="<f8", count=n, offset=off) for off in offsets[:4]]
+    return Bars(
+        np.frombuffer(mm, dtype="<i4", count=n, offset=days_off),
+        *cols,
+        np.frombuffer(mm, dtype="<i8", count=n, offset=offsets[4]),
+    )
+
+
+def load_bars(symbol: str, name: str):
+    """加载某品种 Bars：优先内存映射新鲜的 .bars，否则解析 CSV 并尽量重建 .bars。CSV 不存在返回 None。"""
+    src, dst = csv_path(symbol, name), bars_path(symbol, name)
+    if not os.path.exists(src):
+        return None
+    bars = read_sidecar(src, dst)
+    if bars is not None:
+        return bars
+    bars = parse_csv(src)
+    try:
+        write_sidecar(src, dst, bars)
+    except OSError:
+        pass  # 只读部署（如 Vercel）写不了，直接用解析结果
+    return bars
+
+
+def build_sidecars(symbols=None, force: bool = False):
+    """为各品种生成/刷新 .bars（跳过仍新鲜的）并刷新 meta.json。返回 [(code, 行数, 是否重建)]。"""
+    result = []
+    for code, name in symbols or SYMBOL_LIST:
+        src, dst = csv_path(code, name), bars_path(code, name)
+        if not os.path.exists(src):
+            continue
+        bars = None if force else read_sidecar(src, dst)
+        rebuilt = bars is None
+        if rebuilt:
+            bars = write_sidecar(src, dst)
+        record_bars_meta(code, name, bars)
+        result.append((code, len(bars), rebuilt))
+    return result
+
+
+# ── 元信息（data/meta.json） ──────────────────────────────────
+# 每品种记录 {rows, first_date, last_date, crc32, size, mtime_ns}，由更新流程写入；
+# 网页端据此 O(1) 取条数与最新日期。记录与 CSV 不符时回退到 .bars，再没有时解析一次 CSV 并补写记录。
+
+_meta_lock = threading.Lock()
+_meta_file = (None, {})       # (meta.json 版本, 内容)
+_meta_memo = {}               # symbol -> (CSV 版本, 元信息)
+
+
+def _load_meta_file() -> dict:
+    global _meta_file
+    stamp = file_stamp(META_PATH)
+    if stamp != _meta_file[0]:
+        try:
+            with open(META_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        _meta_file = (stamp, data if isinstance(data, dict) else {})
+    return _meta_file[1]
+
+
+def record_meta(symbol: str, name: str, rows: int, first_date: str, last_date: str):
+    """更新流程写完某品种 CSV 后调用：把条数、首末日期、校验和与文件版本写入 meta.json（原子替换）。"""
+    path = csv_path(symbol, name)
+    stamp = file_stamp(path)
+    if stamp is None:
+        return
+    entry = {"rows": int(rows), "first_date": first_date, "last_date": last_date,
+             "crc32": file_crc32(path), "size": stamp[1], "mtime_ns": stamp[0]}
+    with _meta_lock:
+        data = dict(_load_meta_file())
+        data[symbol] = entry
+        text = json.dumps(data, ensure_ascii=False, indent=1, sort_keys=True)
+        publish_file(META_PATH, text.encode("utf-8"))
+
+
+def record_bars_meta(symbol: str, name: str, bars: Bars):
+    """record_meta 的 Bars 版本。"""
+    if len(bars):
+        record_meta(symbol, name, len(bars), bars.dates[0], bars.dates[-1])
+
+
+def _day_str(day) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+
+def symbol_meta(symbol: str, name: str):
+    """某品种 {rows, first_date, last_date}，CSV 不存在返回 None。
+
+    依次取 meta.json 的记录、新鲜 .bars 的行数与首末日期（内存映射，只读到头部和首末两个值）；
+    都没有时解析一次 CSV 并写入 .bars 与 meta.json（只读部署写不了时按文件版本缓存在进程内），之后的页面渲染不再读全量数据。
+    """
+    path = csv_path(symbol, name)
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    hit = _meta_memo.get(symbol)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    info = None
+    entry = _load_meta_file().get(symbol)
+    if isinstance(entry, dict) and entry.get("size") == stamp[1]:
+        # mtime 不同（如 git 检出）时用校验和确认内容未变；结果按文件版本缓存，每版本只校验一次
+        if entry.get("mtime_ns") == stamp[0] or entry.get("crc32") == file_crc32(path):
+            info = {k: entry[k] for k in ("rows", "first_date", "last_date")}
+    if info is None:
+        bars = read_sidecar(path, bars_path(symbol, name))
+        if bars is None:
+            bars = load_bars(symbol, name)
+            try:
+                record_bars_meta(symbol, name, bars)
+            except OSError:
+                pass
+        first, last = (_day_str(bars.days[0]), _day_str(bars.days[-1])) if len(bars) else ("", "")
+        info = {"rows": len(bars), "first_date": first, "last_date": last}
+    _meta_memo[symbol] = (stamp, info)
+    return info
+
+
+class BarStore:
+    """进程级行情缓存：symbol -> (文件版本, Bars)。线程安全。"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, name: str):
+        """返回某品种的 Bars；CSV 不存在时返回 None。文件变化后自动重新解析。"""
+        stamp = file_stamp(csv_path(symbol, name))
+        if stamp is None:
+            self._entries.pop(symbol, None)
+            return None
+        entry = self._entries.get(symbol)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+            bars = load_bars(symbol, name)
+            if bars is None:
+                return None
+            self._entries[symbol] = (stamp, bars)
+            return bars
+
+    def invalidate(self, symbol: str = None):
+        """丢弃缓存（symbol 为空时清空全部），下次访问重新加载。"""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol, None)
+
+
+# 进程内共享实例
+STORE = BarStore()
+
+
+def get_bars(symbol: str, name: str, calendar: bool = False):
+    """从共享缓存取某品种 Bars，无数据返回 None。calendar=True 时返回日历补全视图。"""
+    bars = STORE.get(symbol, name)
+    return bars.calendar if calendar and bars is not None else bars
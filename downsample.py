@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 图表降采样
+长区间缩放浏览时，把日K按桶合并到不超过 max_points 根：
+K 线按桶做 OHLC 合并（开取首根、收取末根、高取最高、低取最低、量求和），
+折线（MA20 等）用 LTTB 在同一组桶里各选一个代表点，保证与 K 线共用同一条类目轴。
+"""
+
+import warnings
+
+import numpy as np
+
+from datastore import Bars
+
+
+def bucket_edges(n: int, max_points: int) -> np.ndarray:
+    """把 n 根分成不超过 max_points 个连续桶，返回各桶起始下标（升序、首项 0）。"""
+    if n <= max_points:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n, max_points, endpoint=False).astype(np.int64))
+
+
+def merge_ohlc(bars: Bars, edges: np.ndarray) -> Bars:
+    """按桶合并 K 线：日期取桶内首日。"""
+    last = np.append(edges[1:], len(bars)) - 1
+    return Bars(bars.days[edges], bars.open[edges],
+                np.maximum.reduceat(bars.high, edges), np.minimum.reduceat(bars.low, edges),
+                bars.close[last], np.add.reduceat(bars.volume, edges))
+
+
+def lttb(x: np.ndarray, y: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：在给定桶内各选一点，返回所选下标（每桶一个）。
+
+    首桶取首点、末桶取末点；中间桶选与「上一所选点」「下一桶均值点」构成三角形面积最大的点。
+    y 中的 NaN（如 MA20 前 19 根）不参与比较，整桶为 NaN 时取桶内首点。
+    """
+    m, n = len(edges), len(x)
+    if m <= 2 or m == n:
+        return edges.copy()
+    x = x.astype(np.float64)
+    ends = np.append(edges[1:], n)
+    valid = ~np.isnan(y)
+    counts = np.add.reduceat(valid.astype(np.int64), edges)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        mean_x = np.add.reduceat(np.where(valid, x, 0.0), edges) / counts
+        mean_y = np.add.reduceat(np.where(valid, y, 0.0), edges) / counts
+    picked = np.empty(m, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for b in range(1, m - 1):
+        lo, hi = edges[b], ends[b]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - mean_x[b + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[b + 1] - y[a]))
+        area[np.isnan(area)] = -1.0
+        a = picked[b] = lo + int(np.argmax(area))
+    return picked
+
+
+def downsample(bars: Bars, line: np.ndarray, max_points: int):
+    """降采样到不超过 max_points 根：返回 (合并后的 Bars, 折线各桶代表值, 每点最多代表的原始根数)。"""
+    edges = bucket_edges(len(bars), max(2, max_points))
+    if len(edges) == len(bars):
+        return bars, line, 1
+    picked = lttb(bars.days, line, edges)
+    bucket = int(np.max(np.diff(np.append(edges, len(bars)))))
+    return merge_ohlc(bars, edges), line[picked], bucket
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 拉取响应的本地缓存
+按 URL + 参数（akshare 按函数名 + 参数）把上游响应存到 CACHE_DIR：
+- TTL 内直接用缓存，不发请求；过期后带 If-None-Match / If-Modified-Since 条件请求，304 时沿用缓存；
+- 响应体记 SHA-256，与上次「已落盘」的摘要相同即视为无变化，调用方可跳过解析和写盘；
+- replay 模式只读缓存、从不联网（离线跑流程 / 测试），未命中抛 CacheMiss；off 模式完全不用缓存。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from config import CACHE_DIR, FETCH_CACHE_MODE, FETCH_CACHE_TTL
+from datastore import publish_file
+
+MODES = ("", "replay", "off")
+
+
+class CacheMiss(RuntimeError):
+    """replay 模式下缓存中没有对应响应。"""
+
+
+class CachedResponse:
+    """一次（可能来自缓存的）响应。source: net / 304 / ttl / replay / off。
+    target 为上次 commit() 时记下的落盘目标版本（如 CSV 的 data_version），没有时为 None。"""
+
+    __slots__ = ("key", "body", "digest", "changed", "source", "target")
+
+    def __init__(self, key, body: bytes, digest: str, changed: bool, source: str, target: str = None):
+        self.key = key
+        self.body = body
+        self.digest = digest
+        self.changed = changed
+        self.source = source
+        self.target = target
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8")
+
+
+def _digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+class ResponseCache:
+    """磁盘响应缓存。每个条目两个文件：<key>.body（原始响应体）与 <key>.json（URL、校验头、摘要、时间）。
+
+    changed 相对于上次 commit() 的摘要判断：拉到了但没写盘成功的数据，下次仍算「有变化」。
+    不同 key 之间互不影响，可在多线程拉取中共用一个实例。
+    """
+
+    def __init__(self, root: str = CACHE_DIR, ttl: float = FETCH_CACHE_TTL, mode: str = FETCH_CACHE_MODE):
+        if mode not in MODES:
+            raise ValueError(f"未知缓存模式: {mode!r}（可选 replay / off 或留空）")
+        self.root = root
+        self.ttl = ttl
+        self.mode = mode
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str, params: dict = None) -> str:
+        raw = json.dumps([url, params or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str):
+        return os.path.join(self.root, key + ".json"), os.path.join(self.root, key + ".body")
+
+    def _load(self, key: str):
+        """读条目，返回 (meta, body)；不存在或损坏时 (None, None)。"""
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        if meta.get("sha256") != _digest(body):
+            return None, None
+        return meta, body
+
+    def _store(self, key: str, meta: dict, body: bytes = None):
+        os.makedirs(self.root, exist_ok=True)
+        meta_path, body_path = self._paths(key)
+        if body is not None:
+            publish_file(body_path, body)
+        publish_file(meta_path, json.dumps(meta, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    def _cached(self, key: str, meta: dict, body: bytes, source: str) -> CachedResponse:
+        return CachedResponse(key, body, meta["sha256"], meta["sha256"] != meta.get("applied"), source,
+                              meta.get("applied_to"))
+
+    def _fresh(self, key: str, fetch):
+        """公共流程：replay / TTL 命中直接返回缓存，否则调用 fetch(meta) -> (body, meta_update) 或 None（304）。"""
+        if self.mode == "off":
+            body, _ = fetch(None)
+            return CachedResponse(key, body, _digest(body), True, "off")
+        meta, body = self._load(key)
+        if self.mode == "replay":
+            if meta is None:
+                raise CacheMiss(f"离线模式下缓存未命中: {key}")
+            return self._cached(key, meta, body, "replay")
+        now = time.time()
+        if meta is not None and now - meta.get("fetched_at", 0) < self.ttl:
+            return self._cached(key, meta, body, "ttl")
+        got = fetch(meta)
+        if got is None:
+            meta["fetched_at"] = now
+            self._store(key, meta)
+            return self._cached(key, meta, body, "304")
+        body, extra = got
+        applied = meta.get("applied") if meta else None
+        meta = dict(extra, sha256=_digest(body), fetched_at=now, applied=applied)
+        self._store(key, meta, body)
+        return self._cached(key, meta, body, "net")
+
+    def get(self, url: str, params: dict = None, session=None, headers: dict = None,
+            timeout: float = 30) -> CachedResponse:
+        """GET 请求（经缓存）。上游返回 ETag / Last-Modified 时，过期后用条件请求复核。"""
+        key = self.key(url, params)
+
+        def fetch(meta):
+            req_headers = dict(headers or {})
+            if meta and meta.get("etag"):
+                req_headers["If-None-Match"] = meta["etag"]
+            if meta and meta.get("last_modified"):
+                req_headers["If-Modified-Since"] = meta["last_modified"]
+            if session is None:
+                import requests
+                resp = requests.get(url, params=params, headers=req_headers, timeout=timeout)
+            else:
+                resp = session.get(url, params=params, headers=req_headers, timeout=timeout)
+            if resp.status_code == 304 and meta:
+                return None
+            resp.raise_for_status()
+            return resp.content, {"url": url, "params": params or {},
+                                  "etag": resp.headers.get("ETag"),
+                                  "last_modified": resp.headers.get("Last-Modified")}
+
+        return self._fresh(key, fetch)
+
+    def call(self, name: str, fn, params: dict = None, encode=None) -> CachedResponse:
+        """缓存任意拉取函数（如 akshare 接口）：fn(**params) 的结果经 encode 转成 bytes 存盘。
+
+        这类接口没有校验头，只能靠 TTL 与摘要判断是否变化；调用方用 body 自行还原结果。
+        """
+        key = self.key(name, params)
+
+        def fetch(meta):
+            result = fn(**(params or {}))
+            body = encode(result) if encode else result
+            return body, {"url": name, "params": params or {}}
+
+        return self._fresh(key, fetch)
+
+    def commit(self, resp: CachedResponse, target: str = None):
+        """记下该响应已成功处理（解析并写盘）；此后同摘要的响应 changed 为 False。
+
+        target 为写盘后目标文件的版本，之后随响应返回（CachedResponse.target）：目标可能被别的步骤改写，
+        调用方应在 changed 为 False 且 target 与目标当前版本相同时才跳过。
+        """
+        if self.mode == "off":
+            return
+        with self._lock:
+            meta, _ = self._load(resp.key)
+            if meta is None or meta["sha256"] != resp.digest:
+                return
+            meta["applied"] = resp.digest
+            meta["applied_to"] = target
+            self._store(resp.key, meta)
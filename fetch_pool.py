@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 并发拉取工具
+共享连接池的 requests.Session、令牌桶限速、指数退避重试，以及带逐品种耗时统计的有界线程池。
+新浪 / akshare 的多品种拉取都走这里。
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import FETCH_RATE, FETCH_RETRIES, FETCH_WORKERS
+
+
+class TokenBucket:
+    """令牌桶限速：平均每秒 rate 个请求，允许 burst 个突发。线程安全。"""
+
+    def __init__(self, rate: float = FETCH_RATE, burst: int = None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待。rate <= 0 表示不限速。"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size: int = FETCH_WORKERS, headers: dict = None):
+    """连接池大小与并发数匹配的 requests.Session（keep-alive 复用 TCP 连接）。"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class FetchStat:
+    """单个任务的执行统计。"""
+
+    __slots__ = ("key", "ok", "seconds", "attempts", "error")
+
+    def __init__(self, key):
+        self.key = key
+        self.ok = False
+        self.seconds = 0.0
+        self.attempts = 0
+        self.error = None
+
+    def __repr__(self):
+        state = "ok" if self.ok else f"失败: {self.error}"
+        return f"{self.key}: {self.seconds:.2f}s, {self.attempts} 次, {state}"
+
+
+def call_with_retry(fn, stat: FetchStat, limiter: TokenBucket = None, retries: int = FETCH_RETRIES,
+                    backoff: float = 0.5, max_backoff: float = 8.0, retry_on=(Exception,)):
+    """调用 fn()，失败时按 backoff * 2^n（带随机抖动）退避重试，最多 retries 次重试。每次尝试前先取令牌。"""
+    delay = backoff
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        stat.attempts += 1
+        try:
+            return fn()
+        except retry_on:
+            if stat.attempts > retries:
+                raise
+        time.sleep(min(max_backoff, delay) * (0.5 + random.random()))
+        delay *= 2
+
+
+def run_parallel(keys, fn, workers: int = FETCH_WORKERS, limiter: TokenBucket = None,
+                 retries: int = FETCH_RETRIES, retry_on=(Exception,), on_done=None):
+    """用有界线程池对每个 key 执行 fn(key)（含限速与重试）。
+
+    按完成顺序在调用线程里回调 on_done(key, result, stat)；返回 [(key, result, stat)]，顺序与 keys 一致。
+    失败的任务 result 为 None、stat.error 为异常信息。
+    """
+    keys = list(keys)
+    results = {}
+
+    def task(key):
+        stat = FetchStat(key)
+        t0 = time.perf_counter()
+        try:
+            result = call_with_retry(lambda: fn(key), stat, limiter, retries, retry_on=retry_on)
+            stat.ok = True
+        except Exception as e:
+            result, stat.error = None, e
+        stat.seconds = time.perf_counter() - t0
+        return key, result, stat
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(keys) or 1))) as pool:
+        for fut in as_completed([pool.submit(task, k) for k in keys]):
+            key, result, stat = fut.result()
+            results[key] = (key, result, stat)
+            if on_done is not None:
+                on_done(key, result, stat)
+    return [results[k] for k in keys]
+
+
+def summarize(stats, elapsed: float) -> str:
+    """汇总耗时统计：总耗时、成功数、最慢的几个任务。"""
+    ok = sum(1 for s in stats if s.ok)
+    slow = sorted(stats, key=lambda s: s.seconds, reverse=True)[:3]
+    lines = [f"共 {len(stats)} 个，成功 {ok}，失败 {len(stats) - ok}，总耗时 {elapsed:.2f}s"]
+    if slow:
+        lines.append("最慢：" + "；".join(f"{s.key} {s.seconds:.2f}s/{s.attempts}次" for s in slow))
+    return "\n".join(lines)
@@ -1,54 +1,38 @@
 # -*- coding: utf-8 -*-
 """
-把 data/ 下三个品种的 CSV 补全为「全部日历日期」：
-非交易日（周末、节假日）用前一交易日收盘价填充开高低收，成交量为 0。
+日历补全：把交易日数据展开为「全部日历日期」，
+非交易日（周末、节假日）沿用前一交易日的开高低收，成交量为 0。
+
+补全已改为读取时的视图（datastore.calendar_fill，接口加 ?calendar=1），不再改写 data/ 下的 CSV；
+本脚本只统计各品种补全前后的行数，或按需把补全结果导出到单独目录。
 """
 
 import os
-import pandas as pd
-
-from config import DATA_DIR, SYMBOL_LIST as SYMBOLS
-
+import sys
 
-def load_df(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, encoding="utf-8-sig")
-    df.columns = [c.split("(")[0].strip() for c in df.columns]
-    df = df.rename(columns={"日期": "Date", "开盘": "Open", "最高": "High", "最低": "Low", "收盘": "Close", "成交量": "Volume"})
-    df["Date"] = pd.to_datetime(df["Date"])
-    df = df.set_index("Date").sort_index()
-    return df[["Open", "High", "Low", "Close", "Volume"]].astype(float)
+from config import CSV_HEADER, SYMBOL_LIST as SYMBOLS
+from datastore import format_csv_lines, get_bars, publish_file
 
 
-def save_df(path: str, df: pd.DataFrame):
-    df = df.reset_index()
-    date_col = df.columns[0]
-    df[date_col] = pd.to_datetime(df[date_col]).dt.strftime("%Y-%m-%d")
-    with open(path, "w", encoding="utf-8-sig") as f:
-        f.write("日期,开盘(元/吨),最高(元/吨),最低(元/吨),收盘(元/吨),成交量(手)\n")
-        for _, r in df.iterrows():
-            f.write(f"{r[date_col]},{r['Open']:.3f},{r['High']:.3f},{r['Low']:.3f},{r['Close']:.3f},{int(r['Volume'])}\n")
-
-
-def main():
+def main(out_dir: str = None):
+    """打印各品种交易日 / 日历日行数；给定 out_dir 时把日历补全后的 CSV 写到该目录（不动源数据）。"""
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
     for symbol, name in SYMBOLS:
-        path = os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K.csv")
-        if not os.path.exists(path):
-            continue
-        df = load_df(path)
-        if df.empty:
+        bars = get_bars(symbol, name)
+        if bars is None or not len(bars):
             continue
-        full_range = pd.date_range(df.index.min(), df.index.max(), freq="D")
-        df = df.reindex(full_range)
-        df["Close"] = df["Close"].ffill()
-        df["Open"] = df["Open"].ffill()
-        df["High"] = df["High"].ffill()
-        df["Low"] = df["Low"].ffill()
-        df["Volume"] = df["Volume"].fillna(0).astype(int)
-        df = df.dropna(subset=["Close"])
-        save_df(path, df)
-        print(f"{name}: 已补全为全部日期，共 {len(df)} 行 -> {path}")
+        full = bars.calendar
+        line = f"{name}: 交易日 {len(bars)} 行，日历补全视图 {len(full)} 行"
+        if out_dir:
+            path = os.path.join(out_dir, f"{symbol}_{name}_历史日K_全日历.csv")
+            publish_file(path, (CSV_HEADER + format_csv_lines(full)).encode("utf-8-sig"))
+            line += f" -> {path}"
+        print(line)
+    if not out_dir:
+        print("日历补全为读取时视图（/api/kline、/api/table 加 ?calendar=1），源 CSV 保持交易日。")
     print("日期补全完成。")
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
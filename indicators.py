@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 技术指标（向量化）
+回测策略与参数扫描用的指标，输入为序列（list / ndarray），输出 float64 数组，不足一个周期的位置为 NaN：
+- 移动均值 / 方差：累积和相减，O(n)；方差先减去首值再平方求和，避免大数相减丢精度；
+- 滚动最高 / 最低：van Herk / Gil-Werman 分块前缀 + 后缀极值，O(n) 且结果精确；
+- EMA / KD 平滑：一阶递归滤波（smooth）。用 scipy.signal.lfilter 在 C 里递推（requirements.txt 已含 scipy）；
+  只装了 requirements-vercel.txt 的环境没有 scipy，退回逐点递推。两者运算顺序与原 EMA 一致，结果逐位相同。
+价格为整数（或二进制可精确表示的小数）时，均值与原逐点累加的结果逐位相同。
+"""
+
+import numpy as np
+
+from datastore import rolling_mean
+
+try:  # scipy 的 lfilter 在 C 里做递归滤波；Vercel 只装 Flask + NumPy，没有时逐点递推
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+
+def _array(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+
+def sma(values, period: int) -> np.ndarray:
+    """简单移动平均，前 period-1 个为 NaN。"""
+    return rolling_mean(_array(values), int(period))
+
+
+def rolling_var(values, period: int) -> np.ndarray:
+    """滚动总体方差（除以 period），前 period-1 个为 NaN。"""
+    x = _array(values)
+    period = int(period)
+    out = np.full(len(x), np.nan)
+    if len(x) < period:
+        return out
+    x = x - x[0]
+    s1 = np.cumsum(x)
+    s2 = np.cumsum(x * x)
+    s1[period:] = s1[period:] - s1[:-period]
+    s2[period:] = s2[period:] - s2[:-period]
+    s1, s2 = s1[period - 1:], s2[period - 1:]
+    out[period - 1:] = np.maximum((s2 - s1 * s1 / period) / period, 0.0)
+    return out
+
+
+def rolling_std(values, period: int) -> np.ndarray:
+    """滚动总体标准差。"""
+    return np.sqrt(rolling_var(values, period))
+
+
+def _rolling_extreme(values, period: int, ufunc, fill: float) -> np.ndarray:
+    """窗口 [i-period+1, i] 的极值：按 period 分块，块内前缀极值与后缀极值各一次 accumulate，
+    窗口跨两块时取「左块后缀」与「右块前缀」的极值。"""
+    x = _array(values)
+    period = int(period)
+    n = len(x)
+    out = np.full(n, np.nan)
+    if n < period:
+        return out
+    m = -(-n // period) * period
+    padded = np.full(m, fill)
+    padded[:n] = x
+    blocks = padded.reshape(-1, period)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()[:n]
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()[:n]
+    out[period - 1:] = ufunc(suffix[:n - period + 1], prefix[period - 1:])
+    return out
+
+
+def rolling_max(values, period: int) -> np.ndarray:
+    """滚动最高，前 period-1 个为 NaN。"""
+    return _rolling_extreme(values, period, np.maximum, -np.inf)
+
+
+def rolling_min(values, period: int) -> np.ndarray:
+    """滚动最低，前 period-1 个为 NaN。"""
+    return _rolling_extreme(values, period, np.minimum, np.inf)
+
+
+def smooth(values, k: float, init: float) -> np.ndarray:
+    """一阶递归平滑：y[i] = x[i]·k + y[i-1]·(1-k)，y[-1] = init。"""
+    x = _array(values)
+    if not len(x):
+        return x
+    if lfilter is not None:
+        out, _ = lfilter([k], [1.0, -(1 - k)], x, zi=[init * (1 - k)])
+        return out
+    out = x.tolist()
+    prev = init
+    for i in range(len(out)):
+        prev = out[i] = out[i] * k + prev * (1 - k)
+    return np.array(out)
+
+
+def ema(values, period: int) -> np.ndarray:
+    """指数移动平均：y[0] = x[0]，y[i] = x[i]·k + y[i-1]·(1-k)，k = 2/(period+1)。"""
+    x = _array(values)
+    if not len(x):
+        return x
+    out = np.empty(len(x))
+    out[0] = x[0]
+    out[1:] = smooth(x[1:], 2.0 / (period + 1), x[0])
+    return out
+
+
+def crosses(a: np.ndarray, b: np.ndarray, start: int = 1):
+    """上穿 / 下穿：返回 (up, down) 布尔数组。up[i] 为 a[i-1] <= b[i-1] 且 a[i] > b[i]，
+    down[i] 为 a[i-1] >= b[i-1] 且 a[i] < b[i]（同一根两者互斥时 up 优先）；i < start 与含 NaN 的位置均为 False。"""
+    n = len(a)
+    up = np.zeros(n, dtype=bool)
+    down = np.zeros(n, dtype=bool)
+    start = max(1, start)
+    if n > start:
+        pa, pb, ca, cb = a[start - 1:-1], b[start - 1:-1], a[start:], b[start:]
+        up[start:] = (pa <= pb) & (ca > cb)
+        down[start:] = (pa >= pb) & (ca < cb) & ~up[start:]
+    return up, down
+
+
+def to_signals(buy: np.ndarray, sell: np.ndarray) -> np.ndarray:
+    """买卖布尔数组 -> 信号数组（int8：1 买入、-1 卖出、0 无操作），买入优先。"""
+    return np.where(buy, 1, np.where(sell, -1, 0)).astype(np.int8)
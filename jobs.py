@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 后台任务
+数据更新等写操作放到进程内的单个后台线程里顺序执行，Web 请求只负责提交与查询，不被长任务占住：
+- 每个任务有 ID 与按序编号的事件（状态、阶段、逐品种进度、日志行、结束），供 SSE 推送与断线续传；
+- 单写者：同一时间只有一个写任务在排队或执行，重复提交返回正在进行的那个；执行期间持有 WRITE_LOCK；
+- 各阶段在本进程内直接调用（不另起解释器），阶段里 print 的内容按行转成 log 事件。
+"""
+
+import io
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# 写数据文件（CSV / .bars / meta.json / Excel）的单写者锁
+WRITE_LOCK = threading.Lock()
+
+
+class Job:
+    """一个后台任务。stages 为 [(阶段名, fn(job)), ...]，按顺序执行，任一阶段抛异常即失败结束。"""
+
+    def __init__(self, kind: str, stages):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.stages = list(stages)
+        self.state = "queued"          # queued / running / done / failed
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self._cond = threading.Condition()
+
+    def emit(self, type_: str, **data):
+        """追加事件并唤醒等待者。事件 seq 从 1 起连续编号。"""
+        with self._cond:
+            self.events.append(dict(data, seq=len(self.events) + 1, type=type_, time=round(time.time(), 3)))
+            self._cond.notify_all()
+
+    def _finish(self, error: str = None):
+        with self._cond:
+            self.state, self.error, self.finished = ("failed" if error else "done"), error, time.time()
+        self.emit("done", ok=error is None, error=error)
+
+    def wait_events(self, after: int, timeout: float):
+        """返回 seq > after 的事件（没有则最多等 timeout 秒）与任务是否已结束。"""
+        with self._cond:
+            if len(self.events) <= after and self.finished is None:
+                self._cond.wait(timeout)
+            return self.events[after:], self.finished is not None
+
+    @property
+    def active(self) -> bool:
+        return self.finished is None
+
+    def status(self) -> dict:
+        return {"id": self.id, "kind": self.kind, "state": self.state, "error": self.error,
+                "created": self.created, "finished": self.finished, "events": len(self.events)}
+
+
+class _JobOutput(io.TextIOBase):
+    """替换 sys.stdout：任务线程写入的内容按行转成 log 事件，其他线程照常写到原 stdout。
+
+    只认执行任务的那个线程：阶段内部再开的线程池（如逐品种并发拉取）里 print 的内容不进任务日志，
+    写到原 stdout；各品种的结果由阶段在任务线程里汇总输出或以 progress 事件上报。
+    """
+
+    def __init__(self, job: Job, fallback):
+        self.job = job
+        self.fallback = fallback
+        self.owner = threading.get_ident()
+        self._buf = ""
+
+    def write(self, s):
+        if threading.get_ident() != self.owner:
+            return self.fallback.write(s)
+        self._buf += s
+        *lines, self._buf = self._buf.split("\n")
+        for line in lines:
+            if line.strip():
+                self.job.emit("log", line=line)
+        return len(s)
+
+    def flush(self):
+        if self._buf.strip():
+            self.job.emit("log", line=self._buf)
+        self._buf = ""
+        self.fallback.flush()
+
+
+class JobRunner:
+    """单线程任务队列。只保留最近 keep 个任务的记录。"""
+
+    def __init__(self, keep: int = 20):
+        self.keep = keep
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def submit(self, kind: str, stages):
+        """提交写任务，返回 (job, 是否新建)。已有任务在排队或执行时不重复提交，直接返回该任务。"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.active:
+                    return job, False
+            job = Job(kind, stages)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep:
+                self._jobs.popitem(last=False)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="job-runner", daemon=True)
+                self._thread.start()
+        job.emit("state", state=job.state)
+        self._queue.put(job)
+        return job, True
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self):
+        """最近提交的任务（没有则 None），页面刷新后据此重新订阅。"""
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def _worker(self):
+        while True:
+            self._run(self._queue.get())
+
+    def _run(self, job: Job):
+        error = "任务异常中止"
+        try:
+            with WRITE_LOCK:
+                job.state = "running"
+                job.emit("state", state="running")
+                out = sys.stdout
+                sys.stdout = _JobOutput(job, out)
+                try:
+                    for i, (name, fn) in enumerate(job.stages, 1):
+                        job.emit("stage", stage=name, index=i, total=len(job.stages))
+                        fn(job)
+                        sys.stdout.flush()
+                    error = None
+                except BaseException as e:
+                    # 含 SystemExit（阶段里的脚本调用 sys.exit）：只让本任务失败，工作线程继续处理后续任务
+                    error = f"{type(e).__name__}: {e}"
+                finally:
+                    sys.stdout = out
+        finally:
+            # 无论如何都结束任务，否则它一直处于 active，之后的提交都会返回这个任务
+            job._finish(error)
+
+
+# 进程内唯一的任务队列
+RUNNER = JobRunner()
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 回测参数扫描
+在 STRATEGIES 声明的参数范围（min / max，可按请求覆盖）上做网格或随机抽样，各组信号按全序列算好后
+由 BacktestEngine.score 批量打分（只算排序用的一项指标），按该指标从高到低排行，并给出热力图矩阵：
+- 多进程：行情数组写进一块共享内存，工作进程启动时映射一次并建好引擎，之后每个任务只传参数组；
+- 组合数少时在当前进程内直接算；
+- 不满足 constraints（如短均线须小于长均线）的组合跳过。
+滚动前推（walk_forward）：按训练 / 测试窗口滚动，每个训练窗口选出最优参数、在其后的测试窗口上回测，
+各测试段的权益拼成样本外曲线。策略指标只用到当前及之前的 K 线，全部参数组的信号在全序列上算一次
+（放进共享内存），各窗口只切片打分，窗口之间并行。
+"""
+
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest import STRATEGIES, BacktestEngine, _round
+from config import (OPTIMIZE_MAX_COMBOS, OPTIMIZE_POOL_MIN, OPTIMIZE_SAMPLES, OPTIMIZE_TOP, OPTIMIZE_WORKERS,
+                    WALKFORWARD_MAX_SIGNAL_BYTES, WALKFORWARD_TEST_YEARS, WALKFORWARD_TRAIN_YEARS)
+from datastore import Bars
+from resample import TIMEFRAMES, resample
+
+METRICS = ("total_return", "annual_return", "max_drawdown", "win_rate", "total_trades",
+           "profit_factor", "avg_holding_days")
+METHODS = ("grid", "random")
+
+
+# ── 参数空间 ──────────────────────────────────────────────────
+
+def _value(v, integer: bool):
+    """取值规整：整数参数取整，小数去掉累加误差，整数值的小数也写成 int（与 /api/backtest 的参数处理一致）。"""
+    v = round(float(v), 10)
+    return int(round(v)) if integer or v == int(v) else v
+
+
+def _axis(p: dict, spec) -> list:
+    integer = isinstance(p["default"], int)
+    lo, hi, step = p["min"], p["max"], (1 if integer else 0.1)
+    if isinstance(spec, str):
+        parts = spec.split(":")
+        if len(parts) == 1:
+            spec = parts
+        elif len(parts) <= 3:
+            spec = dict(zip(("min", "max", "step"), parts))
+        else:
+            raise ValueError(f"参数 {p['key']} 的范围应为 min:max[:step]")
+    try:
+        if isinstance(spec, (int, float)):
+            return [_value(spec, integer)]
+        if isinstance(spec, (list, tuple)):
+            return sorted({_value(v, integer) for v in spec})
+        if isinstance(spec, dict):
+            lo, hi = float(spec.get("min", lo)), float(spec.get("max", hi))
+            step = float(spec.get("step", step))
+        elif spec is not None:
+            raise TypeError
+    except (TypeError, ValueError):
+        raise ValueError(f"参数 {p['key']} 的取值不合法: {spec!r}") from None
+    if step <= 0 or lo > hi:
+        raise ValueError(f"参数 {p['key']} 的范围不合法: min={lo} max={hi} step={step}")
+    count = int(math.floor((hi - lo) / step + 1e-9)) + 1
+    return sorted({_value(lo + i * step, integer) for i in range(count)})
+
+
+def param_axes(strategy_key: str, ranges: dict = None) -> dict:
+    """各参数的取值列表（按 STRATEGIES 中的参数顺序）。
+
+    默认取声明的 [min, max]：整数参数步长 1，小数参数步长 0.1。ranges 可逐个覆盖：
+    {key: 值}、{key: [值, ...]}、{key: {"min", "max", "step"}}（缺省项沿用声明）或 {key: "min:max[:step]"}。
+    未知参数或取值不合法时抛 ValueError。
+    """
+    params = STRATEGIES[strategy_key]["params"]
+    ranges = ranges or {}
+    unknown = set(ranges) - {p["key"] for p in params}
+    if unknown:
+        raise ValueError(f"策略 {strategy_key} 没有参数: {', '.join(sorted(unknown))}")
+    return {p["key"]: _axis(p, ranges.get(p["key"])) for p in params}
+
+
+def combinations(strategy_key: str, axes: dict, method: str = "grid", samples: int = None, seed=None):
+    """要回测的参数组：返回 (参数名列表, [取值元组, ...])。
+
+    grid 为全部组合（超过 OPTIMIZE_MAX_COMBOS 时抛 ValueError）；random 为不重复地随机抽 samples 组
+    （默认 OPTIMIZE_SAMPLES，seed 相同则结果相同）。两者都只保留满足 constraints 的组合。
+    """
+    keys = list(axes)
+    cons = [(keys.index(a), keys.index(b)) for a, b in STRATEGIES[strategy_key].get("constraints", ())]
+
+    def valid(c):
+        return all(c[a] < c[b] for a, b in cons)
+
+    total = math.prod(len(v) for v in axes.values())
+    if method == "grid":
+        if total > OPTIMIZE_MAX_COMBOS:
+            raise ValueError(f"网格共 {total} 组，超过上限 {OPTIMIZE_MAX_COMBOS}，请缩小范围、加大步长或改用 random")
+        return keys, [c for c in itertools.product(*axes.values()) if valid(c)]
+    if method != "random":
+        raise ValueError("method 可选: " + "/".join(METHODS))
+    n = int(samples or OPTIMIZE_SAMPLES)
+    if n <= 0:
+        raise ValueError("samples 须为正整数")
+    rng = np.random.default_rng(seed)
+    if total <= OPTIMIZE_MAX_COMBOS:
+        pool = [c for c in itertools.product(*axes.values()) if valid(c)]
+        pick = rng.choice(len(pool), size=min(n, len(pool)), replace=False) if pool else []
+        return keys, [pool[i] for i in pick]
+    # 空间太大不枚举：逐轴随机取下标，去重并跳过不满足约束的，最多尝试 50 倍
+    seen, out, values = set(), [], list(axes.values())
+    for _ in range(n * 50):
+        c = tuple(v[rng.integers(len(v))] for v in values)
+        if c not in seen and valid(c):
+            seen.add(c)
+            out.append(c)
+            if len(out) == n:
+                break
+    return keys, out
+
+
+# ── 执行：共享内存 + 进程池 ─────────────────────────────────────
+
+def signal_matrix(engine: BacktestEngine, strategy_key: str, keys, combos, out: np.ndarray = None) -> np.ndarray:
+    """各参数组在全序列上的信号，每行一组（int8）。out 给定时写入其中（如共享内存里的矩阵）。"""
+    out = np.empty((len(combos), engine.n), dtype=np.int8) if out is None else out
+    for i, c in enumerate(combos):
+        out[i] = engine.signals(strategy_key, dict(zip(keys, c)))
+    return out
+
+
+def _attach(name: str, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+_worker = None          # 工作进程内：{"shm": [...], "engine", "strategy", "account", "signals"}
+
+
+def _init_worker(bars_name: str, n: int, signals_name: str, rows: int, timeframe: str,
+                 strategy_key: str, account: dict):
+    """工作进程初始化：映射共享内存（零拷贝），建好引擎，供之后的每个任务复用。"""
+    global _worker
+    shm, buf = _attach(bars_name, (5, n), np.float64)
+    bars = Bars(buf[0], buf[1], buf[2], buf[3], buf[4], np.zeros(n, dtype=np.int64))
+    _worker = {"shm": [shm], "engine": BacktestEngine.from_bars(bars, timeframe),
+               "strategy": strategy_key, "account": account, "signals": None}
+    if signals_name:
+        shm, _worker["signals"] = _attach(signals_name, (rows, n), np.int8)
+        _worker["shm"].append(shm)
+
+
+def _score_chunk(keys, chunk, metric: str):
+    """参数扫描的任务：算出这批参数组的信号并在全序列上打分。"""
+    w = _worker
+    sig = signal_matrix(w["engine"], w["strategy"], keys, chunk)
+    return w["engine"].score(sig, metric, **w["account"])
+
+
+def _fill_chunk(keys, chunk, row0: int):
+    """滚动前推的任务一：这批参数组的信号写进共享信号矩阵的 [row0, row0 + len(chunk)) 行。"""
+    w = _worker
+    signal_matrix(w["engine"], w["strategy"], keys, chunk, out=w["signals"][row0:row0 + len(chunk)])
+
+
+def _window_best(start: int, stop: int, metric: str) -> int:
+    """滚动前推的任务二：某个训练窗口上 metric 最高的参数组下标（同值取靠前的）。"""
+    w = _worker
+    return int(np.argmax(w["engine"].score(w["signals"], metric, start, stop, **w["account"])))
+
+
+class WorkerPool:
+    """参数扫描的进程池：行情（5×n float64）与可选的信号矩阵（rows×n int8）放在共享内存里，
+    工作进程启动时映射一次，之后任务只传参数组 / 窗口边界。退出时关闭进程池并释放共享内存。"""
+
+    def __init__(self, bars: Bars, timeframe: str, strategy_key: str, account: dict, workers: int,
+                 signal_rows: int = 0):
+        self.bars, self.timeframe, self.strategy_key = bars, timeframe, strategy_key
+        self.account, self.workers, self.signal_rows = account, workers, signal_rows
+        self.signals = None
+        self._shm, self._executor = [], None
+
+    def __enter__(self):
+        n = len(self.bars)
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, 5 * n * 8))
+            self._shm.append(shm)
+            np.ndarray((5, n), dtype=np.float64, buffer=shm.buf)[:] = (
+                self.bars.days, self.bars.open, self.bars.high, self.bars.low, self.bars.close)
+            signals_name = ""
+            if self.signal_rows:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, self.signal_rows * n))
+                self._shm.append(shm)
+                self.signals = np.ndarray((self.signal_rows, n), dtype=np.int8, buffer=shm.buf)
+                signals_name = shm.name
+            self._executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self._shm[0].name, n, signals_name, self.signal_rows, self.timeframe,
+                          self.strategy_key, self.account))
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def map(self, fn, *iterables):
+        return list(self._executor.map(fn, *iterables))
+
+    def chunks(self, items):
+        """把 items 切成约 workers×8 块：块太大时负载不均，太小则调度开销占比高。返回 [(起始下标, 块), ...]。"""
+        size = max(1, -(-len(items) // (self.workers * 8)))
+        return [(i, items[i:i + size]) for i in range(0, len(items), size)]
+
+    def __exit__(self, *exc):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.signals = None
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+
+# 进程池 / 共享内存建不起来时的异常：无 /dev/shm、不支持信号量（如 Vercel / Lambda）或工作进程启动即退出。
+# 遇到时在当前进程内算，结果相同
+POOL_ERRORS = (OSError, NotImplementedError, BrokenProcessPool)
+
+
+def pool_size(workers: int = None, tasks: int = 0) -> int:
+    """实际进程数：workers 为空时取 OPTIMIZE_WORKERS（0 为 CPU 核数）；组合数少于 OPTIMIZE_POOL_MIN 时为 1。"""
+    workers = workers or OPTIMIZE_WORKERS or os.cpu_count() or 1
+    return 1 if tasks < OPTIMIZE_POOL_MIN else max(1, min(workers, tasks))
+
+
+def evaluate(bars: Bars, strategy_key: str, keys, combos, metric: str = "total_return", timeframe: str = "D",
+             workers: int = 1, account: dict = None):
+    """各参数组在全序列（bars 须已是 timeframe 周期）上的 metric，与 combos 一一对应。返回 (分数数组, 实际进程数)。
+    workers > 1 时用进程池，建不起来（见 POOL_ERRORS）时退回当前进程。"""
+    account = account or {}
+    if workers > 1:
+        try:
+            with WorkerPool(bars, timeframe, strategy_key, account, workers) as pool:
+                parts = pool.map(_score_chunk, itertools.repeat(keys), [c for _, c in pool.chunks(combos)],
+                                 itertools.repeat(metric))
+            return np.concatenate(parts), workers
+        except POOL_ERRORS:
+            pass
+    engine = BacktestEngine.from_bars(bars, timeframe)
+    return engine.score(signal_matrix(engine, strategy_key, keys, combos), metric, **account), 1
+
+
+# ── 结果：排行与热力图 ─────────────────────────────────────────
+
+def heatmap_axes(keys, x: str = None, y: str = None):
+    """热力图的 (x, y) 参数名：默认前两个参数；只有一个参数时 y 为 None。不合法时抛 ValueError。"""
+    x = x or keys[0]
+    y = y or next((k for k in keys if k != x), None)
+    if x not in keys or (y is not None and y not in keys) or x == y:
+        raise ValueError(f"热力图坐标轴须为不同的参数: {', '.join(keys)}")
+    return x, y
+
+
+def heatmap(keys, combos, scores, x: str = None, y: str = None) -> dict:
+    """热力图矩阵：x / y 轴为两个参数实际出现的取值，z[i][j] 为 y=ys[i]、x=xs[j] 的各组中
+    scores 的最大值（其余参数取最优），没有组合的格子为 None。只有一个参数时 y 为 None、z 只有一行。"""
+    x, y = heatmap_axes(keys, x, y)
+    xi = keys.index(x)
+    xs = sorted({c[xi] for c in combos})
+    col = {v: j for j, v in enumerate(xs)}
+    if y is None:
+        ys, rows = [], np.zeros(len(combos), dtype=np.int64)
+    else:
+        yi = keys.index(y)
+        ys = sorted({c[yi] for c in combos})
+        row = {v: i for i, v in enumerate(ys)}
+        rows = np.array([row[c[yi]] for c in combos], dtype=np.int64)
+    z = np.full((max(1, len(ys)), len(xs)), np.nan)
+    if combos:
+        np.fmax.at(z, (rows, np.array([col[c[xi]] for c in combos], dtype=np.int64)),
+                   np.asarray(scores, dtype=np.float64))
+    return {"x": x, "y": y, "xs": xs, "ys": ys,
+            "z": [[None if v != v else v for v in r] for r in z.tolist()]}
+
+
+def _prepare(bars: Bars, strategy_key: str, metric: str, timeframe: str) -> Bars:
+    """校验策略 / 指标 / 周期，返回 timeframe 周期的 K 线。"""
+    if strategy_key not in STRATEGIES:
+        raise ValueError("未知策略")
+    if metric not in METRICS:
+        raise ValueError("metric 可选: " + "/".join(METRICS))
+    if timeframe not in TIMEFRAMES:
+        raise ValueError("timeframe 可选: " + "/".join(TIMEFRAMES))
+    return resample(bars, timeframe) if timeframe != "D" else bars
+
+
+def optimize(bars: Bars, strategy_key: str, ranges: dict = None, method: str = "grid",
+             samples: int = None, seed=None, metric: str = "total_return", top: int = OPTIMIZE_TOP,
+             x: str = None, y: str = None, timeframe: str = "D", workers: int = None, **account) -> dict:
+    """在 bars（日K，已按日期区间截取）上扫描 strategy_key 的参数。account 为 capital / lots / commission / multiplier。
+
+    返回 {strategy, timeframe, method, metric, axes, combos, workers, elapsed, results, heatmap}：
+    results 为按 metric 从高到低（同值保持组合顺序）的前 top 组 {"params", "metrics"}，heatmap 见 heatmap()。
+    参数不合法或数据不足时抛 ValueError。
+    """
+    bars = _prepare(bars, strategy_key, metric, timeframe)
+    if len(bars) < 30:
+        raise ValueError("数据不足（至少需要 30 根 K 线）")
+    axes = param_axes(strategy_key, ranges)
+    keys, combos = combinations(strategy_key, axes, method, samples, seed)
+    x, y = heatmap_axes(keys, x, y)
+    if not combos:
+        raise ValueError("没有满足约束的参数组合")
+
+    t0 = time.perf_counter()
+    scores, workers = evaluate(bars, strategy_key, keys, combos, metric, timeframe,
+                               pool_size(workers, len(combos)), account)
+    # 排行只需前 top 组的完整指标：按分数稳定排序后逐组回测（与分数逐位一致）
+    engine = BacktestEngine.from_bars(bars, timeframe)
+    results = []
+    for i in np.argsort(-scores, kind="stable")[:max(0, int(top))].tolist():
+        params = dict(zip(keys, combos[i]))
+        results.append({"params": params,
+                        "metrics": engine.run(strategy_key, params, detail=False, **account)["metrics"]})
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "strategy": strategy_key,
+        "timeframe": timeframe,
+        "method": method,
+        "metric": metric,
+        "axes": axes,
+        "combos": len(combos),
+        "workers": workers,
+        "elapsed": round(elapsed, 3),
+        "results": results,
+        "heatmap": heatmap(keys, combos, scores.tolist(), x, y),
+    }
+
+
+# ── 滚动前推 ──────────────────────────────────────────────────
+
+def windows(n: int, train: int, test: int, anchored: bool = False):
+    """滚动窗口：[(训练起点, 训练终点 = 测试起点, 测试终点), ...]，下标左闭右开。
+    训练 train 根后测试 test 根，整体每次前移 test 根，最后一段测试可不足 test 根；anchored 时训练起点固定为 0（扩展窗口）。"""
+    out = []
+    for b in range(train, n, test):
+        out.append((0 if anchored else b - train, b, min(b + test, n)))
+    return out
+
+
+def walk_forward(bars: Bars, strategy_key: str, ranges: dict = None, method: str = "grid",
+                 samples: int = None, seed=None, metric: str = "total_return",
+                 train_years: float = WALKFORWARD_TRAIN_YEARS, test_years: float = WALKFORWARD_TEST_YEARS,
+                 anchored: bool = False, timeframe: str = "D", workers: int = None, **account) -> dict:
+    """滚动前推优化：每个训练窗口上按 metric 选出最优参数组（同值取靠前的），在随后的测试窗口上回测。
+
+    窗口长度按年给出，折算为 timeframe 周期的根数（日K每年 252 根等）。各测试段从空仓、初始资金起算，
+    拼接时每段权益加上此前各段的累计盈亏（手数固定，逐段相加即整段的样本外权益）。
+    返回 {strategy, timeframe, method, metric, train_bars, test_bars, anchored, combos, workers, elapsed,
+    windows, metrics, equity, trades, signals}：windows 为各窗口的区间、选中的参数与训练 / 测试指标，
+    metrics / equity / trades / signals 为拼接后的样本外结果（格式同 /api/backtest）。参数不合法或数据不足时抛 ValueError。
+    """
+    bars = _prepare(bars, strategy_key, metric, timeframe)
+    per_year = TIMEFRAMES[timeframe]
+    try:
+        train, test = int(round(float(train_years) * per_year)), int(round(float(test_years) * per_year))
+    except (TypeError, ValueError):
+        raise ValueError("训练 / 测试窗口长度须为数字（年）") from None
+    if train < 30:
+        raise ValueError(f"训练窗口太短：{train_years} 年只有 {train} 根 K 线（至少 30 根）")
+    if test < 1:
+        raise ValueError(f"测试窗口太短：{test_years} 年不足 1 根 K 线")
+    spans = windows(len(bars), train, test, anchored)
+    if not spans:
+        raise ValueError(f"数据不足：共 {len(bars)} 根 K 线，训练窗口需要 {train} 根，之后还须有测试数据")
+    keys, combos = combinations(strategy_key, param_axes(strategy_key, ranges), method, samples, seed)
+    if not combos:
+        raise ValueError("没有满足约束的参数组合")
+    if len(combos) * len(bars) > WALKFORWARD_MAX_SIGNAL_BYTES:
+        raise ValueError(f"{len(combos)} 组 × {len(bars)} 根的信号矩阵超过内存上限，请缩小范围、加大步长或改用 random")
+
+    t0 = time.perf_counter()
+    engine = BacktestEngine.from_bars(bars, timeframe)
+    workers = pool_size(workers, len(combos))
+    if workers > 1:
+        try:
+            with WorkerPool(bars, timeframe, strategy_key, account, workers, signal_rows=len(combos)) as pool:
+                starts, chunks = zip(*pool.chunks(combos))
+                pool.map(_fill_chunk, itertools.repeat(keys), chunks, starts)
+                best = pool.map(_window_best, [a for a, _, _ in spans], [b for _, b, _ in spans],
+                                itertools.repeat(metric))
+                chosen = pool.signals[best]      # 花式索引即拷贝，共享内存释放后仍可用
+        except POOL_ERRORS:
+            workers = 1
+    if workers <= 1:
+        sig = signal_matrix(engine, strategy_key, keys, combos)
+        best = [int(np.argmax(engine.score(sig, metric, a, b, **account))) for a, b, _ in spans]
+        chosen = sig[best]
+
+    # 选中参数的训练 / 测试结果在当前进程内逐窗口回测（与打分逐位一致），测试段按累计盈亏拼接
+    capital = account.get("capital", 100000)
+    dates = engine.dates
+    out_windows, equity, trades, signals = [], [], [], []
+    pnl, holding, values = [], [], []
+    offset = 0.0
+    for (a, b, c), i, row in zip(spans, best, chosen):
+        fit = engine.run_signals(row, a, b, detail=False, **account)["metrics"]
+        res = engine.run_signals(row, b, c, **account)
+        out_windows.append({"train_start": dates[a], "train_end": dates[b - 1],
+                            "test_start": dates[b], "test_end": dates[c - 1],
+                            "params": dict(zip(keys, combos[i])), "train": fit, "test": res["metrics"]})
+        seg = np.array([e["value"] for e in res["equity"]]) + offset
+        values.append(_round(seg))
+        equity += [{"date": e["date"], "value": v} for e, v in zip(res["equity"], values[-1].tolist())]
+        trades += res["trades"]
+        signals += res["signals"]
+        pnl += [t["pnl"] for t in res["trades"]]
+        holding += [t["holding_days"] for t in res["trades"]]
+        offset = float(values[-1][-1]) - capital
+    metrics = BacktestEngine._metrics(np.array(pnl, dtype=np.float64), np.array(holding, dtype=np.int64),
+                                      np.concatenate(values), capital, per_year)
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "strategy": strategy_key,
+        "timeframe": timeframe,
+        "method": method,
+        "metric": metric,
+        "train_bars": train,
+        "test_bars": test,
+        "anchored": bool(anchored),
+        "combos": len(combos),
+        "workers": workers,
+        "elapsed": round(elapsed, 3),
+        "windows": out_windows,
+        "metrics": metrics,
+        "equity": equity,
+        "trades": trades,
+        "signals": signals,
+    }
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 组合回测
+多个品种（每腿各自的策略与参数）共用一个资金池。各品种 K 线对齐到共同日期轴（datastore.align_days），
+拼成「腿数 × 日期」的价格 / 信号矩阵，一次数组运算同时得出全部腿的仓位、成交与盈亏，按日汇总成组合权益：
+- 成交规则与 BacktestEngine 相同：只做多，信号出现后该品种的下一根开盘成交，末根的信号不执行，期末持仓按末根收盘平仓；
+- 某品种当日无数据（尚未上市、交易日不同）时不成交，持仓按最近收盘计价；
+- 每腿的合约乘数取 CONTRACT_MULTI，手续费按手数双边收取。
+资金池（不加杠杆）：各腿共用一份权益。开仓按信号所在根的组合权益（持仓按该根收盘计价）定手数，且全部持仓的
+合约价值（按该根收盘）加上新开仓的合约价值（按成交价）不超过该权益，超出时缩减手数，不足 1 手不开仓；
+同一根上平仓的腿在下一根开盘同时成交，释放的额度可供同根开仓的腿使用，同一根多腿开仓按腿的顺序分配。
+手数分配（allocation，即在上述额度内希望开的手数）：
+- fixed：每腿固定手数（lots，可逐腿指定）；
+- equal：开仓时的组合权益按腿数等分，按开仓价的合约价值（价格 × 乘数）折算手数，向下取整；
+- weight：同 equal，按各腿 weight 的比例分配权益。
+开仓手数依赖此前各笔的盈亏，按开仓事件顺序逐个确定（事件数为成交笔数，不逐根循环）；仓位、成交价与盈亏仍是矩阵运算。
+"""
+
+import numpy as np
+
+from backtest import STRATEGIES, BacktestEngine, _round
+from config import CONTRACT_MULTI
+from datastore import align_days
+from resample import TIMEFRAMES, resample
+
+ALLOCATIONS = ("fixed", "equal", "weight")
+
+
+def _take(matrix: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """逐行按列下标取值（cols 中的 -1 取第 0 列，由调用方另行屏蔽）。"""
+    return np.take_along_axis(matrix, np.maximum(cols, 0), axis=1)
+
+
+def _last_where(mask: np.ndarray) -> np.ndarray:
+    """逐行：截至每一列最近一个 mask 为真的列下标，之前没有为 -1。"""
+    cols = np.arange(mask.shape[1], dtype=np.int64)
+    return np.maximum.accumulate(np.where(mask, cols, -1), axis=1)
+
+
+def _next_where(mask: np.ndarray) -> np.ndarray:
+    """逐行：每一列之后（不含本列）最近一个 mask 为真的列下标，之后没有为列数。"""
+    n = mask.shape[1]
+    nxt = np.full(mask.shape, n, dtype=np.int64)
+    if n > 1:
+        idx = np.where(mask[:, 1:], np.arange(1, n), n)
+        nxt[:, :-1] = np.minimum.accumulate(idx[:, ::-1], axis=1)[:, ::-1]
+    return nxt
+
+
+class PortfolioEngine:
+    """多品种组合回测。bars 为 {品种代码: 日K Bars}（已按日期区间截取），timeframe 为 W/M/Q 时各品种先合成再对齐。"""
+
+    def __init__(self, bars: dict, timeframe="D"):
+        if timeframe not in TIMEFRAMES:
+            raise ValueError("timeframe 可选: " + "/".join(TIMEFRAMES))
+        self.timeframe = timeframe
+        self.engines = {}
+        for symbol, b in bars.items():
+            if b is None or not len(b):
+                raise ValueError(f"{symbol} 在所选区间内无数据")
+            self.engines[symbol] = BacktestEngine.from_bars(resample(b, timeframe), timeframe)
+        if not self.engines:
+            raise ValueError("至少需要一个品种")
+        days, index = align_days([e.arrays()[4] for e in self.engines.values()])
+        self.days = days
+        self.dates = np.datetime_as_string(days.astype("datetime64[D]"), unit="D").tolist()
+        self.n = len(days)
+        self._index = dict(zip(self.engines, index))
+
+    def leg(self, spec: dict, lots=1) -> dict:
+        """规整一腿：{symbol, strategy, params, lots, weight, multiplier}，缺省项取默认值。不合法时抛 ValueError。"""
+        symbol = spec.get("symbol")
+        if symbol not in self.engines:
+            raise ValueError(f"组合中没有品种: {symbol}")
+        strategy = spec.get("strategy", "ma_cross")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"未知策略: {strategy}")
+        try:
+            out = {"symbol": symbol, "strategy": strategy,
+                   "params": {p["key"]: spec.get("params", {}).get(p["key"], p["default"])
+                              for p in STRATEGIES[strategy]["params"]},
+                   "lots": int(spec.get("lots", lots)),
+                   "weight": float(spec.get("weight", 1)),
+                   "multiplier": float(spec.get("multiplier", CONTRACT_MULTI.get(symbol, 10)))}
+        except (TypeError, ValueError, AttributeError):
+            raise ValueError(f"{symbol} 的 lots / weight / multiplier 须为数字") from None
+        if out["lots"] < 0 or out["weight"] < 0:
+            raise ValueError(f"{symbol} 的 lots / weight 不能为负")
+        return out
+
+    def matrices(self, legs):
+        """各腿对齐到日期轴的 (有无数据, 开盘, 收盘, 信号) 矩阵，形状均为 腿数 × 日期。
+        收盘价向后填充（无数据的日子沿用最近收盘，上市前为 NaN）；信号只在有数据的日子非零，各腿末根的信号清零。"""
+        m, n = len(legs), self.n
+        have = np.zeros((m, n), dtype=bool)
+        opens = np.full((m, n), np.nan)
+        closes = np.full((m, n), np.nan)
+        sig = np.zeros((m, n), dtype=np.int8)
+        for r, leg in enumerate(legs):
+            engine = self.engines[leg["symbol"]]
+            idx = self._index[leg["symbol"]]
+            have[r] = idx >= 0
+            src = idx[have[r]]
+            o, _, _, c, _ = engine.arrays()
+            opens[r, have[r]] = o[src]
+            closes[r, have[r]] = c[src]
+            sig[r, have[r]] = engine.signals(leg["strategy"], leg["params"])[src]
+        last = _last_where(have)
+        closes = np.where(last >= 0, _take(closes, last), np.nan)
+        sig[np.arange(m), last[:, -1]] = 0
+        return have, opens, closes, sig
+
+    def _size(self, legs, buy, sell, end, price, closes, multi, capital, commission, share):
+        """按资金池逐笔定开仓手数，返回与 buy 同形的手数矩阵（见模块说明）。share 为各腿的权益占比，None 为 fixed。
+
+        组合权益只在开仓事件处需要：已平仓各笔的盈亏与已开仓的手续费累加在 realized 里，持仓按信号所在根的收盘计价；
+        每笔的平仓列与每手盈亏（含双边手续费）事先按矩阵算好。
+        """
+        n = self.n
+        size = np.zeros(buy.shape)
+        b_r, b_c = np.nonzero(buy)
+        if not len(b_r):
+            return size
+        order = np.lexsort((b_r, b_c))
+        b_r, b_c = b_r[order], b_c[order]
+        nxt = _next_where(sell)[b_r, b_c]
+        forced = nxt >= n
+        close_c = np.where(forced, end[b_r], nxt)
+        fill = price[b_r, b_c]
+        exit_price = np.where(forced, closes[b_r, end[b_r]], price[b_r, np.minimum(nxt, n - 1)])
+        unit_pnl = ((exit_price - fill) * multi[b_r] - commission).tolist()
+        unit_cost = (fill * multi[b_r]).tolist()
+        lots = [float(leg["lots"]) for leg in legs]
+        closing = np.argsort(close_c, kind="stable").tolist()
+        close_at = close_c.tolist()
+        rows, cols = b_r.tolist(), b_c.tolist()
+
+        lot_value = np.ascontiguousarray((np.nan_to_num(closes) * multi[:, None]).T)   # 日期 × 腿，每手合约价值
+        held = np.zeros(len(legs))                 # 各腿当前持仓手数
+        held_until = np.full(len(legs), -1)        # 平仓列
+        qty = [0.0] * len(rows)
+        realized, cost_sum, k, i = float(capital), 0.0, 0, 0
+        while i < len(rows):
+            c = cols[i]
+            while k < len(closing) and close_at[closing[k]] < c:
+                t = closing[k]
+                if qty[t]:
+                    realized += qty[t] * unit_pnl[t]
+                    cost_sum -= qty[t] * unit_cost[t]
+                    held[rows[t]] = 0.0
+                k += 1
+            mark = lot_value[c] * held
+            total = float(mark.sum())
+            equity = realized + total - cost_sum
+            committed = total - float(mark[held_until == c].sum())
+            while i < len(rows) and cols[i] == c:
+                r, unit = rows[i], unit_cost[i]
+                q = 0.0
+                if unit > 0:
+                    want = lots[r] if share is None else equity * share[r] / unit
+                    q = max(float(np.floor(min(want, (equity - committed) / unit))), 0.0)
+                elif unit == 0 and share is None:
+                    q = lots[r]            # 开盘价为 0 的坏数据：不占额度，fixed 照常成交（与单品种回测一致）
+                if q:
+                    qty[i] = q
+                    committed += q * unit
+                    cost_sum += q * unit
+                    realized -= commission * q
+                    held[r], held_until[r] = q, close_at[i]
+                i += 1
+        size[b_r, b_c] = qty
+        return size
+
+    def run(self, legs, capital=100000, lots=1, commission=5, allocation="fixed", detail=True):
+        """回测组合。legs 为 [{symbol, strategy, params, lots, weight, multiplier}, ...]（见 leg()），
+        lots 为各腿未指定时的默认手数。返回 {allocation, timeframe, metrics, legs, dates, equity, drawdown, trades}：
+        metrics 另有 max_exposure（持仓合约价值占权益的最高百分比），legs 为各腿的设置、成交笔数、盈亏与
+        逐日累计盈亏 equity（对应 dates）；detail 为 False 时只返回 {"metrics"}。"""
+        if allocation not in ALLOCATIONS:
+            raise ValueError("allocation 可选: " + "/".join(ALLOCATIONS))
+        legs = [self.leg(spec, lots) for spec in legs]
+        if not legs:
+            raise ValueError("至少需要一腿")
+        m, n = len(legs), self.n
+        rows = np.arange(m)
+        cols = np.arange(n, dtype=np.int64)
+        have, opens, closes, sig = self.matrices(legs)
+        multi = np.array([leg["multiplier"] for leg in legs])[:, None]
+
+        # 仓位：截至某根最近的非零信号为买入即持有。与 BacktestEngine 的记账一致：开 / 平仓在信号所在根记入权益，
+        # 成交价为该腿下一根有数据的 K 线开盘价；各腿末根之后不再持仓
+        end = _last_where(have)[:, -1]
+        valid = cols <= end[:, None]
+        last_sig = _last_where(sig != 0)
+        long = (_take(sig, last_sig) == 1) & (last_sig >= 0) & valid
+        was = np.zeros_like(long)
+        was[:, 1:] = long[:, :-1]
+        buy = long & ~was
+        sell = was & ~long & valid
+        open_end = long[rows, end]
+        fill = _next_where(have)
+        price = np.where(fill < n, _take(opens, np.minimum(fill, n - 1)), np.nan)
+
+        # 手数：开仓时按资金池定，持有期间不变
+        if allocation == "fixed":
+            share = None
+        else:
+            w = np.array([1.0 if allocation == "equal" else leg["weight"] for leg in legs])
+            if w.sum() <= 0:
+                raise ValueError("各腿 weight 之和须为正")
+            share = w / w.sum()
+        size = self._size(legs, buy, sell, end, price, closes, multi[:, 0], capital, commission, share)
+        entry = _last_where(buy)
+        cost = _take(price, entry)
+        qty = _take(size, entry)
+        fee = commission * qty
+
+        # 现金变动：开仓扣手续费，平仓计入该笔盈亏；期末强平的一笔计入该腿末根之后的现金
+        sell_pnl = (price - cost) * multi * qty - fee
+        end_pnl = (closes[rows, end] - cost[rows, end]) * multi[:, 0] * qty[rows, end] - fee[rows, end]
+        deltas = np.where(buy, -fee, np.where(sell, sell_pnl, 0.0))
+        after = open_end & (end + 1 < n)
+        deltas[rows[after], end[after] + 1] += end_pnl[after]
+        # 持仓按收盘计价，末根为强平盈亏
+        marked = np.where(long, (closes - cost) * multi * qty, 0.0)
+        marked[rows[open_end], end[open_end]] = end_pnl[open_end]
+
+        total = deltas.sum(axis=0)
+        total[0] += float(capital)
+        values = _round(np.cumsum(total) + marked.sum(axis=0))
+
+        # 成交：按平仓日期排序（同一日按腿的顺序），不足 1 手的不算
+        forced_at = (cols == end[:, None]) & open_end[:, None]
+        tr_r, tr_c = np.nonzero(sell | forced_at)
+        keep = qty[tr_r, tr_c] > 0
+        tr_r, tr_c = tr_r[keep], tr_c[keep]
+        forced = ~sell[tr_r, tr_c]
+        exit_c = np.where(forced, tr_c, fill[tr_r, tr_c])
+        order = np.lexsort((tr_r, exit_c))
+        tr_r, tr_c, exit_c, forced = tr_r[order], tr_c[order], exit_c[order], forced[order]
+        entry_c = fill[tr_r, entry[tr_r, tr_c]]
+        lots_t = qty[tr_r, tr_c]
+        raw_pnl = np.where(forced, end_pnl[tr_r], sell_pnl[tr_r, tr_c])
+        pnl = _round(raw_pnl)
+        holding = self.days[exit_c].astype(np.int64) - self.days[entry_c]
+        metrics = BacktestEngine._metrics(pnl, holding, values, capital, TIMEFRAMES[self.timeframe])
+        notional = np.where(long, np.nan_to_num(closes) * multi * qty, 0.0).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            exposure = np.where(values > 0, notional / values * 100, 0.0)
+        metrics["max_exposure"] = round(float(exposure.max()), 2) if n else 0.0
+        if not detail:
+            return {"metrics": metrics}
+
+        # 以下只在输出边界转成 dict / 列表
+        dates = self.dates
+        peak = np.maximum(np.maximum.accumulate(values), capital)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dd = _round(np.where(peak != 0, (values - peak) / peak * 100, 0.0))
+        leg_curve = _round(np.cumsum(deltas, axis=1) + marked)
+        leg_out = []
+        for r, leg in enumerate(legs):
+            mine = pnl[tr_r == r]
+            leg_out.append(dict(
+                leg, trades=int(len(mine)), pnl=round(float(mine.sum()), 2),
+                win_rate=round(float((mine > 0).sum()) / len(mine) * 100, 1) if len(mine) else 0,
+                first_date=dates[int(np.argmax(have[r]))], last_date=dates[int(end[r])],
+                equity=leg_curve[r].tolist()))
+        entry_price = price[tr_r, entry[tr_r, tr_c]].tolist()
+        exit_price = np.where(forced, closes[tr_r, exit_c], price[tr_r, tr_c]).tolist()
+        pnl_pct = _round(raw_pnl / capital * 100).tolist()
+        trades = [{
+            "symbol": legs[r]["symbol"],
+            "strategy": legs[r]["strategy"],
+            "lots": int(q),
+            "entry_date": dates[e],
+            "entry_price": round(ep, 2),
+            "exit_date": dates[x],
+            "exit_price": round(xp, 2),
+            "pnl": p,
+            "pnl_pct": pp,
+            "holding_days": h,
+        } for r, e, x, q, ep, xp, p, pp, h in zip(tr_r.tolist(), entry_c.tolist(), exit_c.tolist(), lots_t.tolist(),
+                                                  entry_price, exit_price, pnl.tolist(), pnl_pct, holding.tolist())]
+        return {
+            "allocation": allocation,
+            "timeframe": self.timeframe,
+            "metrics": metrics,
+            "legs": leg_out,
+            "dates": dates,
+            "equity": [{"date": d, "value": v} for d, v in zip(dates, values.tolist())],
+            "drawdown": [{"date": d, "value": v} for d, v in zip(dates, dd.tolist())],
+            "trades": trades,
+        }
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 周期合成
+由日K一次向量化计算合成周 / 月 / 季 K：按周期编号切桶，reduceat 求开（首）高（最高）低（最低）收（末）量（和），
+日期取周期内最后一个交易日（该根 K 线收盘的日子）。
+合成结果按「品种 + 周期」缓存：日K数据版本不变时直接复用；新增日K（只追加）时只重算最后一个（可能未走完的）周期及之后。
+"""
+
+import threading
+
+import numpy as np
+
+from datastore import Bars, dates_to_days, get_bars
+
+# 周期：D 日、W 周（周一至周日）、M 月、Q 季；值为每年约多少根，用于年化
+TIMEFRAMES = {"D": 252, "W": 52, "M": 12, "Q": 4}
+
+
+def period_keys(days: np.ndarray, tf: str) -> np.ndarray:
+    """每根日K所属周期的编号（单调不减）。1970-01-01 为周四，(days + 3) // 7 即以周一起算的周序号。"""
+    if tf == "W":
+        return (days.astype(np.int64) + 3) // 7
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return months // 3 if tf == "Q" else months
+
+
+def resample(bars: Bars, tf: str) -> Bars:
+    """日K -> 周 / 月 / 季 K（tf 为 D 时原样返回）。"""
+    if tf not in TIMEFRAMES:
+        raise ValueError(f"未知周期: {tf!r}（可选 {'/'.join(TIMEFRAMES)}）")
+    if tf == "D" or not len(bars):
+        return bars
+    keys = period_keys(bars.days, tf)
+    edges = np.flatnonzero(np.diff(keys)) + 1
+    first = np.concatenate([[0], edges])
+    last = np.append(edges, len(bars)) - 1
+    return Bars(bars.days[last], bars.open[first],
+                np.maximum.reduceat(bars.high, first), np.minimum.reduceat(bars.low, first),
+                bars.close[last], np.add.reduceat(bars.volume, first))
+
+
+def resample_lists(dates, opens, highs, lows, closes, volumes, tf: str):
+    """列表形式的日K序列合成为 tf 周期，返回同样顺序的 6 个列表。"""
+    r = resample(Bars(dates_to_days(dates), opens, highs, lows, closes, volumes), tf)
+    return (r.dates, r.open.tolist(), r.high.tolist(), r.low.tolist(), r.close.tolist(),
+            r.volume.tolist())
+
+
+def _concat(head: Bars, tail: Bars) -> Bars:
+    return Bars(np.concatenate([head.days, tail.days]), np.concatenate([head.open, tail.open]),
+                np.concatenate([head.high, tail.high]), np.concatenate([head.low, tail.low]),
+                np.concatenate([head.close, tail.close]), np.concatenate([head.volume, tail.volume]))
+
+
+class _Entry:
+    """某品种某周期的缓存：来源日K实例、合成结果，以及增量续算所需的边界信息。"""
+
+    __slots__ = ("daily", "result", "n", "tail_start")
+
+    def __init__(self, daily: Bars, result: Bars, tf: str):
+        self.daily = daily
+        self.result = result
+        self.n = len(daily)
+        # 最后一个周期在日K中的起始下标：续算时从这里重算（该周期可能尚未走完）
+        keys = period_keys(daily.days, tf)
+        self.tail_start = int(np.searchsorted(keys, keys[-1], "left"))
+
+
+class ResampleCache:
+    """合成周期 K 的进程内缓存：(symbol, tf) -> _Entry。线程安全。
+
+    日K为同一实例（数据版本未变）时直接命中；新版本的日K确实是旧版本追加新交易日所得（补全流程即如此）时，
+    保留旧结果中已走完的周期，只合成最后一个周期起的部分；其余情况（含更正改写了历史 K 线）整体重算。
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, daily: Bars, tf: str) -> Bars:
+        if tf == "D" or not len(daily):
+            return resample(daily, tf)
+        key = (symbol, tf)
+        entry = self._entries.get(key)
+        if entry is not None and entry.daily is daily:
+            return entry.result
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.daily is daily:
+                return entry.result
+            if entry is not None and self._extends(entry, daily):
+                result = _concat(entry.result.take(slice(0, -1)),
+                                 resample(daily.take(slice(entry.tail_start, None)), tf))
+            else:
+                result = resample(daily, tf)
+            self._entries[key] = _Entry(daily, result, tf)
+            return result
+
+    @staticmethod
+    def _extends(entry: _Entry, daily: Bars) -> bool:
+        """daily 是否为旧日K追加新行所得：行数增加，且旧结果中已走完的周期（续算起点之前）的日K逐行不变。
+        续算起点之后的部分本来就会重算，不必比较。"""
+        if len(daily) <= entry.n:
+            return False
+        old, k = entry.daily, entry.tail_start
+        return all(np.array_equal(getattr(daily, f)[:k], getattr(old, f)[:k])
+                   for f in ("days", "open", "high", "low", "close", "volume"))
+
+
+# 进程内共享实例
+CACHE = ResampleCache()
+
+
+def get_resampled(symbol: str, name: str, tf: str = "D"):
+    """从共享缓存取某品种 tf 周期的 Bars（日K来自 datastore.get_bars），无数据返回 None。"""
+    if tf not in TIMEFRAMES:
+        raise ValueError(f"未知周期: {tf!r}（可选 {'/'.join(TIMEFRAMES)}）")
+    daily = get_bars(symbol, name)
+    if daily is None:
+        return None
+    return CACHE.get(symbol, daily, tf)
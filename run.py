@@ -7,50 +7,203 @@
 import argparse
 import os
 import sys
+from datetime import datetime
 
 # 确保当前目录在 path 里，便于直接 python run.py
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from config import DATA_DIR, SYMBOL_LIST
+from config import DATA_DIR, OPTIMIZE_TOP, SYMBOL_LIST, WALKFORWARD_TEST_YEARS, WALKFORWARD_TRAIN_YEARS
 
 
-def cmd_fetch():
-    """1. 从新浪拉取历史日K（自上市起）。"""
+def cmd_fetch(offline: bool = False):
+    """1. 从新浪拉取历史日K（自上市起）。offline 时只用本地响应缓存，不联网。"""
     from sina_futures_history import main
-    main()
+    main(cache_mode="replay") if offline else main()
 
 
-def cmd_supplement():
-    """2. 用 akshare 补全 2024-07-18 之后的数据，与现有 CSV 合并。"""
+def cmd_supplement(offline: bool = False):
+    """2. 用 akshare 补全 2024-07-18 之后的数据，与现有 CSV 合并。offline 时只用本地响应缓存。"""
     from supplement_futures_akshare import main
-    main()
+    main(cache_mode="replay") if offline else main()
 
 
-def cmd_fill_dates():
-    """3. 将 CSV 补全为全部日历日期（非交易日用前收填充）。"""
+def cmd_fill_dates(out_dir: str = None):
+    """3. 日历补全（读取时视图，不改写 CSV）：统计行数，给定 out_dir 时导出补全后的 CSV。"""
     from fill_all_dates import main
-    main()
+    main(out_dir)
+
 
+def cmd_sidecar(force: bool = False):
+    """生成二进制列式缓存 data/*.bars（CSV 为准，仅重建过期的），供 Web/回测内存映射。"""
+    from datastore import build_sidecars
+    for code, n, rebuilt in build_sidecars(force=force):
+        print(f"  {code}: {n} 条 -> {'已重建' if rebuilt else '未变化，跳过'}")
 
-def cmd_export():
-    """4. 根据 CSV 生成带 K 线图 + MA20 的 Excel。"""
+
+def cmd_export(force: bool = False):
+    """4. 根据 CSV 生成带 K 线图 + MA20 的 Excel（CSV 均未变化时跳过）。"""
     from csv_to_excel_with_chart import main
-    main()
+    main(force)
+
+
+def cmd_snapshot():
+    """预生成静态快照 static/snapshot/*.json.gz（接口响应的 gzip JSON），供 Vercel 等只读部署直接返回文件。"""
+    from snapshot import build_snapshot
+    r = build_snapshot()
+    print(f"  快照 {r['files']} 个文件（{r['keys']} 个请求键），更新 {r['written']} 个，删除旧文件 {r['removed']} 个")
+
+
+def _date_arg(text: str) -> str:
+    """argparse 的 type：--start / --end 须为有效的 YYYY-MM-DD。"""
+    try:
+        datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期应为有效的 YYYY-MM-DD: {text}") from None
+    return text
+
+
+def _scan_input(args, parser):
+    """optimize / walkforward 共用：按 --symbol / --start / --end 截取日K，解析 --param。返回 (bars, ranges)。
+    参数错误经 parser.error 报用法错误。"""
+    from datastore import get_bars
+
+    name = dict(SYMBOL_LIST).get(args.symbol)
+    bars = get_bars(args.symbol, name) if name else None
+    if bars is None or not len(bars):
+        parser.error(f"无数据或未知品种: {args.symbol}")
+    ranges = {}
+    for item in args.param or []:
+        key, sep, spec = item.partition("=")
+        if not sep:
+            parser.error(f"--param 格式应为 名称=min:max[:step] 或 名称=值,值,...: {item}")
+        ranges[key] = [v for v in spec.split(",")] if "," in spec else spec
+    i0, i1 = bars.locate(args.start, args.end)
+    return bars.take(slice(i0, i1)), ranges
+
+
+def cmd_optimize(args, parser):
+    """回测参数扫描：在策略声明的参数范围（或 --param 指定的范围）上网格 / 随机搜索，多进程执行，打印排行。"""
+    import json
+    from config import CONTRACT_MULTI
+    from optimize import optimize
+
+    bars, ranges = _scan_input(args, parser)
+    try:
+        r = optimize(bars, args.strategy, ranges=ranges, method=args.method,
+                     samples=args.samples, seed=args.seed, metric=args.metric, top=args.top,
+                     timeframe=args.timeframe, workers=args.workers,
+                     multiplier=CONTRACT_MULTI.get(args.symbol, 10))
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"  {args.symbol} {r['strategy']}（{r['timeframe']}）{r['method']}：{r['combos']} 组，"
+          f"{r['workers']} 个进程，耗时 {r['elapsed']:.2f}s，按 {r['metric']} 排序")
+    keys = list(r["axes"])
+    cols = ["total_return", "annual_return", "max_drawdown", "win_rate", "total_trades", "profit_factor"]
+    print("  " + "".join(f"{k:>10}" for k in keys) + "".join(f"{c:>16}" for c in cols))
+    for row in r["results"]:
+        print("  " + "".join(f"{row['params'][k]:>10}" for k in keys)
+              + "".join(f"{row['metrics'][c]:>16}" for c in cols))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False)
+        print(f"  完整结果（含热力图矩阵）已写入 {args.json}")
 
 
-def cmd_all(fill_calendar: bool = False):
-    """全流程：fetch → supplement → [fill_dates] → export。"""
-    print("======== 1/4 拉取新浪历史 ========\n")
-    cmd_fetch()
-    print("\n======== 2/4 补全最新（akshare） ========\n")
-    cmd_supplement()
+def cmd_walkforward(args, parser):
+    """滚动前推：每个训练窗口扫描参数选出最优，在随后的测试窗口上回测，打印各窗口与拼接后的样本外指标。"""
+    import json
+    from config import CONTRACT_MULTI
+    from optimize import walk_forward
+
+    bars, ranges = _scan_input(args, parser)
+    try:
+        r = walk_forward(bars, args.strategy, ranges=ranges, method=args.method,
+                         samples=args.samples, seed=args.seed, metric=args.metric,
+                         train_years=args.train_years, test_years=args.test_years, anchored=args.anchored,
+                         timeframe=args.timeframe, workers=args.workers,
+                         multiplier=CONTRACT_MULTI.get(args.symbol, 10))
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"  {args.symbol} {r['strategy']}（{r['timeframe']}）{r['method']}：{r['combos']} 组 × {len(r['windows'])} 个窗口"
+          f"（训练 {r['train_bars']} 根{'，起点固定' if r['anchored'] else ''}，测试 {r['test_bars']} 根），"
+          f"{r['workers']} 个进程，耗时 {r['elapsed']:.2f}s，按 {r['metric']} 选参")
+    print(f"  {'测试区间':<24}{'参数':<28}{'训练 ' + r['metric']:>22}{'测试收益%':>12}{'测试回撤%':>12}")
+    for w in r["windows"]:
+        params = " ".join(f"{k}={v}" for k, v in w["params"].items())
+        print(f"  {w['test_start'] + '~' + w['test_end']:<24}{params:<28}{w['train'][r['metric']]:>22}"
+              f"{w['test']['total_return']:>12}{w['test']['max_drawdown']:>12}")
+    m = r["metrics"]
+    print(f"  样本外合计：收益 {m['total_return']}%，年化 {m['annual_return']}%，最大回撤 {m['max_drawdown']}%，"
+          f"胜率 {m['win_rate']}%，{m['total_trades']} 笔，盈亏比 {m['profit_factor']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False)
+        print(f"  完整结果（含样本外权益曲线与成交）已写入 {args.json}")
+
+
+def cmd_portfolio(args, parser):
+    """组合回测：--symbols 的各品种（默认全部）用同一策略、共用一个资金池，打印组合与各腿的结果。
+    --symbols / --param 写错或区间内无数据时经 parser.error 报用法错误。"""
+    import json
+    from datastore import get_bars
+    from portfolio import PortfolioEngine
+
+    name_map = dict(SYMBOL_LIST)
+    codes = [c.strip() for c in (args.symbols or ",".join(name_map)).split(",") if c.strip()]
+    unknown = [c for c in codes if c not in name_map]
+    if unknown:
+        parser.error("未知品种: " + ",".join(unknown))
+    params = {}
+    for item in args.param or []:
+        key, sep, value = item.partition("=")
+        try:
+            if not sep:
+                raise ValueError
+            params[key] = float(value) if "." in value else int(value)
+        except ValueError:
+            parser.error(f"--param 格式应为 名称=数值: {item}")
+    bars = {}
+    for code in codes:
+        b = get_bars(code, name_map[code])
+        i0, i1 = b.locate(args.start, args.end) if b is not None else (0, 0)
+        bars[code] = b.take(slice(i0, i1)) if b is not None else None
+    try:
+        engine = PortfolioEngine(bars, args.timeframe)
+        r = engine.run([{"symbol": c, "strategy": args.strategy, "params": params} for c in codes],
+                       capital=args.capital, lots=args.lots, allocation=args.allocation)
+    except ValueError as e:
+        parser.error(str(e))
+    m = r["metrics"]
+    print(f"  组合 {','.join(codes)} {args.strategy}（{r['timeframe']}，{r['allocation']}）：{engine.n} 根，"
+          f"{r['equity'][0]['date']} ~ {r['equity'][-1]['date']}")
+    print(f"  收益 {m['total_return']}%，年化 {m['annual_return']}%，最大回撤 {m['max_drawdown']}%，胜率 {m['win_rate']}%，"
+          f"{m['total_trades']} 笔，盈亏比 {m['profit_factor']}，最高持仓占权益 {m['max_exposure']}%")
+    print(f"  {'品种':<8}{'起始':<12}{'交易':>6}{'胜率%':>8}{'盈亏(元)':>14}")
+    for leg in r["legs"]:
+        print(f"  {leg['symbol']:<8}{leg['first_date']:<12}{leg['trades']:>6}{leg['win_rate']:>8}{leg['pnl']:>14}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False)
+        print(f"  完整结果（含组合 / 各腿权益曲线与成交）已写入 {args.json}")
+
+
+def cmd_all(fill_calendar: bool = False, offline: bool = False):
+    """全流程：fetch → supplement → [fill_dates] → sidecar → export → snapshot。"""
+    print("======== 1/6 拉取新浪历史 ========\n")
+    cmd_fetch(offline)
+    print("\n======== 2/6 补全最新（akshare） ========\n")
+    cmd_supplement(offline)
     if fill_calendar:
-        print("\n======== 3/4 补全日历 ========\n")
+        print("\n======== 3/6 补全日历 ========\n")
         cmd_fill_dates()
     else:
-        print("\n（跳过补全日历，仅交易日。加 --fill-dates 可补全）\n")
-    print("======== 4/4 导出 Excel ========\n")
+        print("\n（跳过日历补全统计；网页 / 接口加 ?calendar=1 即为日历补全视图）\n")
+    print("======== 4/6 生成列式缓存 ========\n")
+    cmd_sidecar()
+    print("\n======== 5/6 导出 Excel ========\n")
     cmd_export()
+    print("\n======== 6/6 生成静态快照 ========\n")
+    cmd_snapshot()
     print("\n数据系统全流程完成。")
 
 
@@ -61,39 +214,97 @@ def main():
         epilog="""
 示例:
   python run.py all               # 全流程（不补全日历）
-  python run.py all --fill-dates  # 全流程并补全全部日历日期
+  python run.py all --fill-dates  # 全流程并统计日历补全视图
   python run.py fetch            # 仅拉取新浪
+  python run.py all --offline     # 离线：只用 .cache/fetch 中缓存的响应
   python run.py supplement       # 仅补全 2024-07-18 后
-  python run.py fill-dates       # 仅补全日历
+  python run.py fill-dates       # 日历补全统计（--out 目录 导出补全后的 CSV）
+  python run.py sidecar          # 仅生成 data/*.bars 列式缓存
   python run.py export          # 仅生成 Excel
+  python run.py snapshot        # 仅生成 static/snapshot 静态快照（Vercel 部署前运行）
+  python run.py optimize --symbol C0 --strategy ma_cross        # 双均线全参数网格扫描
+  python run.py optimize --strategy boll --method random --samples 300 --param period=10:60:5
+  python run.py walkforward --symbol C0 --strategy ma_cross --train-years 3 --test-years 1   # 滚动前推
+  python run.py portfolio --strategy boll --allocation equal    # 全部品种组合回测（共用资金）
         """,
     )
     parser.add_argument(
         "command",
         nargs="?",
         default="all",
-        choices=["all", "fetch", "supplement", "fill-dates", "export"],
+        choices=["all", "fetch", "supplement", "fill-dates", "sidecar", "export", "snapshot", "optimize", "walkforward", "portfolio"],
         help="要执行的步骤（默认: all）",
     )
     parser.add_argument(
         "--fill-dates",
         action="store_true",
-        help="在 all 流程中补全全部日历日期（非交易日用前收填充）",
+        help="在 all 流程中统计日历补全视图（非交易日沿用前一交易日价格；不改写 CSV）",
+    )
+    parser.add_argument(
+        "--out",
+        default=None,
+        help="fill-dates：把日历补全后的 CSV 导出到该目录（源数据不变）",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="sidecar / export：忽略新鲜度检查，全部重建",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="fetch / supplement 只回放本地响应缓存，不联网（缓存未命中的品种报错跳过）",
+    )
+    opt = parser.add_argument_group("optimize / walkforward（回测参数扫描 / 滚动前推）")
+    opt.add_argument("--symbol", default="C0", help="品种代码（默认 C0）")
+    opt.add_argument("--strategy", default="ma_cross", help="策略（ma_cross / macd / boll / kdj）")
+    opt.add_argument("--param", action="append", metavar="名称=范围",
+                     help="参数取值：min:max[:step] 或 值,值,...；可多次指定，未指定的用策略声明的范围")
+    opt.add_argument("--method", default="grid", choices=["grid", "random"], help="网格或随机抽样（默认 grid）")
+    opt.add_argument("--samples", type=int, default=None, help="random：抽样组数")
+    opt.add_argument("--seed", type=int, default=None, help="random：随机种子")
+    opt.add_argument("--metric", default="total_return", help="排序指标（默认 total_return）")
+    opt.add_argument("--top", type=int, default=OPTIMIZE_TOP, help=f"打印前几名（默认 {OPTIMIZE_TOP}）")
+    opt.add_argument("--timeframe", default="D", choices=["D", "W", "M", "Q"], help="K 线周期（默认日K）")
+    opt.add_argument("--start", default=None, type=_date_arg, help="起始日期 YYYY-MM-DD")
+    opt.add_argument("--end", default=None, type=_date_arg, help="截止日期 YYYY-MM-DD")
+    opt.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    opt.add_argument("--json", default=None, metavar="PATH", help="把完整结果写成 JSON")
+    opt.add_argument("--train-years", type=float, default=WALKFORWARD_TRAIN_YEARS,
+                     help=f"walkforward：训练窗口（年，默认 {WALKFORWARD_TRAIN_YEARS:g}）")
+    opt.add_argument("--test-years", type=float, default=WALKFORWARD_TEST_YEARS,
+                     help=f"walkforward：测试窗口，也是每次前移的长度（年，默认 {WALKFORWARD_TEST_YEARS:g}）")
+    opt.add_argument("--anchored", action="store_true", help="walkforward：训练起点固定为区间开头（扩展窗口）")
+    pf = parser.add_argument_group("portfolio（组合回测，另用上面的 --strategy / --param 名称=值 / --timeframe / --start / --end / --json）")
+    pf.add_argument("--symbols", default=None, help="品种代码，逗号分隔（默认全部）")
+    pf.add_argument("--allocation", default="fixed", choices=["fixed", "equal"],
+                    help="手数分配：fixed 每腿固定手数、equal 开仓时的组合权益等分按开仓价折算手数；均受资金池额度限制（默认 fixed）")
+    pf.add_argument("--capital", type=float, default=100000, help="初始资金（默认 100000）")
+    pf.add_argument("--lots", type=int, default=1, help="fixed：每腿手数（默认 1）")
     args = parser.parse_args()
 
     os.makedirs(DATA_DIR, exist_ok=True)
 
     if args.command == "all":
-        cmd_all(fill_calendar=args.fill_dates)
+        cmd_all(fill_calendar=args.fill_dates, offline=args.offline)
     elif args.command == "fetch":
-        cmd_fetch()
+        cmd_fetch(args.offline)
     elif args.command == "supplement":
-        cmd_supplement()
+        cmd_supplement(args.offline)
     elif args.command == "fill-dates":
-        cmd_fill_dates()
+        cmd_fill_dates(args.out)
+    elif args.command == "sidecar":
+        cmd_sidecar(force=args.force)
     elif args.command == "export":
-        cmd_export()
+        cmd_export(args.force)
+    elif args.command == "snapshot":
+        cmd_snapshot()
+    elif args.command == "optimize":
+        cmd_optimize(args, parser)
+    elif args.command == "walkforward":
+        cmd_walkforward(args, parser)
+    elif args.command == "portfolio":
+        cmd_portfolio(args, parser)
 
 
 if __name__ == "__main__":
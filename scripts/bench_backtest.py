@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""回测内核一致性校验 + 基准：向量化仓位 / 资金模拟（backtest.simulate）对比原逐根循环。
+
+校验：各品种真实日K（日 / 周 / 月）与合成 K 线上，四个策略多组参数、不同资金 / 手数 / 手续费 / 乘数下，
+回测结果（指标、权益曲线、成交、信号点）须完全相同。
+基准：合成 10 万根（可指定）K 线，同一组信号下原循环与向量化内核的耗时：完整结果（含逐根权益 dict）与只算指标（detail=False）。
+只算指标的一列对应参数扫描 / 滚动前推，应在 20 倍以上；完整结果的下限是逐根权益 dict 的组装，只作参考。
+
+用法：python scripts/bench_backtest.py [根数 ...]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backtest import STRATEGIES, BacktestEngine  # noqa: E402
+from bench_indicators import PARAM_SETS, synthetic  # noqa: E402
+from config import SYMBOL_LIST  # noqa: E402
+from datastore import get_bars  # noqa: E402
+from resample import TIMEFRAMES  # noqa: E402
+
+ACCOUNTS = [{}, {"capital": 50000, "lots": 3, "commission": 2.5, "multiplier": 5}]
+
+
+# ── 原实现（向量化之前的 BacktestEngine.run / _trade / _metrics），作为对照 ─────────
+
+def legacy_trade(dates, ei, xi, ep, xp, pnl, cap):
+    d0 = datetime.strptime(dates[ei], "%Y-%m-%d")
+    d1 = datetime.strptime(dates[xi], "%Y-%m-%d")
+    return {
+        "entry_date": dates[ei],
+        "entry_price": round(ep, 2),
+        "exit_date": dates[xi],
+        "exit_price": round(xp, 2),
+        "pnl": round(pnl, 2),
+        "pnl_pct": round(pnl / cap * 100, 2),
+        "holding_days": (d1 - d0).days,
+    }
+
+
+def legacy_metrics(trades, equity, capital, per_year=252):
+    final = equity[-1]["value"] if equity else capital
+    total_ret = (final - capital) / capital * 100
+    days = len(equity)
+    years = days / per_year if days > 0 else 1
+    annual_ret = ((final / capital) ** (1 / years) - 1) * 100 if years > 0 and final > 0 else 0
+    max_dd = 0
+    peak = capital
+    for e in equity:
+        if e["value"] > peak:
+            peak = e["value"]
+        dd = (e["value"] - peak) / peak * 100 if peak else 0
+        if dd < max_dd:
+            max_dd = dd
+    wins = [t for t in trades if t["pnl"] > 0]
+    losses = [t for t in trades if t["pnl"] <= 0]
+    win_rate = len(wins) / len(trades) * 100 if trades else 0
+    gross_profit = sum(t["pnl"] for t in wins) if wins else 0
+    gross_loss = abs(sum(t["pnl"] for t in losses)) if losses else 0
+    profit_factor = round(gross_profit / gross_loss, 2) if gross_loss > 0 else 999.0
+    avg_hold = sum(t["holding_days"] for t in trades) / len(trades) if trades else 0
+    return {
+        "total_return": round(total_ret, 2),
+        "annual_return": round(annual_ret, 2),
+        "max_drawdown": round(max_dd, 2),
+        "win_rate": round(win_rate, 1),
+        "total_trades": len(trades),
+        "profit_factor": profit_factor,
+        "avg_holding_days": round(avg_hold, 1),
+    }
+
+
+def legacy_run(eng, signals_raw, capital=100000, lots=1, commission=5, multiplier=10):
+    dates, opens, closes, n = eng.dates, eng.opens, eng.closes, eng.n
+    trades, signals_out, equity = [], [], []
+    cash = float(capital)
+    pos = 0
+    entry_price = 0.0
+    entry_idx = 0
+    for i in range(n):
+        sig = signals_raw[i]
+        if sig == 1 and pos == 0 and i + 1 < n:
+            exec_price = opens[i + 1]
+            pos = lots
+            entry_price = exec_price
+            entry_idx = i + 1
+            cash -= commission * lots
+            signals_out.append({"date": dates[i + 1], "action": "buy", "price": exec_price})
+        elif sig == -1 and pos > 0 and i + 1 < n:
+            exec_price = opens[i + 1]
+            pnl = (exec_price - entry_price) * multiplier * pos - commission * pos
+            cash += pnl
+            trades.append(legacy_trade(dates, entry_idx, i + 1, entry_price, exec_price, pnl, capital))
+            signals_out.append({"date": dates[i + 1], "action": "sell", "price": exec_price})
+            pos = 0
+        unrealised = 0.0
+        if pos > 0:
+            unrealised = (closes[i] - entry_price) * multiplier * pos
+        equity.append({"date": dates[i], "value": round(cash + unrealised, 2)})
+    if pos > 0:
+        exec_price = closes[-1]
+        pnl = (exec_price - entry_price) * multiplier * pos - commission * pos
+        cash += pnl
+        trades.append(legacy_trade(dates, entry_idx, n - 1, entry_price, exec_price, pnl, capital))
+        signals_out.append({"date": dates[-1], "action": "sell", "price": exec_price})
+        equity[-1]["value"] = round(cash, 2)
+    metrics = legacy_metrics(trades, equity, capital, TIMEFRAMES[eng.timeframe])
+    return {"metrics": metrics, "equity": equity, "trades": trades, "signals": signals_out}
+
+
+def synthetic_engine(n: int, tick: float = 1.0) -> BacktestEngine:
+    opens, highs, lows, closes = synthetic(n, tick)
+    start = datetime(1990, 1, 1).toordinal()
+    dates = [datetime.fromordinal(start + i).strftime("%Y-%m-%d") for i in range(n)]
+    return BacktestEngine(dates, opens, highs, lows, closes, [0] * n)
+
+
+def check_engine(label: str, eng: BacktestEngine) -> bool:
+    ok, runs = True, 0
+    for key in STRATEGIES:
+        for params in PARAM_SETS[key]:
+            sig = eng.signals(key, params).tolist()
+            for acct in ACCOUNTS:
+                new = eng.run(key, params, **acct)
+                old = legacy_run(eng, sig, **acct)
+                runs += 1
+                if new != old or eng.run(key, params, detail=False, **acct) != {"metrics": old["metrics"]}:
+                    ok = False
+                    bad = [k for k in old if new[k] != old[k]]
+                    print(f"  [不一致] {label} {key} {params} {acct}: {', '.join(bad)}")
+    print(f"  {label}: {eng.n} 根，{runs} 次回测{'一致' if ok else '不一致'}")
+    return ok
+
+
+def bench(n: int):
+    eng = synthetic_engine(n)
+    print(f"\n基准：{n} 根（同一组信号，只比较仓位 / 资金模拟与结果组装）")
+    print(f"{'策略':<10}{'成交':>6}{'原循环':>12}{'向量化':>12}{'加速':>8}{'仅指标':>12}{'加速':>8}")
+    for key in STRATEGIES:
+        sig = eng.signals(key, {})
+        eng.signals = lambda *_a, _s=sig: _s        # 只计内核，不计信号生成
+        sig = sig.tolist()                          # 原实现的信号为 list
+        t0 = time.perf_counter()
+        old = legacy_run(eng, sig)
+        t1 = time.perf_counter()
+        new = eng.run(key, {})
+        t2 = time.perf_counter()
+        eng.run(key, {}, detail=False)
+        t3 = time.perf_counter()
+        del eng.signals
+        assert new == old
+        print(f"{key:<10}{len(new['trades']):>6}{(t1 - t0) * 1000:>10.1f}ms{(t2 - t1) * 1000:>10.1f}ms"
+              f"{(t1 - t0) / (t2 - t1):>7.1f}x{(t3 - t2) * 1000:>10.1f}ms{(t1 - t0) / (t3 - t2):>7.1f}x")
+
+
+def main(sizes):
+    print("一致性校验：")
+    ok = True
+    for code, name in SYMBOL_LIST:
+        bars = get_bars(code, name)
+        if bars is None or not len(bars):
+            continue
+        for tf in TIMEFRAMES:
+            eng = BacktestEngine(bars.dates, bars.open.tolist(), bars.high.tolist(), bars.low.tolist(),
+                                 bars.close.tolist(), bars.volume.tolist(), timeframe=tf)
+            ok &= check_engine(f"{code}/{tf}", eng)
+    for tick in (1.0, 0.5):
+        ok &= check_engine(f"合成(跳价 {tick})", synthetic_engine(10000, tick))
+    for n in sizes:
+        bench(n)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main([int(a) for a in sys.argv[1:]] or [100_000]))
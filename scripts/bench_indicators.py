@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""指标一致性校验 + 基准：向量化实现（indicators.py / backtest.py 策略）对比原逐根循环实现。
+
+校验：三个品种的真实日K，以及合成的整数价 / 0.5 跳价随机游走，四个策略在多组参数下的信号须完全一致，
+均线 / EMA 须逐位相同，标准差、滚动极值与原公式的差在浮点误差内。
+基准：合成 10 万根（可指定）K 线上各策略的耗时。
+同样的相等性检查在 tests/test_indicators.py 里（unittest），这里的 legacy_* 为其对照实现。
+
+用法：python scripts/bench_indicators.py [根数 ...]
+"""
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import indicators  # noqa: E402
+from backtest import STRATEGIES  # noqa: E402
+from config import SYMBOL_LIST  # noqa: E402
+from datastore import get_bars  # noqa: E402
+
+
+# ── 原实现（backtest.py 向量化之前），作为对照 ──────────────────────
+
+def legacy_sma(arr, period):
+    out = [None] * len(arr)
+    s = 0.0
+    for i, v in enumerate(arr):
+        s += v
+        if i >= period:
+            s -= arr[i - period]
+        if i >= period - 1:
+            out[i] = s / period
+    return out
+
+
+def legacy_ema(arr, period):
+    k = 2.0 / (period + 1)
+    out = [arr[0]]
+    for i in range(1, len(arr)):
+        out.append(arr[i] * k + out[-1] * (1 - k))
+    return out
+
+
+def legacy_ma_cross(closes, short=5, long=20, **_):
+    ma_s = legacy_sma(closes, short)
+    ma_l = legacy_sma(closes, long)
+    n = len(closes)
+    sig = [0] * n
+    for i in range(1, n):
+        if ma_s[i] is None or ma_l[i] is None or ma_s[i - 1] is None or ma_l[i - 1] is None:
+            continue
+        if ma_s[i - 1] <= ma_l[i - 1] and ma_s[i] > ma_l[i]:
+            sig[i] = 1
+        elif ma_s[i - 1] >= ma_l[i - 1] and ma_s[i] < ma_l[i]:
+            sig[i] = -1
+    return sig
+
+
+def legacy_macd(closes, fast=12, slow=26, signal=9, **_):
+    ef = legacy_ema(closes, fast)
+    es = legacy_ema(closes, slow)
+    dif = [ef[i] - es[i] for i in range(len(closes))]
+    dea = legacy_ema(dif, signal)
+    n = len(closes)
+    sig = [0] * n
+    for i in range(slow, n):
+        if dif[i - 1] <= dea[i - 1] and dif[i] > dea[i]:
+            sig[i] = 1
+        elif dif[i - 1] >= dea[i - 1] and dif[i] < dea[i]:
+            sig[i] = -1
+    return sig
+
+
+def legacy_boll(closes, period=20, mult=2.0, **_):
+    mid = legacy_sma(closes, period)
+    n = len(closes)
+    sig = [0] * n
+    for i in range(1, n):
+        if mid[i] is None or mid[i - 1] is None:
+            continue
+        sq = sum((closes[j] - mid[i]) ** 2 for j in range(i - period + 1, i + 1))
+        std = math.sqrt(sq / period)
+        upper = mid[i] + mult * std
+        lower = mid[i] - mult * std
+        prev_sq = sum((closes[j] - mid[i - 1]) ** 2 for j in range(i - period, i))
+        prev_std = math.sqrt(prev_sq / period)
+        prev_upper = mid[i - 1] + mult * prev_std
+        prev_lower = mid[i - 1] - mult * prev_std
+        if closes[i - 1] <= prev_upper and closes[i] > upper:
+            sig[i] = 1
+        elif closes[i - 1] >= prev_lower and closes[i] < lower:
+            sig[i] = -1
+    return sig
+
+
+def legacy_kdj(closes, highs, lows, period=9, **_):
+    n = len(closes)
+    sig = [0] * n
+    kv, dv = [50.0] * n, [50.0] * n
+    for i in range(period - 1, n):
+        hi = max(highs[i - period + 1: i + 1])
+        lo = min(lows[i - period + 1: i + 1])
+        rsv = 50.0 if hi == lo else (closes[i] - lo) / (hi - lo) * 100
+        if i == period - 1:
+            kv[i] = 50.0
+            dv[i] = 50.0
+        else:
+            kv[i] = (2 * kv[i - 1] + rsv) / 3
+            dv[i] = (2 * dv[i - 1] + kv[i]) / 3
+    for i in range(period, n):
+        if kv[i - 1] <= dv[i - 1] and kv[i] > dv[i] and kv[i] < 30:
+            sig[i] = 1
+        elif kv[i - 1] >= dv[i - 1] and kv[i] < dv[i] and kv[i] > 70:
+            sig[i] = -1
+    return sig
+
+
+LEGACY = {"ma_cross": legacy_ma_cross, "macd": legacy_macd, "boll": legacy_boll, "kdj": legacy_kdj}
+
+# 每个策略的参数组：默认值 + 几组常见取值
+PARAM_SETS = {
+    "ma_cross": [{}, {"short": 10, "long": 60}, {"short": 2, "long": 5}],
+    "macd": [{}, {"fast": 5, "slow": 35, "signal": 5}],
+    "boll": [{}, {"period": 10, "mult": 1.5}, {"period": 60, "mult": 3.0}],
+    "kdj": [{}, {"period": 3}, {"period": 30}],
+}
+
+
+def synthetic(n: int, tick: float = 1.0, seed: int = 7):
+    """随机游走 K 线（价格为 tick 的整数倍），返回 (opens, highs, lows, closes) 列表。"""
+    rng = np.random.default_rng(seed)
+    close = np.maximum(3000 + np.cumsum(rng.integers(-20, 21, n)), 100) * tick
+    open_ = close + rng.integers(-5, 6, n) * tick
+    high = np.maximum(open_, close) + rng.integers(0, 10, n) * tick
+    low = np.minimum(open_, close) - rng.integers(0, 10, n) * tick
+    return open_.tolist(), high.tolist(), low.tolist(), close.tolist()
+
+
+def run_strategy(fn, key, params, highs, lows, closes):
+    kw = {p["key"]: params.get(p["key"], p["default"]) for p in STRATEGIES[key]["params"]}
+    if STRATEGIES[key]["needs_hl"]:
+        kw["highs"], kw["lows"] = highs, lows
+    return fn(closes, **kw)
+
+
+def check_dataset(label: str, highs, lows, closes) -> bool:
+    ok = True
+    for key, cfg in STRATEGIES.items():
+        for params in PARAM_SETS[key]:
+            new = run_strategy(cfg["fn"], key, params, highs, lows, closes)
+            old = run_strategy(LEGACY[key], key, params, highs, lows, closes)
+            same = new.tolist() == old
+            ok &= same
+            if not same:
+                diff = sum(a != b for a, b in zip(new.tolist(), old))
+                print(f"  [不一致] {label} {key} {params}: {diff} 处信号不同")
+    for p in (5, 20, 60):
+        old = np.array([np.nan if v is None else v for v in legacy_sma(closes, p)])
+        same = np.array_equal(indicators.sma(closes, p), old, equal_nan=True)
+        ok &= same
+        if not same:
+            print(f"  [不一致] {label} sma({p})")
+    for p in (9, 12, 26):
+        same = np.array_equal(indicators.ema(closes, p), np.array(legacy_ema(closes, p)))
+        ok &= same
+        if not same:
+            print(f"  [不一致] {label} ema({p})")
+    c = np.array(closes)
+    mid = indicators.sma(c, 20)
+    ref = np.array([math.sqrt(sum((closes[j] - mid[i]) ** 2 for j in range(i - 19, i + 1)) / 20)
+                    for i in range(19, len(closes))])
+    err = float(np.max(np.abs(indicators.rolling_std(c, 20)[19:] - ref))) if len(ref) else 0.0
+    hi_ok = all(indicators.rolling_max(highs, 9)[i] == max(highs[i - 8:i + 1]) for i in range(8, len(highs)))
+    lo_ok = all(indicators.rolling_min(lows, 9)[i] == min(lows[i - 8:i + 1]) for i in range(8, len(lows)))
+    ok &= hi_ok and lo_ok and err < 1e-6
+    print(f"  {label}: {len(closes)} 根，信号{'一致' if ok else '不一致'}；std 最大误差 {err:.2e}，"
+          f"滚动极值{'一致' if hi_ok and lo_ok else '不一致'}")
+    return ok
+
+
+def bench(n: int):
+    _, highs, lows, closes = synthetic(n)
+    print(f"\n基准：{n} 根（EMA 递归滤波: {'scipy.lfilter' if indicators.lfilter else '逐点递推'}）")
+    print(f"{'策略':<10}{'原实现':>12}{'向量化':>12}{'加速':>10}")
+    for key, cfg in STRATEGIES.items():
+        t0 = time.perf_counter()
+        run_strategy(LEGACY[key], key, {}, highs, lows, closes)
+        t1 = time.perf_counter()
+        run_strategy(cfg["fn"], key, {}, highs, lows, closes)
+        t2 = time.perf_counter()
+        print(f"{key:<10}{(t1 - t0) * 1000:>10.1f}ms{(t2 - t1) * 1000:>10.1f}ms{(t1 - t0) / (t2 - t1):>9.1f}x")
+
+
+def main(sizes):
+    print("一致性校验：")
+    ok = True
+    for code, name in SYMBOL_LIST:
+        bars = get_bars(code, name)
+        if bars is not None and len(bars):
+            ok &= check_dataset(code, bars.high.tolist(), bars.low.tolist(), bars.close.tolist())
+    for tick in (1.0, 0.5):
+        _, highs, lows, closes = synthetic(10000, tick)
+        ok &= check_dataset(f"合成(跳价 {tick})", highs, lows, closes)
+    for n in sizes:
+        bench(n)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main([int(a) for a in sys.argv[1:]] or [100_000]))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""CSV 解析基准：对比 datastore.parse_csv（向量化）与原逐行解析，在 1 万 / 10 万 / 100 万行上的耗时。
+
+用法：python scripts/bench_parse.py [行数 ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import CSV_HEADER  # noqa: E402
+from datastore import parse_csv  # noqa: E402
+
+
+def legacy_parse(path: str):
+    """原各脚本中的逐行解析（split + float），作为对照。"""
+    rows = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        next(f)
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.split(",")
+            if len(parts) < 6:
+                continue
+            try:
+                rows.append((parts[0].strip(), float(parts[1]), float(parts[2]),
+                             float(parts[3]), float(parts[4]), int(float(parts[5]))))
+            except (ValueError, TypeError):
+                continue
+    return rows
+
+
+def make_csv(path: str, n: int):
+    """生成 n 行模拟日K（价格一半三位小数、一半一位小数，与现有数据混排一致）。"""
+    rng = np.random.default_rng(0)
+    days = np.arange(n) + np.datetime64("1970-01-01")
+    close = 2000 + np.cumsum(rng.integers(-20, 21, n))
+    vol = rng.integers(1000, 900000, n)
+    with open(path, "w", encoding="utf-8-sig") as f:
+        f.write(CSV_HEADER)
+        for i, (d, c, v) in enumerate(zip(days.astype(str), close.tolist(), vol.tolist())):
+            fmt = "{:.3f}" if i % 2 else "{:.1f}"
+            o, h, lo = fmt.format(c - 3), fmt.format(c + 8), fmt.format(c - 9)
+            f.write(f"{d},{o},{h},{lo},{fmt.format(c)},{v}\n")
+
+
+def bench(fn, path, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'行数':>10} {'逐行(s)':>10} {'向量化(s)':>10} {'加速比':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = os.path.join(tmp, f"bench_{n}.csv")
+            make_csv(path, n)
+            t_old = bench(legacy_parse, path)
+            t_new = bench(parse_csv, path)
+            print(f"{n:>10} {t_old:>10.4f} {t_new:>10.4f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
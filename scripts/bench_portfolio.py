@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""组合回测一致性校验 + 基准：portfolio.PortfolioEngine 对比逐品种 BacktestEngine。
+
+校验（资金取 POOL，足够大，资金池的额度不起作用，组合应与各腿独立回测之和相同；额度生效时的行为见 tests/test_portfolio.py）：
+- 单腿组合（fixed 手数）与 BacktestEngine.run 的指标、权益曲线、成交须完全相同（真实日K各周期、四个策略多组参数）；
+- 多腿（各腿上市日期不同、交易日有缺口的合成 K 线）：每腿的成交与单独回测相同，组合期末权益 = 初始资金 + 各腿盈亏之和。
+基准：合成 N 个品种（默认 50）× 5000 根，组合引擎对比逐品种回测后再按日期轴合并权益。
+
+用法：python scripts/bench_portfolio.py [品种数 ...]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backtest import STRATEGIES, BacktestEngine  # noqa: E402
+from bench_indicators import PARAM_SETS, synthetic  # noqa: E402
+from config import CONTRACT_MULTI, SYMBOL_LIST  # noqa: E402
+from datastore import Bars, align_days, get_bars  # noqa: E402
+from portfolio import PortfolioEngine  # noqa: E402
+from resample import TIMEFRAMES, resample  # noqa: E402
+
+STRATEGY_KEYS = list(STRATEGIES)
+POOL = 100_000_000
+
+
+def synthetic_universe(count: int, n: int = 5000, seed: int = 11) -> dict:
+    """count 个合成品种：上市日期错开（最多晚 n/5 根），各自随机缺 2% 的交易日。"""
+    rng = np.random.default_rng(seed)
+    out = {}
+    for i in range(count):
+        opens, highs, lows, closes = synthetic(n, 0.5 if i % 2 else 1.0, seed=seed + i)
+        days = 7000 + np.arange(n)
+        keep = rng.random(n) > 0.02
+        keep[:rng.integers(0, n // 5)] = False
+        out[f"S{i:02d}"] = Bars(days, opens, highs, lows, closes, np.zeros(n)).take(keep)
+    return out
+
+
+def trade_key(t: dict):
+    return t["entry_date"], t["exit_date"], t["entry_price"], t["exit_price"], t["pnl"], t["holding_days"]
+
+
+def check_single(code: str, bars: Bars, tf: str) -> bool:
+    ok, runs = True, 0
+    eng = BacktestEngine.from_bars(resample(bars, tf), tf)
+    pe = PortfolioEngine({code: bars}, tf)
+    for key in STRATEGIES:
+        for params in PARAM_SETS[key]:
+            for lots in (1, 3):
+                old = eng.run(key, params, capital=POOL, lots=lots, multiplier=CONTRACT_MULTI.get(code, 10))
+                new = pe.run([{"symbol": code, "strategy": key, "params": params}], capital=POOL, lots=lots)
+                metrics = {k: v for k, v in new["metrics"].items() if k != "max_exposure"}
+                same = (metrics == old["metrics"] and new["equity"] == old["equity"]
+                        and [trade_key(t) for t in new["trades"]] == [trade_key(t) for t in old["trades"]])
+                runs += 1
+                if not same:
+                    ok = False
+                    print(f"  [不一致] {code}/{tf} {key} {params} lots={lots}")
+    print(f"  {code}/{tf}: 单腿 {runs} 次回测{'一致' if ok else '不一致'}")
+    return ok
+
+
+def check_multi(universe: dict) -> bool:
+    pe = PortfolioEngine(universe)
+    legs = [{"symbol": s, "strategy": STRATEGY_KEYS[i % 4]} for i, s in enumerate(universe)]
+    r = pe.run(legs, capital=POOL)
+    ok, total = True, 0.0
+    for leg, out in zip(legs, r["legs"]):
+        old = BacktestEngine.from_bars(universe[leg["symbol"]]).run(leg["strategy"], {}, capital=POOL)
+        mine = sorted(trade_key(t) for t in r["trades"] if t["symbol"] == leg["symbol"])
+        if mine != sorted(trade_key(t) for t in old["trades"]):
+            ok = False
+            print(f"  [不一致] {leg['symbol']} {leg['strategy']} 的成交与单独回测不同")
+        total += old["equity"][-1]["value"] - POOL
+    err = abs(r["equity"][-1]["value"] - POOL - total)
+    ok &= err < 1e-6
+    print(f"  合成 {len(universe)} 腿 × {pe.n} 日：各腿成交{'一致' if ok else '不一致'}，期末权益误差 {err:.2e}")
+    return ok
+
+
+def merged_run(universe: dict, legs, capital=POOL):
+    """对照：逐品种回测，再把各自的权益按日期轴对齐（缺口沿用前值）后相加。"""
+    results = [BacktestEngine.from_bars(universe[leg["symbol"]]).run(leg["strategy"], {}, capital=capital)
+               for leg in legs]
+    axis, index = align_days([universe[leg["symbol"]].days for leg in legs])
+    total = np.full(len(axis), float(capital))
+    for res, idx in zip(results, index):
+        pnl = np.array([e["value"] for e in res["equity"]]) - capital
+        last = np.maximum.accumulate(np.where(idx >= 0, np.arange(len(axis)), -1))
+        total += np.where(last >= 0, pnl[np.maximum(idx[np.maximum(last, 0)], 0)], 0.0)
+    return total
+
+
+def bench(count: int):
+    universe = synthetic_universe(count)
+    legs = [{"symbol": s, "strategy": STRATEGY_KEYS[i % 4]} for i, s in enumerate(universe)]
+    t0 = time.perf_counter()
+    ref = merged_run(universe, legs)
+    t1 = time.perf_counter()
+    pe = PortfolioEngine(universe)
+    r = pe.run(legs, capital=POOL)
+    t2 = time.perf_counter()
+    pe.run(legs, capital=POOL, detail=False)
+    t3 = time.perf_counter()
+    err = float(np.max(np.abs(np.array([e["value"] for e in r["equity"]]) - ref)))
+    print(f"\n基准：{count} 个品种 × {pe.n} 日（含信号生成），权益最大差 {err:.2e}")
+    print(f"  逐品种回测后合并  {(t1 - t0) * 1000:>8.1f}ms")
+    print(f"  组合引擎          {(t2 - t1) * 1000:>8.1f}ms  {(t1 - t0) / (t2 - t1):.1f}x")
+    print(f"  组合引擎（仅指标）{(t3 - t2) * 1000:>8.1f}ms  {(t1 - t0) / (t3 - t2):.1f}x")
+
+
+def main(counts):
+    print("一致性校验：")
+    ok = True
+    for code, name in SYMBOL_LIST:
+        bars = get_bars(code, name)
+        if bars is None or not len(bars):
+            continue
+        for tf in TIMEFRAMES:
+            ok &= check_single(code, bars, tf)
+    ok &= check_multi(synthetic_universe(12, 3000))
+    for count in counts:
+        bench(count)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main([int(a) for a in sys.argv[1:]] or [50]))
@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 """
-新浪财经 - 玉米、玉米淀粉、鸡蛋期货历史日K线爬虫
-数据从交易所上市/新浪有记录开始拉取，保存为 CSV。
+新浪财经 - 期货主力连续历史日K线爬虫（品种见 config.SYMBOLS）
+数据从交易所上市/新浪有记录开始拉取，保存为 CSV。多品种并发拉取，带限速与重试。
 """
 
 import json
 import os
 import time
+
 import requests
 
 # 新浪期货日K线接口（主力连续合约，返回自上市起全部日线）
@@ -16,48 +17,82 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
 }
 
-from config import DATA_DIR, SYMBOLS
+from config import DATA_DIR, SYMBOLS, CSV_HEADER, FETCH_CACHE_MODE, FETCH_RATE, FETCH_WORKERS, csv_path
+from datastore import publish_file, record_meta
+from fetch_cache import ResponseCache
+from fetch_pool import TokenBucket, make_session, run_parallel, summarize
 
 
-def fetch_daily_kline(symbol: str) -> list:
-    """请求单品种日K线，返回 [ [日期, 开, 高, 低, 收, 量], ... ]"""
-    resp = requests.get(API_URL, params={"symbol": symbol}, headers=HEADERS, timeout=30)
-    resp.raise_for_status()
-    text = resp.text.strip()
+def parse_daily_kline(text: str) -> list:
+    """解析接口返回的 JSON 文本为 [ [日期, 开, 高, 低, 收, 量], ... ]。"""
+    text = text.strip()
     if not text:
         return []
     data = json.loads(text)
     return data if isinstance(data, list) else []
 
 
+def fetch_daily_kline(symbol: str, session=None, cache: ResponseCache = None) -> list:
+    """请求单品种日K线，返回 [ [日期, 开, 高, 低, 收, 量], ... ]。session 为空时单独发请求；给定 cache 时经本地缓存。"""
+    if cache is not None:
+        return parse_daily_kline(cache.get(API_URL, {"symbol": symbol}, session, HEADERS).text)
+    if session is None:
+        resp = requests.get(API_URL, params={"symbol": symbol}, headers=HEADERS, timeout=30)
+    else:
+        resp = session.get(API_URL, params={"symbol": symbol}, timeout=30)
+    resp.raise_for_status()
+    return parse_daily_kline(resp.text)
+
+
 def save_csv(symbol: str, name: str, rows: list, out_dir: str = None):
-    """保存为 CSV：日期, 开盘, 最高, 最低, 收盘, 成交量"""
+    """保存为 CSV：日期, 开盘, 最高, 最低, 收盘, 成交量（临时文件 + 原子替换）"""
     out_dir = out_dir or DATA_DIR
     os.makedirs(out_dir, exist_ok=True)
     path = os.path.join(out_dir, f"{symbol}_{name}_历史日K.csv")
-    with open(path, "w", encoding="utf-8-sig") as f:
-        f.write("日期,开盘(元/吨),最高(元/吨),最低(元/吨),收盘(元/吨),成交量(手)\n")
-        for r in rows:
-            if len(r) >= 6:
-                line = f"{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}\n"
-                f.write(line)
+    rows = [r for r in rows if len(r) >= 6]
+    lines = [CSV_HEADER] + [f"{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}\n" for r in rows]
+    publish_file(path, "".join(lines).encode("utf-8-sig"))
+    if rows and out_dir == DATA_DIR:
+        record_meta(symbol, name, len(rows), rows[0][0], rows[-1][0])
     return path
 
 
-def main():
-    print("新浪财经 - 玉米 / 玉米淀粉 / 鸡蛋 历史日K线爬取（自上市起）\n")
-    for code, (name, note) in SYMBOLS.items():
-        print(f"正在拉取: {name} ({code}) - {note}")
-        try:
-            rows = fetch_daily_kline(code)
-            if not rows:
-                print(f"  -> 无数据，跳过\n")
-                continue
-            path = save_csv(code, name, rows)
-            print(f"  -> 共 {len(rows)} 条，已保存: {path}\n")
-        except Exception as e:
-            print(f"  -> 失败: {e}\n")
-        time.sleep(0.5)
+def main(workers: int = FETCH_WORKERS, rate: float = FETCH_RATE, cache_mode: str = FETCH_CACHE_MODE):
+    """并发拉取 SYMBOLS 中全部品种：共享连接池、令牌桶限速、失败指数退避重试，拉完即写盘。
+
+    响应经本地缓存（fetch_cache）：与上次落盘内容相同的品种不解析、不写盘。cache_mode="replay" 时离线只用缓存。
+    """
+    print(f"新浪财经 - 主力连续历史日K线爬取（自上市起），共 {len(SYMBOLS)} 个品种，并发 {workers}\n")
+    session = make_session(workers, HEADERS)
+    limiter = TokenBucket(rate)
+    cache = ResponseCache(mode=cache_mode)
+
+    def job(code):
+        name = SYMBOLS[code][0]
+        resp = cache.get(API_URL, {"symbol": code}, session, HEADERS)
+        if not resp.changed and os.path.exists(csv_path(code, name)):
+            return None, resp.source
+        rows = parse_daily_kline(resp.text)
+        path = save_csv(code, name, rows) if rows else None
+        cache.commit(resp)
+        return len(rows), path
+
+    def report(code, result, stat):
+        name, note = SYMBOLS[code]
+        head = f"{name} ({code}) [{stat.seconds:.2f}s, {stat.attempts} 次]"
+        if not stat.ok:
+            print(f"{head} -> 失败: {stat.error}")
+        elif result[0] is None:
+            print(f"{head} -> 未变化（{result[1]}），跳过解析与写盘")
+        elif not result[0]:
+            print(f"{head} -> 无数据，跳过（{note}）")
+        else:
+            print(f"{head} -> 共 {result[0]} 条，已保存: {result[1]}")
+
+    t0 = time.perf_counter()
+    results = run_parallel(SYMBOLS, job, workers=workers, limiter=limiter,
+                           retry_on=(requests.RequestException, ValueError), on_done=report)
+    print("\n" + summarize([stat for _, _, stat in results], time.perf_counter() - t0))
     print("全部完成。")
 
 
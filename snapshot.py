@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 静态快照
+把常用的接口响应预先生成为 gzip JSON 放到 static/snapshot（run.py snapshot）：
+元信息、品种列表、各品种 K 线（全量 / 紧凑格式 / K 线页首屏一页）、数据表默认排序下的每一页。
+manifest.json 记录「请求 → 文件、ETag」与生成时各品种 CSV 的版本（大小 + 校验和）；快照模式（config.SNAPSHOT_SERVE）
+下命中的请求直接返回文件，冷启动不解析 CSV。CSV 与清单记录的版本不一致（数据已更新而快照未重建）时整份快照不用，
+全部走实时接口。未命中的请求（筛选、排序、降采样、日历视图等）照常实时计算。
+快照内容由 Flask 测试客户端调用实时接口得到，与实时输出逐字节一致。快照是生成物，不提交到 Git：
+部署时由 vercel.json 的 buildCommand（python run.py snapshot）生成，本地更新数据后也会重建。
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from config import SNAPSHOT_DIR, SNAPSHOT_KLINE_PAGE, SNAPSHOT_TABLE_SIZE, SYMBOL_LIST, csv_path
+from datastore import file_crc32, file_stamp, get_bars, publish_file
+
+MANIFEST = "manifest.json"
+# 快照格式版本：键的规则或文件布局变化时递增，旧清单整体失效
+SNAPSHOT_VERSION = 1
+
+_lock = threading.Lock()
+_manifest = (None, {}, {})    # (清单文件版本, 键 -> 条目, 生成时的数据版本)
+_source = (None, None)        # (各 CSV 的文件版本, 数据版本)：文件未变时不重复计算校验和
+
+
+def request_key(path: str, args) -> str:
+    """请求 -> 快照键：路径 + 按名排序的非空查询参数（与参数顺序无关）。"""
+    items = sorted((k, v) for k, v in args if v != "")
+    return path + ("?" + urlencode(items) if items else "")
+
+
+def url_key(url: str) -> str:
+    parts = urlsplit(url)
+    return request_key(parts.path, parse_qsl(parts.query, keep_blank_values=True))
+
+
+def _table_pages(code: str, name: str):
+    """数据表默认视图（按日期升序）的每一页：yield (页码, 别名 URL 列表)。
+
+    页边界对齐时，用游标翻到的页（after=上一页末行 / before=下一页首行）与 page=N 是同一页，登记为别名。
+    """
+    bars = get_bars(code, name)
+    n = len(bars) if bars is not None else 0
+    size = SNAPSHOT_TABLE_SIZE
+    base = f"/api/table/{code}?size={size}&sort=date&order=asc"
+    for page, offset in enumerate(range(0, max(n, 1), size), 1):
+        aliases = []
+        if offset:
+            aliases.append(f"{base}&after={bars.dates[offset - 1]}")
+        if offset + size < n:
+            aliases.append(f"{base}&before={bars.dates[offset + size]}")
+        yield page, aliases
+
+
+def snapshot_requests():
+    """要预生成的请求：yield (文件相对路径, URL, 别名 URL 列表)。"""
+    yield "meta.json.gz", "/api/meta", []
+    yield "symbols.json.gz", "/api/symbols", []
+    for code, name in SYMBOL_LIST:
+        yield f"kline/{code}.json.gz", f"/api/kline/{code}", []
+        yield f"kline/{code}.compact.json.gz", f"/api/kline/{code}?format=compact", []
+        yield (f"kline/{code}.latest.json.gz",
+               f"/api/kline/{code}?format=compact&limit={SNAPSHOT_KLINE_PAGE}", [])
+        size = SNAPSHOT_TABLE_SIZE
+        for page, aliases in _table_pages(code, name):
+            yield (f"table/{code}/{page}.json.gz",
+                   f"/api/table/{code}?size={size}&sort=date&order=asc&page={page}",
+                   aliases + ([f"/api/table/{code}"] if page == 1 else []))
+
+
+def source_version() -> dict:
+    """当前数据版本：{品种: [CSV 大小, crc32]}，CSV 不存在为 None。按各 CSV 的文件版本缓存，文件未变时只 stat 不读。
+    用内容校验和而不是 mtime：部署时文件被复制，mtime 会变。"""
+    global _source
+    paths = [csv_path(code, name) for code, name in SYMBOL_LIST]
+    stamps = [file_stamp(p) for p in paths]
+    if stamps != _source[0]:
+        version = {code: ([st[1], file_crc32(p)] if st is not None else None)
+                   for (code, _), p, st in zip(SYMBOL_LIST, paths, stamps)}
+        _source = (stamps, version)
+    return _source[1]
+
+
+def _read(path: str):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def build_snapshot(out_dir: str = SNAPSHOT_DIR) -> dict:
+    """生成快照：内容未变的文件不重写（gzip 不带时间戳，输出可复现），删除已不再需要的旧文件。
+
+    返回 { files, written, removed, keys }。
+    """
+    from app import app
+
+    client = app.test_client()
+    serving, app.config["SNAPSHOT"] = app.config.get("SNAPSHOT"), False
+    entries, keep, written = {}, set(), 0
+    try:
+        for rel, url, aliases in snapshot_requests():
+            resp = client.get(url)
+            if resp.status_code != 200:
+                continue
+            body = resp.get_data()
+            data = gzip.compress(body, 9, mtime=0)
+            path = os.path.join(out_dir, rel)
+            if _read(path) != data:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                publish_file(path, data)
+                written += 1
+            entry = {"file": rel, "etag": hashlib.sha1(body).hexdigest()[:24]}
+            for u in [url] + aliases:
+                entries[url_key(u)] = entry
+            keep.add(os.path.normpath(rel))
+    finally:
+        app.config["SNAPSHOT"] = serving
+    removed = 0
+    for root, _, files in os.walk(out_dir):
+        for f in files:
+            rel = os.path.relpath(os.path.join(root, f), out_dir)
+            if f.endswith(".json.gz") and rel not in keep:
+                os.remove(os.path.join(root, f))
+                removed += 1
+    manifest = {"version": SNAPSHOT_VERSION, "source": source_version(), "entries": entries}
+    publish_file(os.path.join(out_dir, MANIFEST),
+                 json.dumps(manifest, ensure_ascii=False, sort_keys=True, indent=0).encode("utf-8"))
+    return {"files": len(keep), "written": written, "removed": removed, "keys": len(entries)}
+
+
+def lookup(path: str, args, root: str = SNAPSHOT_DIR):
+    """查快照：命中返回 (gzip 文件绝对路径, ETag)，否则 None。清单按文件版本缓存，重建快照后自动重新加载；
+    数据版本与清单记录的不一致时一律不命中。"""
+    global _manifest
+    manifest_path = os.path.join(root, MANIFEST)
+    stamp = file_stamp(manifest_path)
+    if stamp is None:
+        return None
+    if stamp != _manifest[0]:
+        with _lock:
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+            except (OSError, ValueError):
+                raw = {}
+            entries = raw.get("entries", {}) if raw.get("version") == SNAPSHOT_VERSION else {}
+            _manifest = (stamp, entries, raw.get("source"))
+    if _manifest[2] != source_version():
+        return None
+    entry = _manifest[1].get(request_key(path, args))
+    if entry is None:
+        return None
+    return os.path.join(root, entry["file"]), entry["etag"]
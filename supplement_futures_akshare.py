@@ -1,115 +1,206 @@
 # -*- coding: utf-8 -*-
 """
-用 akshare 补全 2024-07-18 之后的玉米、玉米淀粉、鸡蛋期货日K线，
-与现有 data/*.csv 合并后写回，保证日期连续、去重。
+用 akshare 补全 2024-07-18 之后的期货日K线，与现有 data/*.csv 合并后写回，保证日期连续、去重。
+各品种从已存最后日期的次日起增量拉取，并发执行；DataFrame 整列转换，不逐行遍历。
 """
 
+import functools
+import io
 import os
 import time
 
-from config import DATA_DIR, SYMBOLS, CUTOFF_DATE, SUPPLEMENT_START_DATE
+import numpy as np
+
+from config import (DATA_DIR, SYMBOLS, CSV_HEADER, CUTOFF_DATE, FETCH_CACHE_MODE, FETCH_RATE, FETCH_WORKERS,
+                    SUPPLEMENT_START_DATE, csv_path)
+from datastore import (Bars, data_version, date_to_day, format_csv_lines, load_bars, merge_bars, publish_file,
+                       record_bars_meta, record_meta, rows_to_bars, symbol_meta)
+from fetch_cache import ResponseCache
+from fetch_pool import TokenBucket, run_parallel, summarize
 
 # SYMBOLS 为 {code: (name, note)}，此处只需 name
 SYMBOLS = {k: v[0] for k, v in SYMBOLS.items()}
 
 
-def load_existing_csv(symbol: str, name: str) -> list:
-    """加载已有 CSV，返回 [ (日期, 开, 高, 低, 收, 量), ... ]"""
-    path = os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K.csv")
-    if not os.path.exists(path):
-        return []
-    rows = []
-    with open(path, "r", encoding="utf-8-sig") as f:
-        next(f)  # skip header
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            parts = line.split(",")
-            if len(parts) >= 6:
-                rows.append((parts[0], parts[1], parts[2], parts[3], parts[4], parts[5]))
-    return rows
-
-
-def fetch_akshare_from(symbol: str, start_date: str):
-    """用 akshare 拉取 start_date 起的日K，返回 list of (日期, 开, 高, 低, 收, 量)。"""
+def load_existing_csv(symbol: str, name: str):
+    """加载已有数据，返回列式 Bars（.bars 新鲜时直接内存映射，不解析 CSV）；文件不存在时为空。"""
+    bars = load_bars(symbol, name)
+    return bars if bars is not None else rows_to_bars([])
+
+
+def csv_version(symbol: str, name: str) -> str:
+    """CSV 的当前版本（data_version，只 stat），记在缓存条目里，用来发现合并后 CSV 又被别处改写。"""
+    return data_version([csv_path(symbol, name)])[0]
+
+
+def start_date_for(symbol: str, name: str) -> str:
+    """增量拉取起点：已存最后日期的次日，不早于 SUPPLEMENT_START_DATE。只读 meta.json / 文件尾部。"""
+    info = symbol_meta(symbol, name)
+    if not info or not info["last_date"]:
+        return SUPPLEMENT_START_DATE
+    return max(str(np.datetime64(info["last_date"]) + 1), SUPPLEMENT_START_DATE)
+
+
+def _fetch_frame(symbol: str, start: str):
+    """调用 akshare 拉取主力连续日K（start 为 YYYYMMDD），返回 DataFrame。"""
     try:
         import akshare as ak
     except ImportError:
         raise RuntimeError("请先安装 akshare: pip install akshare")
-    # 格式 start_date: YYYYMMDD
-    start = start_date.replace("-", "")
-    df = ak.futures_main_sina(symbol=symbol, start_date=start)
+    return ak.futures_main_sina(symbol=symbol, start_date=start)
+
+
+def _frame_bytes(df) -> bytes:
+    """DataFrame -> CSV 字节，作为缓存内容（摘要稳定，便于判断有无变化）。"""
+    return b"" if df is None or df.empty else df.to_csv(index=False).encode("utf-8")
+
+
+def fetch_akshare_cached(symbol: str, start_date: str, cache: ResponseCache):
+    """经本地缓存拉取 start_date 起的日K，返回 CachedResponse（body 为 CSV 字节，用 cached_bars 解析）。
+
+    缓存键含起点：TTL 内只复用同一起点的响应，full 补全（从 SUPPLEMENT_START_DATE 起）不会回放上次增量拉取的结果。
+    """
+    fetch = functools.partial(_fetch_frame, start=start_date.replace("-", ""))
+    return cache.call("akshare.futures_main_sina", fetch, {"symbol": symbol, "start": start_date},
+                      encode=_frame_bytes)
+
+
+def cached_bars(resp) -> Bars:
+    """把 fetch_akshare_cached 的响应还原为 Bars。"""
+    if not resp.body:
+        return rows_to_bars([])
+    import pandas as pd
+    return frame_to_bars(pd.read_csv(io.BytesIO(resp.body)))
+
+
+def fetch_akshare_from(symbol: str, start_date: str) -> Bars:
+    """用 akshare 拉取 start_date 起的日K（不经缓存），返回 Bars。"""
+    return frame_to_bars(_fetch_frame(symbol, start_date.replace("-", "")))
+
+
+def _column(df, *names):
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    raise KeyError(f"akshare 返回缺少列: {names[0]}")
+
+
+def frame_to_bars(df) -> Bars:
+    """akshare DataFrame -> Bars，整列向量化转换。日期或 OHLC 无法解析的行丢弃，成交量缺失记 0。"""
     if df is None or df.empty:
-        return []
+        return rows_to_bars([])
+    import pandas as pd
     # 列名可能是 日期 开盘价 最高价 最低价 收盘价 成交量
-    date_col = "日期" if "日期" in df.columns else "date"
-    open_col = "开盘价" if "开盘价" in df.columns else "open"
-    high_col = "最高价" if "最高价" in df.columns else "high"
-    low_col = "最低价" if "最低价" in df.columns else "low"
-    close_col = "收盘价" if "收盘价" in df.columns else "close"
-    vol_col = "成交量" if "成交量" in df.columns else "volume"
-    rows = []
-    for _, r in df.iterrows():
-        dt = r[date_col]
-        if hasattr(dt, "strftime"):
-            dt = dt.strftime("%Y-%m-%d")
-        else:
-            dt = str(dt).replace("/", "-")[:10]
-        open_ = str(r[open_col])
-        high = str(r[high_col])
-        low = str(r[low_col])
-        close = str(r[close_col])
-        try:
-            v = r[vol_col]
-            vol = str(int(float(v))) if v == v else "0"
-        except (TypeError, ValueError):
-            vol = "0"
-        rows.append((dt, open_, high, low, close, vol))
-    return rows
-
-
-def merge_and_save(symbol: str, name: str, existing: list, new_rows: list):
-    """合并已有 + 新数据（仅日期 > CUTOFF_DATE），按日期排序去重后写回 CSV。"""
-    before = len(existing)
-    seen = {r[0] for r in existing}
-    for r in new_rows:
-        if r[0] > CUTOFF_DATE and r[0] not in seen:
-            existing.append(r)
-            seen.add(r[0])
-    existing.sort(key=lambda x: x[0])
-    path = os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K.csv")
+    raw = _column(df, "日期", "date").astype(str).str.replace("/", "-").str[:10]
+    dates = pd.to_datetime(raw, format="%Y-%m-%d", errors="coerce")
+    ohlc = [pd.to_numeric(_column(df, *names), errors="coerce").to_numpy(np.float64)
+            for names in (("开盘价", "open"), ("最高价", "high"), ("最低价", "low"), ("收盘价", "close"))]
+    vol = pd.to_numeric(_column(df, "成交量", "volume"), errors="coerce").fillna(0).to_numpy(np.float64)
+    ok = dates.notna().to_numpy() & ~np.isnan(np.column_stack(ohlc)).any(axis=1)
+    days = dates[ok].to_numpy().astype("datetime64[D]").astype(np.int32)
+    return Bars(days, *(col[ok] for col in ohlc), vol[ok].astype(np.int64))
+
+
+def _classify(existing, new):
+    """把新数据分为 (追加行掩码, 回补行掩码, 修正掩码)。new 已按日期排序去重。"""
+    n = len(existing)
+    last = existing.days[-1] if n else np.iinfo(np.int32).min
+    pos = np.minimum(np.searchsorted(existing.days, new.days), max(n - 1, 0))
+    found = (existing.days[pos] == new.days) if n else np.zeros(len(new), dtype=bool)
+    changed = np.zeros(len(new), dtype=bool)
+    for col in ("open", "high", "low", "close", "volume"):
+        if n:
+            changed |= getattr(existing, col)[pos] != getattr(new, col)
+    return new.days > last, ~found & (new.days <= last), found & changed
+
+
+def _publish(symbol: str, name: str, data: bytes, base: str = None) -> str:
+    """原子写入 CSV；文件被占用（如 Excel 打开）时改写到 *_补全.csv。返回实际路径。"""
+    path = csv_path(symbol, name)
     try:
-        with open(path, "w", encoding="utf-8-sig") as f:
-            f.write("日期,开盘(元/吨),最高(元/吨),最低(元/吨),收盘(元/吨),成交量(手)\n")
-            for r in existing:
-                f.write(f"{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}\n")
+        publish_file(path, data, base=path if base else None)
     except OSError as e:
-        if e.errno == 13:  # Permission denied，可能文件被 Excel 打开
-            path = os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K_补全.csv")
-            with open(path, "w", encoding="utf-8-sig") as f:
-                f.write("日期,开盘(元/吨),最高(元/吨),最低(元/吨),收盘(元/吨),成交量(手)\n")
-                for r in existing:
-                    f.write(f"{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}\n")
-        else:
+        if e.errno != 13:  # Permission denied，可能文件被 Excel 打开
             raise
-    return path, len(existing), len(existing) - before
+        alt = os.path.join(DATA_DIR, f"{symbol}_{name}_历史日K_补全.csv")
+        publish_file(alt, data, base=path if base else None)
+        path = alt
+    return path
 
 
-def main():
-    print("补全 2024-07-18 之后数据（akshare 主力连续），与现有 CSV 合并\n")
+def merge_and_save(symbol: str, name: str, existing, fetched: Bars):
+    """把新数据（仅日期 > CUTOFF_DATE）并入已有 CSV，返回 (路径, 合计条数, 新增条数)。
+
+    只有晚于现有最后日期的新行时，仅把这些行追加到文件末尾；出现回补（中间缺失的日期）
+    或修正（同一日期数值变化）时才整表重写。两种方式都经临时文件原子替换发布。
+    """
+    before = len(existing)
+    path = csv_path(symbol, name)
+    new = merge_bars(rows_to_bars([]), fetched.take(fetched.days > date_to_day(CUTOFF_DATE)))
+    ordered = before < 2 or bool(np.all(np.diff(existing.days) > 0))
+    if not len(new):
+        return path, before, 0
+    append, backfill, corrected = _classify(existing, new)
+    if ordered and before and not backfill.any() and not corrected.any():
+        if not append.any():
+            return path, before, 0
+        tail = new.take(append)
+        path = _publish(symbol, name, format_csv_lines(tail).encode("utf-8"), base=path)
+        if path == csv_path(symbol, name):
+            record_meta(symbol, name, before + len(tail), existing.dates[0], tail.dates[-1])
+        return path, before + len(tail), len(tail)
+    if corrected.any():
+        # 同日数值以新数据为准：先把修正写回已有数据，再并入其余新行
+        pos = np.searchsorted(existing.days, new.days[corrected])
+        cols = {k: getattr(existing, k).copy() for k in ("open", "high", "low", "close", "volume")}
+        for k, col in cols.items():
+            col[pos] = getattr(new, k)[corrected]
+        existing = Bars(existing.days, cols["open"], cols["high"], cols["low"], cols["close"], cols["volume"])
+    merged = merge_bars(existing, new)
+    path = _publish(symbol, name, (CSV_HEADER + format_csv_lines(merged)).encode("utf-8-sig"))
+    if path == csv_path(symbol, name):
+        record_bars_meta(symbol, name, merged)
+    return path, len(merged), len(merged) - before
+
+
+def main(cache_mode: str = FETCH_CACHE_MODE, workers: int = FETCH_WORKERS, full: bool = False, on_symbol=None):
+    """并发补全各品种：每个品种从已存最后日期的次日起拉取（full=True 时从 SUPPLEMENT_START_DATE 起），
+    akshare 结果经本地缓存，与上次已合并的内容相同、且 CSV 此后未被改写（如 fetch 步骤整表重写）时不读 CSV、不写盘。
+
+    on_symbol(symbol, result, stat) 在每个品种完成时于调用线程回调（供后台任务上报进度）；
+    result 为 (起始日期, None 表示无变化 | (原有条数, 新增条数, 合计条数, 路径))，失败时为 None。
+    """
+    print("补全 2024-07-18 之后数据（akshare 主力连续，增量），与现有 CSV 合并\n")
     os.makedirs(DATA_DIR, exist_ok=True)
-    for symbol, name in SYMBOLS.items():
-        print(f"{name} ({symbol})")
-        try:
-            existing = load_existing_csv(symbol, name)
-            before = len(existing)
-            new_rows = fetch_akshare_from(symbol, SUPPLEMENT_START_DATE)
-            path, total, added = merge_and_save(symbol, name, existing, new_rows)
-            print(f"  原有 {before} 条，新增 {added} 条，合计 {total} 条 -> {path}\n")
-        except Exception as e:
-            print(f"  失败: {e}\n")
-        time.sleep(0.5)
+    cache = ResponseCache(mode=cache_mode)
+
+    def job(symbol):
+        name = SYMBOLS[symbol]
+        start = SUPPLEMENT_START_DATE if full else start_date_for(symbol, name)
+        resp = fetch_akshare_cached(symbol, start, cache)
+        if not resp.changed and resp.target == csv_version(symbol, name):
+            return start, None
+        existing = load_existing_csv(symbol, name)
+        path, total, added = merge_and_save(symbol, name, existing, cached_bars(resp))
+        cache.commit(resp, csv_version(symbol, name))
+        return start, (len(existing), added, total, path)
+
+    def report(symbol, result, stat):
+        head = f"{SYMBOLS[symbol]} ({symbol}) [{stat.seconds:.2f}s, {stat.attempts} 次]"
+        if not stat.ok:
+            print(f"{head}\n  失败: {stat.error}\n")
+        elif result[1] is None:
+            print(f"{head}\n  自 {result[0]} 起无变化，跳过\n")
+        else:
+            before, added, total, path = result[1]
+            print(f"{head}\n  自 {result[0]} 起：原有 {before} 条，新增 {added} 条，合计 {total} 条 -> {path}\n")
+        if on_symbol is not None:
+            on_symbol(symbol, result, stat)
+
+    t0 = time.perf_counter()
+    results = run_parallel(SYMBOLS, job, workers=workers, limiter=TokenBucket(FETCH_RATE),
+                           retry_on=(OSError, ValueError), on_done=report)
+    print(summarize([stat for _, _, stat in results], time.perf_counter() - t0))
     print("补全完成。")
 
 
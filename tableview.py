@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+期货日K线数据系统 - 数据表查询
+直接在共享列式缓存（datastore.Bars）上排序、筛选、分页，不再每次请求把全部行构造成 Python 列表：
+- 各列的排序下标按数据版本缓存（随 Bars 实例一起失效），筛选后的视图按查询条件做小容量 LRU 缓存；
+- 翻页只对本页下标取值并转成行，单页代价与页大小成正比；
+- 游标为上一页首 / 末行的日期：数据追加新行后，已翻过的位置不会错位。
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import TABLE_VIEW_CACHE
+from datastore import Bars, date_to_day
+
+# 可排序 / 筛选的列：日期、开高低收、成交量、MA20、涨跌幅(%)
+COLUMNS = ("date", "open", "high", "low", "close", "volume", "ma20", "chg")
+
+_lock = threading.Lock()
+
+
+def _change_pct(bars: Bars) -> np.ndarray:
+    """涨跌幅(%)：相对前一根收盘，首根及前收盘为 0 的为 NaN。"""
+    pct = np.full(len(bars), np.nan)
+    if len(bars) > 1:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct[1:] = (bars.close[1:] / bars.close[:-1] - 1.0) * 100.0
+        pct[~np.isfinite(pct)] = np.nan
+    return pct
+
+
+def column(bars: Bars, name: str) -> np.ndarray:
+    """按列名取数组；日期列为天数。"""
+    if name == "date":
+        return bars.days
+    if name == "ma20":
+        return bars.ma20
+    if name == "chg":
+        return bars.memo("chg", _change_pct)
+    return getattr(bars, name)
+
+
+def sort_order(bars: Bars, name: str, desc: bool = False) -> np.ndarray:
+    """按某列排序的下标（同值按日期升序 / 降序，NaN 始终排在最后），按数据版本缓存。"""
+    def build(b):
+        order = np.lexsort((b.days, column(b, name)))
+        if not desc:
+            return order
+        nan = int(np.count_nonzero(np.isnan(column(b, name)))) if name in ("ma20", "chg") else 0
+        valid = order[:len(order) - nan]
+        return np.concatenate([valid[::-1], order[len(order) - nan:]])
+
+    return bars.memo(("order", name, desc), build)
+
+
+def _build_view(bars: Bars, sort: str, desc: bool, filters: tuple):
+    """返回 (视图下标, 各行在视图中的位置)。位置数组用于游标定位，不在视图中的行为 -1。"""
+    order = sort_order(bars, sort, desc)
+    if filters:
+        keep = np.ones(len(bars), dtype=bool)
+        for name, lo, hi in filters:
+            values = column(bars, name)
+            if lo is not None:
+                keep &= values >= lo
+            if hi is not None:
+                keep &= values <= hi
+        order = order[keep[order]]
+    pos = np.full(len(bars), -1, dtype=np.int64)
+    pos[order] = np.arange(len(order))
+    return order, pos
+
+
+def table_view(bars: Bars, sort: str = "date", desc: bool = False, filters: tuple = ()):
+    """某排序 + 筛选条件下的视图（见 _build_view），按条件缓存在该 Bars 上（LRU，最多 TABLE_VIEW_CACHE 个）。
+
+    filters 为 ((列名, 下限, 上限), ...)，上下限含端点、可为 None；日期列的上下限为天数。
+    """
+    key = (sort, desc, filters)
+    views = bars.memo("table_views", lambda b: OrderedDict())
+    with _lock:
+        hit = views.get(key)
+        if hit is not None:
+            views.move_to_end(key)
+            return hit
+    view = _build_view(bars, sort, desc, filters)
+    with _lock:
+        views[key] = view
+        while len(views) > TABLE_VIEW_CACHE:
+            views.popitem(last=False)
+    return view
+
+
+def table_rows(bars: Bars, index) -> list:
+    """按下标取行：每行 [日期, 开, 高, 低, 收, 量, MA20, 涨跌幅(%)]，缺失值为空串。"""
+    index = np.asarray(index, dtype=np.int64)
+    dates = np.datetime_as_string(bars.days[index].astype("datetime64[D]"), unit="D").tolist()
+    cols = [bars.open[index].round(2).tolist(), bars.high[index].round(2).tolist(),
+            bars.low[index].round(2).tolist(), bars.close[index].round(2).tolist(),
+            bars.volume[index].tolist()]
+    ma = bars.ma20[index].round(2).tolist()
+    chg = column(bars, "chg")[index].round(2).tolist()
+    return [[d, o, h, lo, c, v, "" if m != m else m, "" if p != p else p]
+            for d, o, h, lo, c, v, m, p in zip(dates, *cols, ma, chg)]
+
+
+def _cursor_pos(bars: Bars, pos: np.ndarray, cursor: str) -> int:
+    """游标日期在视图中的位置；该行已不在视图中（数据变化）时抛 LookupError。"""
+    day = date_to_day(cursor)
+    i = int(np.searchsorted(bars.days, day))
+    if i >= len(bars) or bars.days[i] != day or pos[i] < 0:
+        raise LookupError(cursor)
+    return int(pos[i])
+
+
+def query_page(bars: Bars, size: int, sort: str = "date", desc: bool = False, filters: tuple = (),
+               after: str = None, before: str = None, page: int = 1) -> dict:
+    """取一页：after=游标 取其后一页，before=游标 取其前一页，都未给出时按 page（从 1 起）取。
+
+    返回 { total, offset, rows, prev, next }：offset 为本页首行在视图中的位置，prev / next 为前后翻页的游标（无则为 None）。
+    """
+    order, pos = table_view(bars, sort, desc, filters)
+    total = len(order)
+    if after:
+        a = _cursor_pos(bars, pos, after) + 1
+    elif before:
+        a = max(0, _cursor_pos(bars, pos, before) - size)
+    else:
+        a = (max(1, page) - 1) * size
+    a = min(a, total)
+    b = min(a + size, total)
+    index = order[a:b]
+    rows = table_rows(bars, index)
+    return {
+        "total": total,
+        "offset": a,
+        "rows": rows,
+        "prev": rows[0][0] if a > 0 and rows else None,
+        "next": rows[-1][0] if b < total and rows else None,
+    }
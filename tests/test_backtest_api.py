@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""单品种回测 / 参数扫描 / 滚动前推接口的参数校验：params、ranges 类型不对时返回 400 与说明。
+
+用法：python -m unittest discover tests（或 python -m pytest tests）
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import app  # noqa: E402
+
+
+class BacktestApiTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def post(self, path, body):
+        r = self.client.post(path, json=body)
+        return r.status_code, r.get_json()
+
+    def test_params_must_be_dict(self):
+        for params in ("x", [20], 20):
+            with self.subTest(params=params):
+                code, out = self.post("/api/backtest", {"symbol": "C0", "strategy": "boll", "params": params})
+                self.assertEqual(code, 400)
+                self.assertIn("params", out["error"])
+
+    def test_ranges_must_be_dict(self):
+        for path in ("/api/backtest/optimize", "/api/backtest/walkforward"):
+            for ranges in ("oops", ["period"], 5):
+                with self.subTest(path=path, ranges=ranges):
+                    code, out = self.post(path, {"symbol": "C0", "strategy": "boll", "ranges": ranges})
+                    self.assertEqual(code, 400)
+                    self.assertIn("ranges", out["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""数据接口的条件 GET：同一 URL 带 If-None-Match 命中时返回 304；查询参数不同（或顺序不同但等价）时 ETag 随之区分。
+
+用法：python -m unittest discover tests（或 python -m pytest tests）
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import app  # noqa: E402
+from config import SYMBOL_LIST  # noqa: E402
+from datastore import get_bars  # noqa: E402
+
+
+class ConditionalGetTest(unittest.TestCase):
+    def setUp(self):
+        self.code, name = SYMBOL_LIST[0]
+        if get_bars(self.code, name) is None:
+            self.skipTest("data/ 下没有行情")
+        self.client = app.test_client()
+
+    def get(self, query, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(f"/api/kline/{self.code}?{query}", headers=headers)
+
+    def test_query_in_etag(self):
+        a = self.get("start=2020-01-01")
+        b = self.get("start=2021-01-01")
+        self.assertEqual((a.status_code, b.status_code), (200, 200))
+        self.assertNotEqual(a.headers["ETag"], b.headers["ETag"])
+        self.assertEqual(self.get("start=2021-01-01", a.headers["ETag"]).status_code, 200)
+        self.assertEqual(self.get("start=2020-01-01", a.headers["ETag"]).status_code, 304)
+
+    def test_param_order_ignored(self):
+        a = self.get("start=2020-01-01&end=2021-01-01")
+        b = self.get("end=2021-01-01&start=2020-01-01")
+        self.assertEqual(a.headers["ETag"], b.headers["ETag"])
+
+
+if __name__ == "__main__":
+    unittest.main()
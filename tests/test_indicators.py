@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""指标一致性测试：向量化实现（indicators.py / backtest.py 策略）对比原逐根循环（scripts/bench_indicators.py 的 legacy_*）。
+
+SMA / EMA 须逐位相同，四个策略在多组参数下的信号须完全相同；装没装 scipy（lfilter / 逐点递推）两条路径都测。
+数据为合成的整数价 / 0.5 跳价随机游走，以及 data/ 下已有的真实日K。
+
+用法：python -m unittest discover tests（或 python -m pytest tests）
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "scripts")]
+
+import indicators  # noqa: E402
+from backtest import STRATEGIES, _kd  # noqa: E402
+from bench_indicators import LEGACY, PARAM_SETS, legacy_ema, legacy_sma, run_strategy, synthetic  # noqa: E402
+from config import SYMBOL_LIST  # noqa: E402
+from datastore import get_bars  # noqa: E402
+
+
+def datasets():
+    """(名称, highs, lows, closes) 列表：两组合成数据 + 各品种真实日K（没有数据的品种跳过）。"""
+    out = []
+    for tick in (1.0, 0.5):
+        _, highs, lows, closes = synthetic(3000, tick)
+        out.append((f"合成(跳价 {tick})", highs, lows, closes))
+    for code, name in SYMBOL_LIST:
+        bars = get_bars(code, name)
+        if bars is not None and len(bars):
+            out.append((code, bars.high.tolist(), bars.low.tolist(), bars.close.tolist()))
+    return out
+
+
+class IndicatorParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = datasets()
+
+    def paths(self):
+        """依次在 lfilter（若已安装）与逐点递推两条路径下运行。"""
+        yield "lfilter" if indicators.lfilter is not None else "逐点递推"
+        if indicators.lfilter is not None:
+            with mock.patch.object(indicators, "lfilter", None):
+                yield "逐点递推"
+
+    def test_sma(self):
+        for label, _, _, closes in self.data:
+            for p in (1, 5, 20, 60):
+                with self.subTest(data=label, period=p):
+                    old = np.array([np.nan if v is None else v for v in legacy_sma(closes, p)])
+                    np.testing.assert_array_equal(indicators.sma(closes, p), old)
+
+    def test_ema(self):
+        for path in self.paths():
+            for label, _, _, closes in self.data:
+                for p in (2, 9, 12, 26):
+                    with self.subTest(path=path, data=label, period=p):
+                        np.testing.assert_array_equal(indicators.ema(closes, p), np.array(legacy_ema(closes, p)))
+            self.assertEqual(len(indicators.ema([], 5)), 0)
+            np.testing.assert_array_equal(indicators.ema([3.0], 5), [3.0])
+
+    def test_kd(self):
+        rsv = np.random.default_rng(3).random(2000) * 100
+        kv, dv = [50.0] * len(rsv), [50.0] * len(rsv)
+        for i in range(9, len(rsv)):
+            kv[i] = (2 * kv[i - 1] + rsv[i]) / 3
+            dv[i] = (2 * dv[i - 1] + kv[i]) / 3
+        for path in self.paths():
+            with self.subTest(path=path):
+                k, d = _kd(rsv, 9)
+                np.testing.assert_allclose(k, kv, rtol=0, atol=1e-9)
+                np.testing.assert_allclose(d, dv, rtol=0, atol=1e-9)
+                np.testing.assert_array_equal(k[:9], 50.0)
+
+    def test_signals(self):
+        for path in self.paths():
+            for label, highs, lows, closes in self.data:
+                for key, cfg in STRATEGIES.items():
+                    for params in PARAM_SETS[key]:
+                        with self.subTest(path=path, data=label, strategy=key, params=params):
+                            new = run_strategy(cfg["fn"], key, params, highs, lows, closes)
+                            old = run_strategy(LEGACY[key], key, params, highs, lows, closes)
+                            self.assertEqual(new.tolist(), old)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""组合回测的资金池：额度生效时，PortfolioEngine 与逐根、逐腿循环的参照实现逐日权益与每笔手数一致，
+且每次开仓时全部持仓的合约价值不超过组合权益。（额度不起作用时与各腿独立回测之和相同，见 scripts/bench_portfolio.py。）
+
+用法：python -m unittest discover tests（或 python -m pytest tests）
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "scripts")]
+
+from bench_portfolio import STRATEGY_KEYS, synthetic_universe  # noqa: E402
+from portfolio import PortfolioEngine  # noqa: E402
+
+
+def reference(pe: PortfolioEngine, specs, capital, lots=1, commission=5, allocation="fixed"):
+    """逐根循环：返回 (逐日权益, [(腿, 开仓列, 手数), ...], 额度是否起过作用)。规则见 portfolio 模块说明。"""
+    legs = [pe.leg(spec, lots) for spec in specs]
+    have, opens, closes, sig = pe.matrices(legs)
+    m, n = have.shape
+    multi = [leg["multiplier"] for leg in legs]
+    w = [1.0 if allocation == "equal" else leg["weight"] for leg in legs]
+    end = [int(np.flatnonzero(have[r])[-1]) for r in range(m)]
+    fill = [[next((j for j in range(c + 1, n) if have[r, j]), None) for c in range(n)] for r in range(m)]
+    cash, held, cost, long = float(capital), [0.0] * m, [0.0] * m, [False] * m
+    values, entries, bound = [], [], False
+    for c in range(n):
+        mark = [held[r] * closes[r, c] * multi[r] if held[r] else 0.0 for r in range(m)]
+        equity = cash + sum(mark[r] - held[r] * cost[r] * multi[r] for r in range(m) if held[r])
+        sells = [r for r in range(m) if long[r] and c <= end[r] and sig[r, c] == -1]
+        committed = sum(mark[r] for r in range(m) if r not in sells)
+        for r in sells:
+            if held[r]:
+                px = opens[r, fill[r][c]]
+                cash += (px - cost[r]) * multi[r] * held[r] - commission * held[r]
+            held[r], long[r] = 0.0, False
+        for r in range(m):
+            if sig[r, c] == 1 and not long[r] and c < end[r]:
+                long[r] = True
+                px = opens[r, fill[r][c]]
+                unit = px * multi[r]
+                want = legs[r]["lots"] if allocation == "fixed" else equity * w[r] / sum(w) / unit
+                q = max(float(np.floor(min(want, (equity - committed) / unit))), 0.0)
+                bound |= q < want // 1
+                if q:
+                    held[r], cost[r] = q, px
+                    committed += q * unit
+                    cash -= commission * q
+                    entries.append((r, c, q))
+        for r in range(m):
+            if c == end[r] and long[r]:
+                if held[r]:
+                    cash += (closes[r, c] - cost[r]) * multi[r] * held[r] - commission * held[r]
+                held[r], long[r] = 0.0, False
+        values.append(cash + sum((closes[r, c] - cost[r]) * multi[r] * held[r] for r in range(m) if held[r]))
+    return np.array(values), entries, bound
+
+
+class PortfolioPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.universe = synthetic_universe(6, 1500)
+        cls.engine = PortfolioEngine(cls.universe)
+        cls.specs = [{"symbol": s, "strategy": STRATEGY_KEYS[i % 4]} for i, s in enumerate(cls.universe)]
+
+    def check(self, capital, allocation, lots=1, bound=False):
+        r = self.engine.run(self.specs, capital=capital, lots=lots, allocation=allocation)
+        values, entries, limited = reference(self.engine, self.specs, capital, lots, allocation=allocation)
+        if bound:
+            self.assertTrue(limited, "额度未起作用，测试数据需调整")
+        np.testing.assert_allclose([e["value"] for e in r["equity"]], values, rtol=0, atol=0.01)
+        symbols = list(self.universe)
+        got = sorted((symbols.index(t["symbol"]), t["entry_date"], t["lots"]) for t in r["trades"])
+        dates = self.engine.dates
+        want = sorted((leg, dates[next(j for j in range(c + 1, self.engine.n)
+                                       if self.engine._index[symbols[leg]][j] >= 0)], int(q))
+                      for leg, c, q in entries)
+        self.assertEqual(got, want)
+
+    def test_fixed_lots_limited_by_pool(self):
+        # 每手约 3 万元合约价值，6 腿各 2 手远超 10 万元
+        self.check(100000, "fixed", lots=2, bound=True)
+
+    def test_equal_budget_from_current_equity(self):
+        # 等分的是开仓时的组合权益（不是初始资金）
+        self.check(150000, "equal")
+
+    def test_weight_budget(self):
+        for spec, wt in zip(self.specs, (3, 1, 1, 2, 1, 1)):
+            spec["weight"] = wt
+        try:
+            self.check(120000, "weight")
+        finally:
+            for spec in self.specs:
+                spec.pop("weight")
+
+
+if __name__ == "__main__":
+    unittest.main()
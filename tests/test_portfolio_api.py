@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""组合回测接口 POST /api/backtest/portfolio 的参数校验：symbols / params 类型不对、品种未知时返回 400 与说明。
+
+用法：python -m unittest discover tests（或 python -m pytest tests）
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import app  # noqa: E402
+from config import SYMBOL_LIST  # noqa: E402
+from datastore import get_bars  # noqa: E402
+
+
+class PortfolioApiTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def post(self, body):
+        r = self.client.post("/api/backtest/portfolio", json=body)
+        return r.status_code, r.get_json()
+
+    def test_symbols_must_be_list(self):
+        for symbols in ("C0", {"C0": 1}, [1, 2], ["C0", None]):
+            with self.subTest(symbols=symbols):
+                code, body = self.post({"symbols": symbols})
+                self.assertEqual(code, 400)
+                self.assertIn("symbols", body["error"])
+
+    def test_unknown_symbol(self):
+        code, body = self.post({"symbols": ["C0", "NOPE"]})
+        self.assertEqual(code, 400)
+        self.assertIn("NOPE", body["error"])
+
+    def test_params_must_be_dict(self):
+        for body in ({"symbols": ["C0"], "params": "x"},
+                     {"legs": [{"symbol": "C0", "params": "x"}]},
+                     {"legs": [{"symbol": "C0", "params": [20]}]}):
+            with self.subTest(body=body):
+                code, out = self.post(body)
+                self.assertEqual(code, 400)
+                self.assertIn("params", out["error"])
+
+    def test_valid_request(self):
+        code0, name0 = SYMBOL_LIST[0]
+        bars = get_bars(code0, name0)
+        if bars is None or len(bars) < 30:
+            self.skipTest("data/ 下没有行情")
+        code, body = self.post({"symbols": [code0], "strategy": "boll", "params": {"period": 20}})
+        self.assertEqual(code, 200, body)
+        self.assertEqual([leg["symbol"] for leg in body["legs"]], [code0])
+
+
+if __name__ == "__main__":
+    unittest.main()